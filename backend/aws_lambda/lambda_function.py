@@ -1,15 +1,54 @@
-import base64
+import io
 import json
 import logging
 import os
+import time
 
+import numpy as np
+
+from common.caching import get_frame_cache, get_result_cache
+from common.features import SUPPORTED_SAMPLE_RATE, featurize_file_block
+from common.jobs import (
+    DEFAULT_JOB_TIMEOUT_SECONDS,
+    DEFAULT_JOB_TTL_SECONDS,
+    get_job_store,
+    run_job,
+)
 from common.predictions import get_prediction_service
-from common.recognition import recognize_saved_file
-from common.utilities import KnownRequestParseError, extract_file_from_http_request
+from common.recognition import recognize_saved_file, resolve_analysis_profile
+from common.tracing import end_trace, get_trace_aggregator, start_trace, trace_stage
+from common.utilities import (
+    KnownRequestParseError,
+    decode_base64_body,
+    extract_file_from_http_request,
+    parse_alternatives_count,
+)
 
 
 logger = None
 
+# Duration of the synthetic recording featurized during warm-up.
+WARMUP_SIGNAL_SECONDS = 2
+
+# Created once per container so that results are reused across warm invocations.
+result_cache = get_result_cache()
+frame_cache = get_frame_cache()
+
+# Asynchronous jobs require a store shared by all containers, e.g. a directory on an EFS mount.
+job_store = get_job_store()
+
+# Per-stage latencies of all invocations of the container, when tracing is enabled.
+trace_aggregator = get_trace_aggregator()
+
+# Prediction service reused across warm invocations, along with the key it was created for.
+prediction_service = None
+prediction_service_key = None
+
+# Container lifecycle timings for the cold vs. warm invocation logs.
+init_seconds = 0.0
+cold_invocation_seconds = None
+invocation_count = 0
+
 
 def setup_logging():
     global logger
@@ -20,11 +59,93 @@ def setup_logging():
     logger = logging.getLogger()
 
 
-def serve_ok(result_obj):
+def get_container_prediction_service():
+    global prediction_service, prediction_service_key
+    service_key = os.environ['DECHORDER_PREDICTION_SERVICE']
+    if not prediction_service or service_key != prediction_service_key:
+        logger.info(f'Creating prediction service: {service_key}')
+        prediction_service = get_prediction_service(service_key)
+        prediction_service_key = service_key
+    return prediction_service
+
+
+def run_warmup(service):
+    # Featurize and recognize a short synthetic recording, so that lazily initialized
+    # decoder, STFT and model code paths are ready before the first real request.
+    import soundfile
+
+    time_points = np.arange(WARMUP_SIGNAL_SECONDS * SUPPORTED_SAMPLE_RATE) / SUPPORTED_SAMPLE_RATE
+    signal = 0.5 * np.sin(2 * np.pi * 440.0 * time_points).astype(np.float32)
+    buffer = io.BytesIO()
+    soundfile.write(buffer, signal, SUPPORTED_SAMPLE_RATE, format='WAV')
+
+    features = featurize_file_block(buffer.getvalue(), profile=resolve_analysis_profile(service))
+    service.predict(features.features)
+
+
+def initialize_container():
+    """
+    Prepare the container for invocations. Runs once, at import time:
+
+    * DECHORDER_PRELOAD_MODEL: set to 1 to create the prediction service and load its model.
+    * DECHORDER_WARMUP: set to 1 to also run a tiny featurization and prediction.
+    """
+    global init_seconds
+    start_time = time.perf_counter()
+    setup_logging()
+
+    is_preload_requested = os.environ.get('DECHORDER_PRELOAD_MODEL') == '1'
+    if os.environ.get('DECHORDER_PREDICTION_SERVICE') and is_preload_requested:
+        service = get_container_prediction_service()
+        service.preload()
+        if os.environ.get('DECHORDER_WARMUP') == '1':
+            try:
+                run_warmup(service)
+            except Exception:
+                logger.warning('Warm-up failed, continuing without it', exc_info=True)
+
+    init_seconds = time.perf_counter() - start_time
+    logger.info(f'Container initialized in {init_seconds:.3f} seconds')
+
+
+def log_invocation_time(invocation_seconds):
+    global cold_invocation_seconds, invocation_count
+    invocation_count += 1
+    if cold_invocation_seconds is None:
+        cold_invocation_seconds = invocation_seconds
+        logger.info(
+            f'Cold invocation finished in {invocation_seconds:.3f} seconds '
+            f'(plus {init_seconds:.3f} seconds of container init)'
+        )
+    else:
+        logger.info(
+            f'Warm invocation #{invocation_count} finished in {invocation_seconds:.3f} seconds '
+            f'(cold invocation took {cold_invocation_seconds:.3f} seconds)'
+        )
+
+
+def log_trace(trace, context):
+    # A single JSON line, so that the stage timings can be queried with CloudWatch Logs Insights.
+    trace_aggregator.add(trace)
+    container_stats = trace_aggregator.get_stats()[trace.name]
+    log_fields = {
+        'requestId': getattr(context, 'aws_request_id', None),
+        **trace.to_log_fields(),
+        'containerRequests': container_stats['requests'],
+        'containerMeanMs': {
+            name: round(stats['meanMs'], 3) for name, stats in container_stats['stages'].items()
+        },
+    }
+    logger.info(f'Trace: {json.dumps(log_fields)}')
+
+
+def serve_ok(result_obj, status_code=200):
+    with trace_stage('serialize'):
+        body = json.dumps(result_obj)
     return {
-        'statusCode': 200,
+        'statusCode': status_code,
         'headers': {'Content-Type': 'application/json'},
-        'body': json.dumps(result_obj),
+        'body': body,
     }
 
 
@@ -36,24 +157,133 @@ def serve_error(message, status_code=500):
     }
 
 
-def lambda_handler(event, context):
-    try:
-        setup_logging()
-        logger.info('Lambda handler started')
+def get_recognition_options():
+    return {
+        'streaming': os.environ.get('DECHORDER_STREAMING_FEATURIZATION') == '1',
+        'change_threshold': float(os.environ.get('DECHORDER_CHANGE_THRESHOLD', 0)),
+        'cache': result_cache,
+        'frame_cache': frame_cache,
+    }
+
 
+def extract_uploaded_file(event, upload_dir=None):
+    with trace_stage('upload'):
         headers = event['headers']
-        body = base64.b64decode(event['body'])
+        body = decode_base64_body(event['body'])
         request_id = event['requestContext']['requestId']
-        upload_dir = '/tmp'
         logger.info(f'Request ID: {request_id}. Body length: {len(body)} bytes')
+        return extract_file_from_http_request(headers, body, upload_dir, request_id)
 
-        uploaded_file = extract_file_from_http_request(headers, body, upload_dir, request_id)
-        prediction_service = get_prediction_service(os.environ['DECHORDER_PREDICTION_SERVICE'])
-        result = recognize_saved_file(uploaded_file.stored_filename, prediction_service)
-        os.remove(uploaded_file.stored_filename)
 
-        logger.info(f'Recognition successful, returning {len(result)} records')
-        return serve_ok(result)
+def get_alternatives_count(event):
+    query_params = event.get('queryStringParameters') or {}
+    return parse_alternatives_count(query_params.get('alternatives'))
+
+
+def get_analysis_profile_name(event):
+    query_params = event.get('queryStringParameters') or {}
+    return query_params.get('profile') or None
+
+
+def dispatch_job(job_id, context, top_k=0, analysis_profile=None):
+    # Invoke this function asynchronously so that the API response is not blocked by recognition.
+    import boto3
+    payload = {
+        'dechorderJobId': job_id,
+        'dechorderAlternatives': top_k,
+        'dechorderAnalysisProfile': analysis_profile,
+    }
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8'),
+    )
+
+
+def handle_recognize(event):
+    # The upload is decoded from memory, so that recognition does not use up the limited /tmp space.
+    top_k = get_alternatives_count(event)
+    analysis_profile = get_analysis_profile_name(event)
+    uploaded_file = extract_uploaded_file(event)
+    service = get_container_prediction_service()
+    result = recognize_saved_file(
+        uploaded_file.source,
+        service,
+        top_k=top_k,
+        analysis_profile=analysis_profile,
+        **get_recognition_options(),
+    )
+
+    logger.info(f'Recognition successful, returning {len(result)} records')
+    return serve_ok(result)
+
+
+def handle_create_job(event, context):
+    ttl_seconds = int(os.environ.get('DECHORDER_JOB_TTL_SECONDS', DEFAULT_JOB_TTL_SECONDS))
+    timeout_seconds = int(os.environ.get(
+        'DECHORDER_JOB_TIMEOUT_SECONDS',
+        DEFAULT_JOB_TIMEOUT_SECONDS,
+    ))
+    job_store.purge_expired(ttl_seconds, timeout_seconds)
+
+    top_k = get_alternatives_count(event)
+    analysis_profile = get_analysis_profile_name(event)
+    # Reject an unknown or mismatching profile now rather than in the job.
+    resolve_analysis_profile(get_container_prediction_service(), analysis_profile)
+
+    uploaded_file = extract_uploaded_file(event, upload_dir='/tmp')
+    job = job_store.create_job(uploaded_file.original_filename, uploaded_file.stored_filename)
+    dispatch_job(job.job_id, context, top_k, analysis_profile)
+
+    logger.info(f'Job {job.job_id} submitted')
+    return serve_ok(job.to_dict(), status_code=202)
+
+
+def handle_get_job(event):
+    job_id = event['pathParameters']['jobId']
+    job = job_store.get_job(job_id)
+    if not job:
+        return serve_error(f'Job {job_id} does not exist or has expired', 404)
+    return serve_ok(job.to_dict())
+
+
+def handle_run_job(event):
+    if not job_store:
+        # The job store was configured when the job was created, but not in this container.
+        logger.error(f'Cannot run job {event["dechorderJobId"]}: asynchronous jobs are disabled')
+        return {'jobId': event['dechorderJobId'], 'error': 'Asynchronous jobs are disabled'}
+
+    service = get_container_prediction_service()
+    run_job(
+        job_store,
+        event['dechorderJobId'],
+        service,
+        top_k=event.get('dechorderAlternatives', 0),
+        analysis_profile=event.get('dechorderAnalysisProfile'),
+        **get_recognition_options(),
+    )
+    return {'jobId': event['dechorderJobId']}
+
+
+def lambda_handler(event, context):
+    start_time = time.perf_counter()
+    trace, trace_token = start_trace() if trace_aggregator else (None, None)
+    try:
+        logger.info('Lambda handler started')
+
+        # Asynchronous invocation for a job created by a POST /jobs request.
+        if 'dechorderJobId' in event:
+            return handle_run_job(event)
+
+        resource = event.get('resource') or ''
+        if resource.endswith('/jobs') or resource.endswith('/jobs/{jobId}'):
+            if not job_store:
+                return serve_error('Asynchronous jobs are disabled', 404)
+            if event.get('httpMethod') == 'GET':
+                return handle_get_job(event)
+            return handle_create_job(event, context)
+
+        return handle_recognize(event)
 
     except KnownRequestParseError as e:
         logger.info(f'Recognition failed, returning user error: {str(e)}')
@@ -62,3 +292,12 @@ def lambda_handler(event, context):
     except Exception as e:
         logger.info(f'Recognition failed, returning internal error: {str(e)}')
         return serve_error(str(e), 500)
+
+    finally:
+        log_invocation_time(time.perf_counter() - start_time)
+        if trace:
+            log_trace(trace, context)
+            end_trace(trace_token)
+
+
+initialize_container()
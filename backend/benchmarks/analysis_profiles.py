@@ -0,0 +1,124 @@
+"""
+Standalone usage: analysis_profiles.py [-h] [--repeat REPEAT] FILE [FILE ...]
+
+Compare the analysis profiles: featurization latency per minute of audio, and chord accuracy on
+labeled recordings. Each audio file must have a corresponding .labels file (see data/rendered).
+
+Accuracy is measured on the mean chroma of each labeled segment, the same way
+data/rendered/featurize.py builds the training dataset:
+  - mlp: an MLP with the hyperparameters of the embedded model, trained on the other recordings
+    and evaluated on the held-out one (leave-one-recording-out). Requires scikit-learn.
+  - template: the template-matching prediction service, which needs no training.
+
+positional arguments:
+  FILE                     labeled audio files
+
+optional arguments:
+  --repeat REPEAT          (optional) number of times to featurize each file (default: 3)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/analysis_profiles.py /project-root/data/rendered/*.mp3
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from common.features import ANALYSIS_PROFILES, compute_frame_features
+from common.predictions.embedded import create_classifier
+from common.predictions.template import TemplatePredictionService
+
+
+def measure_featurization(filename, profile, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        frame_features = compute_frame_features(filename, profile=profile)
+        timings.append(time.perf_counter() - start_time)
+    return np.median(timings), frame_features
+
+
+def get_segment_features(frame_features, label_filename):
+    df_labels = pd.read_csv(label_filename)
+    features = []
+    for seconds_start, seconds_end in zip(df_labels['seconds_start'], df_labels['seconds_end']):
+        start_idx = int(np.round(seconds_start * frame_features.frames_per_second))
+        end_idx = int(np.round(seconds_end * frame_features.frames_per_second))
+        features.append(np.mean(frame_features.chroma[:, start_idx:end_idx], axis=1))
+    return np.array(features), df_labels['chord'].values
+
+
+def get_mlp_accuracy(recordings):
+    n_correct = 0
+    for held_out_idx, (features, labels) in enumerate(recordings):
+        training = [recording for idx, recording in enumerate(recordings) if idx != held_out_idx]
+        model = create_classifier()
+        model.fit(np.vstack([x for x, _ in training]), np.concatenate([y for _, y in training]))
+        n_correct += np.sum(model.predict(features) == labels)
+    return n_correct / sum(len(labels) for _, labels in recordings)
+
+
+def get_template_accuracy(recordings):
+    service = TemplatePredictionService()
+    features = np.vstack([x for x, _ in recordings])
+    labels = np.concatenate([y for _, y in recordings])
+    return np.mean(service.predict(features)['name'].values == labels)
+
+
+def parse_command_line_args(args):
+    program_desc = 'Compare featurization latency and accuracy of the analysis profiles'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('files', metavar='FILE', nargs='+', help='labeled audio files')
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=3,
+        help='number of times to featurize each file',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    label_filenames = [f'{os.path.splitext(filename)[0]}.labels' for filename in args.files]
+    missing_label_files = [filename for filename in label_filenames if not os.path.exists(filename)]
+    if missing_label_files:
+        sys.exit(f'Expected annotation files: {", ".join(missing_label_files)}')
+
+    header = f'{"profile":>8} | {"sr":>5} | {"n_fft":>5} | {"hop":>4}'
+    header += f' | {"ms/min":>7} | {"mlp acc.":>8} | {"template acc.":>12}'
+    print(header)
+    for name, profile in ANALYSIS_PROFILES.items():
+        total_seconds = 0
+        total_duration = 0
+        recordings = []
+        for filename, label_filename in zip(args.files, label_filenames):
+            seconds, frame_features = measure_featurization(filename, profile, args.repeat)
+            total_seconds += seconds
+            total_duration += frame_features.chroma.shape[1] / frame_features.frames_per_second
+            recordings.append(get_segment_features(frame_features, label_filename))
+
+        ms_per_minute = total_seconds * 1000 / (total_duration / 60)
+        mlp_accuracy = get_mlp_accuracy(recordings)
+        template_accuracy = get_template_accuracy(recordings)
+        print(
+            f'{name:>8} | {profile.sample_rate:>5} | {profile.n_fft:>5} | '
+            f'{profile.hop_length:>4} | {ms_per_minute:>7.1f} | {mlp_accuracy:>8.3f} | '
+            f'{template_accuracy:>12.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
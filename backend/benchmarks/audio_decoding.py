@@ -0,0 +1,138 @@
+"""
+Standalone usage: audio_decoding.py [-h] [--repeat REPEAT] FILE
+
+Compare the librosa and ffmpeg audio decoders: decode time per audio format, for a saved file and
+for in-memory content, and the RMS difference of the decoded signals. Formats a decoder cannot read
+show as nan.
+
+librosa decodes formats that libsndfile does not support (e.g. M4A) with audioread, which needs
+one of its backends (e.g. ffmpeg on PATH).
+
+The file is converted to several formats with ffmpeg first (WAV, FLAC, OGG, MP3, M4A).
+Requires ffmpeg on PATH or DECHORDER_FFMPEG_PATH.
+
+positional arguments:
+  FILE                     audio file to convert and decode
+
+optional arguments:
+  --repeat REPEAT          (optional) number of times to decode each file (default: 5)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/audio_decoding.py /project-root/data/rendered/major-minor-acoustic.mp3
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+
+from common.features import FFmpegAudioDecoder, LibrosaAudioDecoder, get_audio_decoder, load_audio
+from common.utilities import KnownRequestParseError
+
+
+FORMATS = ['wav', 'flac', 'ogg', 'mp3', 'm4a']
+
+
+def convert(ffmpeg_path, filename, output_dir, audio_format):
+    output_path = os.path.join(output_dir, f'audio.{audio_format}')
+    subprocess.run(
+        [
+            ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+            '-i', filename, '-vn', output_path,
+        ],
+        check=True,
+    )
+    return output_path
+
+
+def measure_decode_ms(source, decoder, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        try:
+            signal, _ = load_audio(source, decoder=decoder)
+        except KnownRequestParseError:
+            return np.nan, None
+        timings.append(time.perf_counter() - start_time)
+    return np.median(timings) * 1000, signal
+
+
+def get_rms_difference(signal, other_signal, max_lag=2048, window=2 ** 16):
+    # The decoders may disagree on the encoder delay by a few hundred samples, so align the signals
+    # by cross-correlating a window from the middle first.
+    start = min(len(signal), len(other_signal)) // 2
+    correlation = np.correlate(
+        other_signal[start - max_lag:start + window + max_lag],
+        signal[start:start + window],
+        mode='valid',
+    )
+    lag = int(np.argmax(correlation)) - max_lag
+    if lag > 0:
+        other_signal = other_signal[lag:]
+    else:
+        signal = signal[-lag:]
+
+    n_samples = min(len(signal), len(other_signal))
+    difference = signal[:n_samples] - other_signal[:n_samples]
+    return np.sqrt(np.mean(difference ** 2) / np.mean(signal[:n_samples] ** 2))
+
+
+def parse_command_line_args(args):
+    program_desc = 'Compare the librosa and ffmpeg audio decoders'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('file', metavar='FILE', help='audio file to convert and decode')
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=5,
+        help='number of times to decode each file',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.WARNING)
+
+    ffmpeg_decoder = get_audio_decoder(FFmpegAudioDecoder.name)
+    if not isinstance(ffmpeg_decoder, FFmpegAudioDecoder):
+        sys.exit('ffmpeg is not available')
+    decoders = [LibrosaAudioDecoder(), ffmpeg_decoder]
+
+    header = f'{"format":>6} | {"source":>6}'
+    header += ''.join(f' | {f"{decoder.name}, ms":>12}' for decoder in decoders)
+    header += f' | {"speedup":>7} | {"rel. RMS diff":>13}'
+    print(header)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for audio_format in FORMATS:
+            path = convert(ffmpeg_decoder.ffmpeg_path, args.file, output_dir, audio_format)
+            with open(path, 'rb') as fp:
+                content = fp.read()
+
+            for source_name, source in [('path', path), ('memory', content)]:
+                results = [measure_decode_ms(source, decoder, args.repeat) for decoder in decoders]
+                (librosa_ms, librosa_signal), (ffmpeg_ms, ffmpeg_signal) = results
+                if librosa_signal is None or ffmpeg_signal is None:
+                    rms_difference = np.nan
+                else:
+                    rms_difference = get_rms_difference(librosa_signal, ffmpeg_signal)
+                print(
+                    f'{audio_format:>6} | {source_name:>6} | '
+                    f'{librosa_ms:>12.1f} | {ffmpeg_ms:>12.1f} | '
+                    f'{librosa_ms / ffmpeg_ms:>6.1f}x | {rms_difference:>13.4f}'
+                )
+
+
+if __name__ == '__main__':
+    main()
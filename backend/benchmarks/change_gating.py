@@ -0,0 +1,96 @@
+"""
+Standalone usage: change_gating.py [-h] [--service SERVICE] [--thresholds THRESHOLDS]
+                         FILE [FILE ...]
+
+Compare recognition with change-point gating against full prediction of every non-silent chunk.
+
+For each file and change threshold, reports the number of predicted rows, the fraction of
+predictions skipped, the fraction of chunks whose chord differs from full prediction, and the number
+of chords in the final result (after repeating chords are removed).
+
+positional arguments:
+  FILE                     audio files to recognize
+
+optional arguments:
+  --service SERVICE        (optional) prediction service (default: EmbeddedPredictionService)
+  --thresholds THRESHOLDS  (optional) comma-separated change thresholds (default: 0.02,0.05,0.1)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/change_gating.py /project-root/data/rendered/*.mp3
+"""
+
+import argparse
+import logging
+import os
+import sys
+import warnings
+
+import numpy as np
+
+from common.features import featurize_file_block
+from common.predictions import get_prediction_service
+from common.recognition import (
+    get_segment_representatives,
+    postprocess_predictions,
+    predict_stable_segments,
+)
+
+
+def parse_command_line_args(args):
+    program_desc = 'Compare recognition with change-point gating against full prediction'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('files', metavar='FILE', nargs='+', help='audio files to recognize')
+    parser.add_argument(
+        '--service',
+        metavar='SERVICE',
+        default='EmbeddedPredictionService',
+        help='prediction service',
+    )
+    parser.add_argument(
+        '--thresholds',
+        metavar='THRESHOLDS',
+        default='0.02,0.05,0.1',
+        help='comma-separated change thresholds',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    service = get_prediction_service(args.service)
+    thresholds = [float(threshold) for threshold in args.thresholds.split(',')]
+
+    print(
+        f'{"file":>28} | {"threshold":>9} | {"rows":>5} | {"skipped":>7} | {"changed":>7} | '
+        f'{"chords":>6}'
+    )
+    for filename in args.files:
+        features = featurize_file_block(filename).get_non_silent()
+        full_predictions = service.predict(features.features)
+        full_chords = postprocess_predictions(full_predictions.copy(), features.time_offsets)
+        name = os.path.basename(filename)
+        print(
+            f'{name:>28} | {"-":>9} | {len(features):>5} | {0:>7.1%} | {0:>7.1%} | '
+            f'{len(full_chords):>6}'
+        )
+
+        for threshold in thresholds:
+            n_predicted_rows = len(get_segment_representatives(features.features, threshold)[0])
+            gated_predictions = predict_stable_segments(features.features, service, threshold)
+
+            changed = np.mean(gated_predictions['name'].values != full_predictions['name'].values)
+            chords = postprocess_predictions(gated_predictions, features.time_offsets)
+            skipped = 1 - n_predicted_rows / max(len(features), 1)
+            print(
+                f'{name:>28} | {threshold:>9.3f} | {n_predicted_rows:>5} | {skipped:>7.1%} | '
+                f'{changed:>7.1%} | {len(chords):>6}'
+            )
+
+
+if __name__ == '__main__':
+    main()
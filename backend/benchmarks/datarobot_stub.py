@@ -0,0 +1,247 @@
+"""
+Standalone usage: datarobot_stub.py [-h] --mode MODE [--port PORT] [--latency-ms LATENCY]
+                                    [--error-rate RATE] [--recognitions N] [--rows ROWS]
+
+A local stub of the DataRobot Prediction API v1.0 (/predApi/v1.0/deployments/<id>/predictions),
+and a benchmark of DataRobotV1APIPredictionService against it.
+
+The stub accepts JSON and CSV payloads and labels each row with the strongest chroma note.
+It can add a fixed latency to each request and fail a fraction of them with 503.
+
+optional arguments:
+  --mode MODE              "serve" to run the stub, "benchmark" to run the stub and measure
+                           the client
+  --port PORT              (optional) port to listen on (default: 8765)
+  --latency-ms LATENCY     (optional) simulated server-side latency of each request (default: 20)
+  --error-rate RATE        (optional) fraction of requests failed with 503 (default: 0)
+  --recognitions N         (optional) number of recognitions to run in the benchmark (default: 20)
+  --rows ROWS              (optional) comma-separated rows per recognition in the benchmark
+                           (default: 200,2000)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend python benchmarks/datarobot_stub.py --mode benchmark
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import random
+import re
+import socket
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import requests
+
+from common.features import FEATURE_NAMES
+from common.predictions.datarobot import DataRobotV1APIPredictionService
+
+
+PREDICTIONS_PATH_PATTERN = re.compile(r'^/predApi/v1\.0/deployments/[^/]+/predictions$')
+NOTE_NAMES = [name.replace('chroma-', '') for name in FEATURE_NAMES]
+
+
+class DataRobotStubHandler(BaseHTTPRequestHandler):
+    # Keep-alive requires HTTP/1.1.
+    protocol_version = 'HTTP/1.1'
+    latency_seconds = 0.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not PREDICTIONS_PATH_PATTERN.match(self.path):
+            return self.send_json(404, {'message': 'Not found'})
+        if 'datarobot-key' not in self.headers or 'Authorization' not in self.headers:
+            return self.send_json(401, {'message': 'Missing credentials'})
+
+        time.sleep(self.latency_seconds)
+        if random.random() < self.error_rate:
+            return self.send_json(503, {'message': 'Service unavailable'})
+
+        if self.headers.get('Content-Type', '').startswith('text/csv'):
+            df = pd.read_csv(io.BytesIO(content))
+        else:
+            df = pd.DataFrame(json.loads(content.decode('utf-8')))
+        self.send_json(200, {'data': predict_rows(df[FEATURE_NAMES].values)})
+
+    def send_json(self, status_code, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def predict_rows(features):
+    confidences = features / np.maximum(features.sum(axis=1, keepdims=True), 1e-10)
+    return [
+        {
+            'rowId': i,
+            'prediction': NOTE_NAMES[int(np.argmax(row))],
+            'predictionValues': [
+                {'label': label, 'value': float(value)}
+                for label, value in zip(NOTE_NAMES, row)
+            ],
+        }
+        for i, row in enumerate(confidences)
+    ]
+
+
+def serve_stub(port, latency_ms, error_rate):
+    handler = type('Handler', (DataRobotStubHandler,), {
+        'latency_seconds': latency_ms / 1000,
+        'error_rate': error_rate,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def start_stub_process(port, latency_ms, error_rate):
+    # A separate process, so that the stub does not compete with the client for the GIL.
+    process = multiprocessing.Process(
+        target=serve_stub,
+        args=(port, latency_ms, error_rate),
+        daemon=True,
+    )
+    process.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'DataRobot stub did not start on port {port}')
+
+
+def predict_unpooled(service, df):
+    # The client before connection pooling and batching: one JSON request,
+    # a new connection each time.
+    url = f'{service.server}/predApi/v1.0/deployments/{service.deployment_id}/predictions'
+    response = requests.post(
+        url=url,
+        json=df.to_dict(orient='records'),
+        auth=(service.username, service.api_token),
+        headers={'Content-Type': 'application/json', 'datarobot-key': service.server_key},
+    )
+    response.raise_for_status()
+    return [service.get_label_and_confidence(row) for row in response.json()['data']]
+
+
+def run_benchmark(port, n_recognitions, rows_per_recognition):
+    server_url = f'http://127.0.0.1:{port}'
+    credentials = dict(
+        server=server_url,
+        server_key='key',
+        deployment_id='stub',
+        username='user',
+        api_token='token',
+    )
+    baseline_service = DataRobotV1APIPredictionService(**credentials)
+    json_service = DataRobotV1APIPredictionService(
+        payload_format='json',
+        max_rows_per_request=500,
+        **credentials,
+    )
+    csv_service = DataRobotV1APIPredictionService(
+        payload_format='csv',
+        max_rows_per_request=500,
+        **credentials,
+    )
+    sequential_service = DataRobotV1APIPredictionService(
+        payload_format='csv',
+        max_rows_per_request=500,
+        max_concurrent_requests=1,
+        **credentials,
+    )
+    clients = [
+        ('unpooled json', lambda df: predict_unpooled(baseline_service, df)),
+        ('pooled json', json_service.predict),
+        ('pooled csv', csv_service.predict),
+        ('pooled csv x1', sequential_service.predict),
+    ]
+
+    print(
+        f'{"rows":>6} | {"client":>14} | {"p50, ms":>8} | {"p95, ms":>8} | {"rows/s":>9} | '
+        'failed'
+    )
+    random_state = np.random.RandomState(42)
+    for n_rows in rows_per_recognition:
+        df = pd.DataFrame(random_state.rand(n_rows, len(FEATURE_NAMES)), columns=FEATURE_NAMES)
+        for name, predict_func in clients:
+            latencies = []
+            n_failed = 0
+            for _ in range(n_recognitions):
+                start_time = time.perf_counter()
+                try:
+                    predict_func(df)
+                except Exception:
+                    n_failed += 1
+                latencies.append(time.perf_counter() - start_time)
+            latencies = np.array(latencies) * 1000
+            print(
+                f'{n_rows:>6} | {name:>14} | {np.percentile(latencies, 50):>8.1f} | '
+                f'{np.percentile(latencies, 95):>8.1f} | '
+                f'{n_rows / np.mean(latencies) * 1000:>9.0f} | {n_failed}'
+            )
+
+
+def parse_command_line_args(args):
+    program_desc = 'DataRobot Prediction API stub server and client benchmark'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('--mode', required=True, metavar='MODE', help='"serve" or "benchmark"')
+    parser.add_argument('--port', metavar='PORT', type=int, default=8765, help='port to listen on')
+    parser.add_argument(
+        '--latency-ms',
+        metavar='LATENCY',
+        type=float,
+        default=20,
+        help='simulated server-side latency of each request',
+    )
+    parser.add_argument(
+        '--error-rate',
+        metavar='RATE',
+        type=float,
+        default=0,
+        help='fraction of requests failed with 503',
+    )
+    parser.add_argument(
+        '--recognitions',
+        metavar='N',
+        type=int,
+        default=20,
+        help='number of recognitions to run in the benchmark',
+    )
+    parser.add_argument(
+        '--rows',
+        metavar='ROWS',
+        default='200,2000',
+        help='comma-separated rows per recognition in the benchmark',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    if args.mode == 'serve':
+        print(f'DataRobot stub listening on http://127.0.0.1:{args.port}')
+        serve_stub(args.port, args.latency_ms, args.error_rate)
+    elif args.mode == 'benchmark':
+        stub_process = start_stub_process(args.port, args.latency_ms, args.error_rate)
+        run_benchmark(args.port, args.recognitions, [int(rows) for rows in args.rows.split(',')])
+        stub_process.terminate()
+
+
+if __name__ == '__main__':
+    main()
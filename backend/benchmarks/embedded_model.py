@@ -0,0 +1,112 @@
+"""
+Standalone usage: embedded_model.py [-h] [--repeat REPEAT]
+
+Benchmark the embedded model formats: the pickled scikit-learn MLPClassifier
+and the compact .npz variants running on NumPy.
+
+Reports the load time in a fresh interpreter (including format-specific imports, as in a cold
+start), and the per-row prediction latency for several batch sizes.
+
+optional arguments:
+  --repeat REPEAT      number of fresh interpreters to measure the load time in (default: 5)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend python benchmarks/embedded_model.py
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from common.predictions.embedded import PICKLE_MODEL_FILENAME, load_pickled_model
+from common.predictions.mlp import NumpyMLPClassifier
+
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'common', 'predictions')
+
+MODELS = [
+    ('pickle', PICKLE_MODEL_FILENAME),
+    ('npz float32', 'embedded_model.npz'),
+    ('npz int8', 'embedded_model.int8.npz'),
+]
+
+BATCH_SIZES = [1, 8, 1000]
+
+# The prediction service package (and librosa through it) is imported by every service, so it is
+# imported before the timer starts: the measurement covers what is specific to the model format.
+LOAD_SCRIPT = '''
+import time, warnings
+warnings.simplefilter('ignore')
+import common.predictions
+start_time = time.perf_counter()
+if {is_pickle}:
+    from common.predictions.embedded import load_pickled_model
+    model = load_pickled_model({path!r})
+else:
+    from common.predictions.mlp import NumpyMLPClassifier
+    model = NumpyMLPClassifier.load({path!r})
+print(time.perf_counter() - start_time)
+'''
+
+
+def measure_load_seconds(path, is_pickle, repeat):
+    script = LOAD_SCRIPT.format(path=path, is_pickle=is_pickle)
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script], env=os.environ)
+        timings.append(float(output.decode('utf-8').strip().splitlines()[-1]))
+    return np.median(timings)
+
+
+def measure_row_microseconds(model, batch_size):
+    features = np.random.RandomState(42).rand(batch_size, 12)
+    model.predict_proba(features)
+
+    n_runs = max(10, 10000 // batch_size)
+    start_time = time.perf_counter()
+    for _ in range(n_runs):
+        model.predict_proba(features)
+    return (time.perf_counter() - start_time) / n_runs / batch_size * 1e6
+
+
+def parse_command_line_args(args):
+    program_desc = 'Benchmark load time and prediction latency of the embedded model formats'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=5,
+        help='number of fresh interpreters to measure the load time in',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+
+    header = f'{"model":>12} | {"size, KB":>8} | {"load, ms":>8}'
+    header += ''.join(f' | {f"us/row @{batch_size}":>12}' for batch_size in BATCH_SIZES)
+    print(header)
+
+    for name, filename in MODELS:
+        path = os.path.realpath(os.path.join(MODEL_DIR, filename))
+        is_pickle = path.endswith('.pkl')
+        model = load_pickled_model(path) if is_pickle else NumpyMLPClassifier.load(path)
+
+        load_seconds = measure_load_seconds(path, is_pickle, args.repeat)
+        row = f'{name:>12} | {os.path.getsize(path) / 1024:>8.1f} | {load_seconds * 1000:>8.1f}'
+        for batch_size in BATCH_SIZES:
+            row += f' | {measure_row_microseconds(model, batch_size):>12.2f}'
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
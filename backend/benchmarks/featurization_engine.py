@@ -0,0 +1,118 @@
+"""
+Standalone usage: featurization_engine.py [-h] [--durations DURATIONS] [--repeat REPEAT]
+                               [--profile PROFILE] FILE
+
+Compare per-request featurization latency of short clips with and without the cached featurization
+engine.
+
+"librosa" computes the spectrogram, RMS and chroma with a fresh window and chroma filterbank for
+every request, "engine" reuses the ones cached by `FeaturizationEngine`. Both start from the decoded
+signal, since decoding does not change. "tuning" is the part of either spent estimating the tuning,
+which depends on the recording and cannot be cached.
+
+positional arguments:
+  FILE                     audio file to cut the clips from
+
+optional arguments:
+  --durations DURATIONS    (optional) comma-separated clip durations in seconds (default: 5,10,15)
+  --repeat REPEAT          (optional) number of times to featurize each clip (default: 100)
+  --profile PROFILE        (optional) analysis profile
+                           (default: DECHORDER_ANALYSIS_PROFILE or balanced)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/featurization_engine.py /project-root/data/rendered/major-minor-jazz.mp3
+"""
+
+import argparse
+import logging
+import sys
+import time
+import warnings
+
+import librosa
+import numpy as np
+
+from common.features import get_analysis_profile, get_featurization_engine, load_audio
+
+
+def featurize_with_librosa(signal, profile):
+    spectrogram = np.abs(librosa.stft(signal, n_fft=profile.n_fft, hop_length=profile.hop_length))
+    rms = librosa.feature.rms(S=spectrogram, frame_length=profile.n_fft,
+                              hop_length=profile.hop_length)
+    chroma = librosa.feature.chroma_stft(S=spectrogram, sr=profile.sample_rate)
+    return rms, chroma
+
+
+def featurize_with_engine(signal, profile):
+    engine = get_featurization_engine(profile)
+    spectrogram = engine.compute_spectrogram(signal)
+    return engine.compute_rms(spectrogram), engine.compute_chroma(spectrogram)
+
+
+def measure_ms(func, repeat):
+    func()
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return np.median(timings) * 1000
+
+
+def parse_command_line_args(args):
+    program_desc = (
+        'Compare featurization latency of short clips '
+        'with and without the cached featurization engine'
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('file', metavar='FILE', help='audio file to cut the clips from')
+    parser.add_argument(
+        '--durations',
+        metavar='DURATIONS',
+        default='5,10,15',
+        help='comma-separated clip durations in seconds',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=100,
+        help='number of times to featurize each clip',
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PROFILE',
+        help='analysis profile',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    profile = get_analysis_profile(args.profile)
+    signal, sample_rate = load_audio(args.file, profile=profile)
+
+    print(
+        f'{"clip, s":>7} | {"librosa, ms":>11} | {"engine, ms":>10} | {"speedup":>7} | '
+        f'{"tuning, ms":>10}'
+    )
+    for duration in [float(duration) for duration in args.durations.split(',')]:
+        clip = signal[:int(duration * sample_rate)]
+        spectrogram = get_featurization_engine(profile).compute_spectrogram(clip)
+        librosa_ms = measure_ms(lambda: featurize_with_librosa(clip, profile), args.repeat)
+        engine_ms = measure_ms(lambda: featurize_with_engine(clip, profile), args.repeat)
+        engine = get_featurization_engine(profile)
+        tuning_ms = measure_ms(lambda: engine.estimate_tuning(spectrogram), args.repeat)
+        print(
+            f'{duration:>7.0f} | {librosa_ms:>11.2f} | {engine_ms:>10.2f} | '
+            f'{librosa_ms / engine_ms:>6.2f}x | {tuning_ms:>10.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
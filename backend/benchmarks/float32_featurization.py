@@ -0,0 +1,119 @@
+"""
+Standalone usage: float32_featurization.py [-h] [--minutes MINUTES] [--repeat REPEAT]
+                                [--profile PROFILE] FILE
+
+Compare the default and the float32 featurization engines: peak memory and latency of featurizing
+a long recording (spectrogram, RMS, chroma and chunk features), and the differences in the results.
+
+The recording is built by repeating the decoded file, so decoding is excluded from the measurements.
+Peak memory is the peak of the allocations traced by `tracemalloc` during featurization.
+
+positional arguments:
+  FILE                     audio file to repeat
+
+optional arguments:
+  --minutes MINUTES        (optional) duration of the recording to featurize, in minutes
+                           (default: 10)
+  --repeat REPEAT          (optional) number of times to featurize the recording (default: 3)
+  --profile PROFILE        (optional) analysis profile
+                           (default: DECHORDER_ANALYSIS_PROFILE or balanced)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/float32_featurization.py /project-root/data/rendered/major-minor-jazz.mp3
+"""
+
+import argparse
+import logging
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from common.features import FEATURIZATION_ENGINES, FrameFeatures, get_analysis_profile, load_audio
+
+
+def featurize_signal(engine, signal):
+    spectrogram = engine.compute_spectrogram(signal)
+    rms = engine.compute_rms(spectrogram)
+    chroma = engine.compute_chroma(spectrogram)
+    frames_per_second = spectrogram.shape[1] / (len(signal) / engine.profile.sample_rate)
+    return FrameFeatures(rms, chroma, frames_per_second).aggregate()
+
+
+def measure(engine, signal, repeat):
+    tracemalloc.start()
+    block = featurize_signal(engine, signal)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        featurize_signal(engine, signal)
+        timings.append(time.perf_counter() - start_time)
+    return peak_bytes, np.median(timings), block
+
+
+def parse_command_line_args(args):
+    program_desc = (
+        'Compare peak memory and latency of the default and the float32 featurization engines'
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('file', metavar='FILE', help='audio file to repeat')
+    parser.add_argument(
+        '--minutes',
+        metavar='MINUTES',
+        type=float,
+        default=10,
+        help='duration of the recording to featurize, in minutes',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=3,
+        help='number of times to featurize the recording',
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PROFILE',
+        help='analysis profile',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    profile = get_analysis_profile(args.profile)
+    signal, sample_rate = load_audio(args.file, profile=profile)
+    n_samples = int(args.minutes * 60 * sample_rate)
+    signal = np.tile(signal, n_samples // len(signal) + 1)[:n_samples]
+    signal_mib = signal.nbytes / 2 ** 20
+    print(f'Featurizing {args.minutes:.0f} minutes of audio ({signal_mib:.0f} MiB signal)')
+
+    print(
+        f'{"engine":>8} | {"peak, MiB":>9} | {"time, s":>7} | {"max feature diff":>16} | '
+        f'{"silent diff":>11}'
+    )
+    expected_block = None
+    for name, engine_class in FEATURIZATION_ENGINES.items():
+        peak_bytes, seconds, block = measure(engine_class(profile), signal, args.repeat)
+        if expected_block is None:
+            expected_block = block
+        feature_diff = np.abs(block.features - expected_block.features).max()
+        silent_diff = np.sum(block.is_silent != expected_block.is_silent)
+        print(
+            f'{name:>8} | {peak_bytes / 2 ** 20:>9.1f} | {seconds:>7.2f} | '
+            f'{feature_diff:>16.2e} | {silent_diff:>11}'
+        )
+
+
+if __name__ == '__main__':
+    main()
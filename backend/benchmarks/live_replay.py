@@ -0,0 +1,226 @@
+"""
+Standalone usage: live_replay.py [-h] [--url URL] [--format FORMAT] [--block-ms BLOCK_MS]
+                                 [--speed SPEED] [--service SERVICE] FILE [FILE ...]
+
+Replay audio files in real time as live audio, and measure how long after the end of each chunk
+its chord event arrives. Without --url, the audio is pushed to a `LiveRecognitionSession` in this
+process; with --url, to the live recognition endpoints of a running Flask API
+(requires DECHORDER_LIVE_MAX_SESSIONS).
+
+  - s16le: the file is decoded to 16-bit PCM at 44100 Hz first, and sent block by block.
+  - mp3: the raw MP3 bytes are sent block by block, paced by the duration of the file
+    (needs ffmpeg).
+
+The latency of an event is the time from the moment the last sample of its chunk was sent
+to the moment the event was received. The chords are compared with the offline recognition
+of the file.
+
+positional arguments:
+  FILE                     audio files to replay
+
+optional arguments:
+  --url URL                (optional) base URL of the Flask API, e.g. http://127.0.0.1:5000
+  --format FORMAT          (optional) live audio format: s16le or mp3 (default: s16le)
+  --block-ms BLOCK_MS      (optional) duration of the audio sent at once, in milliseconds
+                           (default: 100)
+  --speed SPEED            (optional) replay speed, 1 = real time (default: 1)
+  --service SERVICE        (optional) prediction service of the in-process session
+                           (default: EmbeddedPredictionService)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/live_replay.py /project-root/data/rendered/major-minor-jazz.mp3
+"""
+
+import argparse
+import logging
+import sys
+import time
+import warnings
+
+import librosa
+import numpy as np
+import requests
+
+from common.features import SECONDS_PER_CHUNK
+from common.live import DEFAULT_PCM_SAMPLE_RATE, LiveSessionStore
+from common.predictions import get_prediction_service
+from common.recognition import recognize_saved_file
+
+
+class InProcessClient(object):
+    def __init__(self, service_name, input_format):
+        self.prediction_service = get_prediction_service(service_name)
+        self.store = LiveSessionStore(max_sessions=1)
+        self.session = self.store.create_session(self.prediction_service, input_format,
+                                                 DEFAULT_PCM_SAMPLE_RATE)
+
+    def push(self, content):
+        return self.session.push(content)
+
+    def finish(self):
+        return self.store.finish_session(self.session.session_id)
+
+
+class HTTPClient(object):
+    def __init__(self, url, input_format):
+        self.url = url.rstrip('/')
+        self.http = requests.Session()
+        params = {'format': input_format, 'sampleRate': DEFAULT_PCM_SAMPLE_RATE}
+        response = self.http.post(f'{self.url}/api/live', params=params)
+        response.raise_for_status()
+        self.session_url = f'{self.url}/api/live/{response.json()["sessionId"]}'
+
+    def push(self, content):
+        response = self.http.post(f'{self.session_url}/audio', data=content)
+        response.raise_for_status()
+        return response.json()['chords']
+
+    def finish(self):
+        response = self.http.delete(self.session_url)
+        response.raise_for_status()
+        return response.json()['chords']
+
+
+def get_blocks(filename, input_format, block_seconds):
+    """
+    Split the file into (content, seconds sent after this block) pairs.
+    """
+    signal, sample_rate = librosa.load(filename, sr=DEFAULT_PCM_SAMPLE_RATE, mono=True)
+    duration = len(signal) / sample_rate
+    if input_format == 'mp3':
+        with open(filename, 'rb') as f:
+            content = f.read()
+        n_bytes = max(int(len(content) * block_seconds / duration), 1)
+        return [
+            (
+                content[start:start + n_bytes],
+                min(start + n_bytes, len(content)) / len(content) * duration,
+            )
+            for start in range(0, len(content), n_bytes)
+        ], duration
+
+    pcm = (np.clip(signal, -1, 1) * 32767).astype('<i2')
+    n_samples = int(block_seconds * sample_rate)
+    return [
+        (pcm[start:start + n_samples].tobytes(), min(start + n_samples, len(pcm)) / sample_rate)
+        for start in range(0, len(pcm), n_samples)
+    ], duration
+
+
+def replay(client, blocks, duration, speed):
+    # Each event is stamped with its receive time,
+    # relative to the start of the replay in audio seconds.
+    events = []
+    start_time = time.perf_counter()
+    for content, sent_seconds in blocks:
+        # Wait until this block would have been recorded.
+        delay = start_time + sent_seconds / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        for chord in client.push(content):
+            events.append((chord, (time.perf_counter() - start_time) * speed))
+
+    final_events = [
+        (chord, (time.perf_counter() - start_time) * speed) for chord in client.finish()
+    ]
+    return events, final_events
+
+
+def get_latencies(events, duration, speed):
+    # A chunk is complete when its last sample has been sent.
+    # Latency is measured in wall-clock seconds.
+    return [
+        (receive_seconds - min(chord['timeOffset'] + SECONDS_PER_CHUNK, duration)) / speed
+        for chord, receive_seconds in events
+    ]
+
+
+def parse_command_line_args(args):
+    program_desc = (
+        'Replay audio files in real time as live audio and measure the chord event latency'
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('files', metavar='FILE', nargs='+', help='audio files to replay')
+    parser.add_argument('--url', metavar='URL', help='base URL of the Flask API')
+    parser.add_argument(
+        '--format',
+        metavar='FORMAT',
+        choices=['s16le', 'mp3'],
+        default='s16le',
+        help='live audio format',
+    )
+    parser.add_argument(
+        '--block-ms',
+        metavar='BLOCK_MS',
+        type=float,
+        default=100,
+        help='duration of the audio sent at once, in milliseconds',
+    )
+    parser.add_argument(
+        '--speed',
+        metavar='SPEED',
+        type=float,
+        default=1,
+        help='replay speed, 1 = real time',
+    )
+    parser.add_argument(
+        '--service',
+        metavar='SERVICE',
+        default='EmbeddedPredictionService',
+        help='prediction service of the in-process session',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    all_latencies = []
+    print(
+        f'{"file":>24} | {"events":>6} | {"mean, ms":>8} | {"p95, ms":>7} | {"max, ms":>7} | '
+        f'{"final":>5} | offline'
+    )
+    for filename in args.files:
+        blocks, duration = get_blocks(filename, args.format, args.block_ms / 1000)
+        if args.url:
+            client = HTTPClient(args.url, args.format)
+        else:
+            client = InProcessClient(args.service, args.format)
+        events, final_events = replay(client, blocks, duration, args.speed)
+
+        latencies = np.array(get_latencies(events, duration, args.speed)) * 1000
+        all_latencies.extend(latencies)
+        # The prediction service of the API is unknown here,
+        # so only in-process sessions are compared.
+        offline_match = 'n/a'
+        if not args.url:
+            live_chords = [
+                (chord['timeOffset'], chord['name']) for chord, _ in events + final_events
+            ]
+            offline_result = recognize_saved_file(filename, client.prediction_service)
+            offline_chords = [(chord['timeOffset'], chord['name']) for chord in offline_result]
+            offline_match = 'same' if live_chords == offline_chords else 'differs'
+
+        stats = (0, 0, 0)
+        if len(latencies):
+            stats = (np.mean(latencies), np.percentile(latencies, 95), np.max(latencies))
+        print(
+            f'{filename[-24:]:>24} | {len(events):>6} | '
+            f'{stats[0]:>8.1f} | {stats[1]:>7.1f} | {stats[2]:>7.1f} | '
+            f'{len(final_events):>5} | {offline_match}'
+        )
+
+    if all_latencies:
+        print(
+            f'All events: mean {np.mean(all_latencies):.1f} ms, '
+            f'p95 {np.percentile(all_latencies, 95):.1f} ms, '
+            f'max {np.max(all_latencies):.1f} ms (chunk: {SECONDS_PER_CHUNK * 1000:.0f} ms)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Standalone usage: multipart.py [-h] [--sizes-mb SIZES] [--repeat REPEAT]
+
+Benchmark the Lambda upload path: base64 decoding and multipart parsing of the request body.
+Reports parse time and peak memory (as seen by tracemalloc) against the upload size,
+for the current parser and for the split-based parser it replaced.
+
+optional arguments:
+  --sizes-mb SIZES     comma-separated upload sizes in megabytes (default: 1,5,20,50)
+  --repeat REPEAT      number of runs per size, the fastest one is reported (default: 3)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend python benchmarks/multipart.py --sizes-mb 1,10
+"""
+
+import argparse
+import base64
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from common.utilities import decode_base64_body, extract_file_from_http_request
+
+
+BOUNDARY = b'----benchmarkboundary'
+
+
+def build_lambda_body(payload):
+    newline = b'\r\n'
+    body = b'--' + BOUNDARY + newline
+    body += b'Content-Disposition: form-data; name="audio-file"; filename="benchmark.mp3"' + newline
+    body += b'Content-Type: audio/mp3' + newline + newline
+    body += payload + newline
+    body += b'--' + BOUNDARY + b'--' + newline
+    return base64.b64encode(body).decode('utf-8')
+
+
+def parse_current(headers, encoded_body):
+    body = decode_base64_body(encoded_body)
+    return extract_file_from_http_request(headers, body).content
+
+
+def parse_legacy(headers, encoded_body):
+    # The split-based parser used before, reduced to the payload extraction.
+    body = base64.b64decode(encoded_body)
+    newline = b'\r\n'
+    file_part = body.split(b'--' + BOUNDARY + newline)[1]
+    file_part = file_part.split(newline + b'--' + BOUNDARY + b'--')[0]
+    lines = [line for line in file_part.split(newline) if line]
+    return newline.join(lines[2:])
+
+
+def measure(parse_func, headers, encoded_body, repeat):
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        parse_func(headers, encoded_body)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    tracemalloc.start()
+    payload = parse_func(headers, encoded_body)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak_bytes, bytes(payload)
+
+
+def parse_command_line_args(args):
+    program_desc = 'Benchmark base64 decoding and multipart parsing of Lambda uploads'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument(
+        '--sizes-mb',
+        metavar='SIZES',
+        default='1,5,20,50',
+        help='comma-separated upload sizes in megabytes',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=3,
+        help='number of runs per size, the fastest one is reported',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    headers = {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY.decode('utf-8')}
+    random_state = np.random.RandomState(42)
+
+    print(
+        f'{"size, MB":>9} | {"parser":>7} | {"time, ms":>9} | {"peak, MB":>9} | '
+        f'{"peak/size":>9} | intact'
+    )
+    for size_mb in [float(size) for size in args.sizes_mb.split(',')]:
+        # Random bytes contain CRLF pairs, like real compressed audio does.
+        payload = random_state.randint(0, 256, int(size_mb * 1024 * 1024), dtype=np.uint8).tobytes()
+        encoded_body = build_lambda_body(payload)
+
+        for name, parse_func in [('current', parse_current), ('legacy', parse_legacy)]:
+            elapsed, peak_bytes, parsed_payload = measure(
+                parse_func,
+                headers,
+                encoded_body,
+                args.repeat,
+            )
+            print(
+                f'{size_mb:>9.1f} | {name:>7} | {elapsed * 1000:>9.1f} | '
+                f'{peak_bytes / 1024 / 1024:>9.1f} | {peak_bytes / len(payload):>9.2f} | '
+                f'{parsed_payload == payload}'
+            )
+
+
+if __name__ == '__main__':
+    main()
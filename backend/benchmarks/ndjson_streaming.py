@@ -0,0 +1,148 @@
+"""
+Standalone usage: ndjson_streaming.py [-h] [--url URL] [--batch-seconds BATCH_SECONDS]
+                                      [--repeat REPEAT] [--service SERVICE] FILE [FILE ...]
+
+Compare the time to the first chord and the total time of recognizing long recordings as a single
+JSON list and as a stream of NDJSON records, batch by batch.
+
+Without --url, `recognize_saved_file` and `iter_recognized_chords` run in this process, including
+the JSON serialization of the result. With --url, the files are uploaded to /api/recognize
+of a running Flask API, with and without `stream=1`, and the times are measured when the response
+bytes arrive.
+
+positional arguments:
+  FILE                           audio files to recognize
+
+optional arguments:
+  --url URL                      (optional) base URL of the Flask API, e.g. http://127.0.0.1:5000
+  --batch-seconds BATCH_SECONDS  (optional) batch duration of the in-process recognition
+                                 (default: 30)
+  --repeat REPEAT                (optional) number of times to recognize each file (default: 3)
+  --service SERVICE              (optional) in-process prediction service
+                                 (default: EmbeddedPredictionService)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/ndjson_streaming.py /project-root/data/rendered/*.mp3
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import requests
+
+from common.features import DEFAULT_FEATURE_BATCH_SECONDS
+from common.predictions import get_prediction_service
+from common.recognition import iter_recognized_chords, recognize_saved_file
+
+
+def measure_json_in_process(filename, prediction_service, batch_seconds):
+    start_time = time.perf_counter()
+    json.dumps(recognize_saved_file(filename, prediction_service))
+    total_seconds = time.perf_counter() - start_time
+    # Nothing is returned before the whole list is serialized.
+    return total_seconds, total_seconds
+
+
+def measure_ndjson_in_process(filename, prediction_service, batch_seconds):
+    start_time = time.perf_counter()
+    first_seconds = None
+    for chords in iter_recognized_chords(filename, prediction_service, batch_seconds=batch_seconds):
+        for chord in chords:
+            json.dumps(chord)
+            if first_seconds is None:
+                first_seconds = time.perf_counter() - start_time
+    return first_seconds, time.perf_counter() - start_time
+
+
+def measure_http(url, filename, stream):
+    with open(filename, 'rb') as f:
+        files = {'audio-file': (os.path.basename(filename), f.read())}
+
+    start_time = time.perf_counter()
+    params = {'stream': '1'} if stream else {}
+    response = requests.post(f'{url}/api/recognize', params=params, files=files, stream=True)
+    response.raise_for_status()
+    first_seconds = None
+    for chunk in response.iter_content(chunk_size=None):
+        if chunk and first_seconds is None:
+            first_seconds = time.perf_counter() - start_time
+    return first_seconds, time.perf_counter() - start_time
+
+
+def measure(func, repeat):
+    func()
+    timings = np.array([func() for _ in range(repeat)])
+    return np.median(timings, axis=0)
+
+
+def parse_command_line_args(args):
+    program_desc = (
+        'Compare the time to the first chord and the total time of JSON and NDJSON recognition'
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('files', metavar='FILE', nargs='+', help='audio files to recognize')
+    parser.add_argument('--url', metavar='URL', help='base URL of the Flask API')
+    parser.add_argument(
+        '--batch-seconds',
+        metavar='BATCH_SECONDS',
+        type=float,
+        default=DEFAULT_FEATURE_BATCH_SECONDS,
+        help='batch duration of the in-process recognition',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=3,
+        help='number of times to recognize each file',
+    )
+    parser.add_argument(
+        '--service',
+        metavar='SERVICE',
+        default='EmbeddedPredictionService',
+        help='in-process prediction service',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    if args.url:
+        url = args.url.rstrip('/')
+        modes = {
+            'json': lambda filename: measure_http(url, filename, stream=False),
+            'ndjson': lambda filename: measure_http(url, filename, stream=True),
+        }
+    else:
+        prediction_service = get_prediction_service(args.service)
+        batch_seconds = args.batch_seconds
+        modes = {
+            'json': lambda filename: measure_json_in_process(filename, prediction_service,
+                                                             batch_seconds),
+            'ndjson': lambda filename: measure_ndjson_in_process(filename, prediction_service,
+                                                                 batch_seconds),
+        }
+
+    print(f'{"file":>24} | {"mode":>6} | {"first chord, s":>14} | {"total, s":>8}')
+    for filename in args.files:
+        for mode, measure_func in modes.items():
+            first_seconds, total_seconds = measure(lambda: measure_func(filename), args.repeat)
+            print(
+                f'{filename[-24:]:>24} | {mode:>6} | '
+                f'{first_seconds:>14.3f} | {total_seconds:>8.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
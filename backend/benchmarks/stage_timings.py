@@ -0,0 +1,127 @@
+"""
+Standalone usage: stage_timings.py [-h] [--profile PROFILE] [--repeat REPEAT] [--service SERVICE]
+                                   FILE [FILE ...]
+
+Break down the recognition latency of each file by pipeline stage (decode, STFT, RMS, tuning,
+chroma, chunking, silence filtering, predict, postprocess), and measure the overhead of tracing:
+the total time of recognizing the files with and without a trace, and the cost of a single
+`trace_stage` call.
+
+positional arguments:
+  FILE               audio files to recognize
+
+optional arguments:
+  --profile PROFILE  (optional) analysis profile (default: the configured one)
+  --repeat REPEAT    (optional) number of times to recognize each file (default: 5)
+  --service SERVICE  (optional) prediction service (default: EmbeddedPredictionService)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend \
+    python benchmarks/stage_timings.py /project-root/data/rendered/*.mp3
+"""
+
+import argparse
+import logging
+import sys
+import time
+import timeit
+import warnings
+
+import numpy as np
+
+from common.predictions import get_prediction_service
+from common.recognition import recognize_saved_file
+from common.tracing import end_trace, start_trace, trace_stage
+
+STAGES = [
+    'decode', 'stft', 'rms', 'tuning', 'chroma', 'chunking', 'silence', 'predict', 'postprocess',
+]
+
+
+def recognize_traced(filename, prediction_service, profile):
+    trace, token = start_trace()
+    try:
+        recognize_saved_file(filename, prediction_service, analysis_profile=profile)
+    finally:
+        end_trace(token)
+    return dict(trace.stages, total=trace.get_total_seconds())
+
+
+def recognize_untraced(filename, prediction_service, profile):
+    start_time = time.perf_counter()
+    recognize_saved_file(filename, prediction_service, analysis_profile=profile)
+    return time.perf_counter() - start_time
+
+
+def measure_stage_call(traced, number=1000000):
+    token = start_trace()[1] if traced else None
+    try:
+        timings = timeit.repeat('with trace_stage("stft"): pass', globals=globals(), number=number,
+                                repeat=3)
+        seconds = min(timings)
+    finally:
+        if token:
+            end_trace(token)
+    return seconds / number
+
+
+def parse_command_line_args(args):
+    program_desc = (
+        'Break down the recognition latency by pipeline stage and measure the overhead of tracing'
+    )
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument('files', metavar='FILE', nargs='+', help='audio files to recognize')
+    parser.add_argument('--profile', metavar='PROFILE', help='analysis profile')
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=5,
+        help='number of times to recognize each file',
+    )
+    parser.add_argument(
+        '--service',
+        metavar='SERVICE',
+        default='EmbeddedPredictionService',
+        help='prediction service',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+    prediction_service = get_prediction_service(args.service)
+
+    columns = STAGES + ['other', 'total']
+    print(f'{"file":>24} | ' + ' | '.join(f'{column:>11}' for column in columns) + '   (median ms)')
+    untraced_seconds = []
+    traced_seconds = []
+    for filename in args.files:
+        recognize_untraced(filename, prediction_service, args.profile)
+        # Interleaved, so that both modes see the same cache and CPU frequency conditions.
+        stages = []
+        for _ in range(args.repeat):
+            untraced_seconds.append(recognize_untraced(filename, prediction_service, args.profile))
+            stages.append(recognize_traced(filename, prediction_service, args.profile))
+            traced_seconds.append(stages[-1]['total'])
+
+        medians = {
+            name: np.median([s.get(name, 0.0) for s in stages]) * 1000
+            for name in STAGES + ['total']
+        }
+        medians['other'] = medians['total'] - sum(medians[name] for name in STAGES)
+        row = ' | '.join(f'{medians[column]:>11.1f}' for column in columns)
+        print(f'{filename[-24:]:>24} | {row}')
+
+    print()
+    print(f'Total recognition time without tracing: {np.sum(untraced_seconds):.3f} s')
+    print(f'Total recognition time with tracing:    {np.sum(traced_seconds):.3f} s')
+    print(f'trace_stage call without a trace: {measure_stage_call(traced=False) * 1e9:.0f} ns')
+    print(f'trace_stage call with a trace:    {measure_stage_call(traced=True) * 1e9:.0f} ns')
+
+
+if __name__ == '__main__':
+    main()
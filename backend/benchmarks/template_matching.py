@@ -0,0 +1,119 @@
+"""
+Standalone usage: template_matching.py [-h] [--data-path DATAPATH] [--repeat REPEAT]
+
+Compare the template-matching prediction service with the embedded model:
+accuracy on a labeled dataset, startup time, and per-row prediction latency for several batch sizes.
+
+Note that the embedded model was trained on the default dataset, so its accuracy there
+is optimistic.
+
+optional arguments:
+  --data-path DATAPATH     (optional) labeled dataset in CSV format
+                           (default: data/featurized/major-minor.csv)
+  --repeat REPEAT          (optional) number of times to construct and load each service
+                           (default: 5)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend python benchmarks/template_matching.py
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from common.features import FEATURE_NAMES
+from common.predictions.embedded import EmbeddedPredictionService
+from common.predictions.template import CHORD_QUALITIES, TemplatePredictionService
+
+
+DEFAULT_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    '..',
+    '..',
+    'data',
+    'featurized',
+    'major-minor.csv',
+)
+
+SERVICES = [
+    ('embedded', EmbeddedPredictionService),
+    ('template', TemplatePredictionService),
+    ('template+7th', lambda: TemplatePredictionService(qualities=list(CHORD_QUALITIES))),
+]
+
+BATCH_SIZES = [1, 8, 1000]
+
+
+def measure_startup_ms(create_service, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        service = create_service()
+        service.preload()
+        timings.append(time.perf_counter() - start_time)
+    return np.median(timings) * 1000
+
+
+def measure_row_microseconds(service, features, batch_size):
+    batch = features[np.arange(batch_size) % len(features)]
+    service.predict(batch)
+
+    n_runs = max(10, 10000 // batch_size)
+    start_time = time.perf_counter()
+    for _ in range(n_runs):
+        service.predict(batch)
+    return (time.perf_counter() - start_time) / n_runs / batch_size * 1e6
+
+
+def parse_command_line_args(args):
+    program_desc = 'Compare template matching with the embedded model'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument(
+        '--data-path',
+        metavar='DATAPATH',
+        default=DEFAULT_DATA_PATH,
+        help='labeled dataset in CSV format',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='REPEAT',
+        type=int,
+        default=5,
+        help='number of times to construct and load each service',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+
+    df = pd.read_csv(args.data_path)
+    features = df[FEATURE_NAMES].values
+    labels = df['chord'].values
+
+    header = f'{"service":>12} | {"accuracy":>8} | {"startup, ms":>11}'
+    header += ''.join(f' | {f"us/row @{batch_size}":>12}' for batch_size in BATCH_SIZES)
+    print(header)
+
+    for name, create_service in SERVICES:
+        startup_ms = measure_startup_ms(create_service, args.repeat)
+        service = create_service()
+        accuracy = np.mean(service.predict(features)['name'].values == labels)
+
+        row = f'{name:>12} | {accuracy:>8.3f} | {startup_ms:>11.2f}'
+        row += ''.join(f' | {measure_row_microseconds(service, features, batch_size):>12.2f}'
+                       for batch_size in BATCH_SIZES)
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
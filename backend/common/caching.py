@@ -0,0 +1,595 @@
+"""
+Standalone usage: caching.py [-h] --mode MODE --audio-dir AUDIODIR --cache-dir CACHEDIR
+                             [--max-bytes MAXBYTES] [--analysis-profile PROFILE]
+
+Pre-warm the frame-level feature cache for a directory of recordings
+
+optional arguments:
+  --mode MODE              mode (currently, only "warm" is available)
+  --audio-dir AUDIODIR     directory with the audio files to featurize
+  --cache-dir CACHEDIR     frame-level feature cache directory
+  --max-bytes MAXBYTES     (optional) size limit of the cache directory
+  --analysis-profile PROFILE
+                           (optional) analysis profile to featurize with
+                           (default: DECHORDER_ANALYSIS_PROFILE)
+
+Note: you might need to set PYTHONPATH when running this. Example:
+
+PYTHONPATH=/project-root/backend python caching.py --mode warm \
+    --audio-dir /project-root/data/rendered --cache-dir /tmp/dechorder-frames
+"""
+
+import argparse
+import collections
+import copy
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+from common.features import (
+    ANALYSIS_PROFILES,
+    FrameFeatures,
+    compute_frame_features,
+    get_analysis_profile,
+    get_analysis_signature,
+    get_featurization_signature,
+)
+from common.utilities import ALLOWED_EXTENSIONS
+
+
+logger = logging.getLogger(__name__)
+
+
+# Size of blocks used when hashing files.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Default number of recognition results kept in memory.
+DEFAULT_MEMORY_CACHE_ENTRIES = 256
+
+# Default size limit for the on-disk tier of the result cache.
+DEFAULT_DISK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Default size limit for the frame-level feature cache.
+DEFAULT_FRAME_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def get_content_digest(source):
+    """
+    Compute a SHA-256 digest of an audio file or in-memory audio content.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+        A path to a saved file, raw file content, or a seekable binary file-like object.
+
+    Returns
+    -------
+    str
+        Hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+        return digest.hexdigest()
+
+    if hasattr(source, 'read'):
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+        source.seek(0)
+        return digest.hexdigest()
+
+    with open(source, 'rb') as fp:
+        for block in iter(lambda: fp.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_recognition_cache_key(content_digest, prediction_service, analysis_profile=None,
+                              skip_silence=False, **options):
+    """
+    Build a cache key for a recognition result.
+
+    Parameters
+    ----------
+    content_digest : str
+        Digest of the audio content, as returned by `get_content_digest`.
+    prediction_service : PredictionService
+        The service used to make predictions. Its identity becomes part of the key.
+    analysis_profile : AnalysisProfile
+        (Optional) The analysis profile used for featurization. Defaults to the configured one.
+    skip_silence : bool
+        Whether featurization skipped the STFT over silent chunks.
+    options
+        Any additional recognition options that affect the result.
+
+    Returns
+    -------
+    str
+    """
+    return _build_key(
+        content=content_digest,
+        model=prediction_service.get_identity(),
+        featurization=get_featurization_signature(analysis_profile, skip_silence),
+        options=options,
+    )
+
+
+def evict_least_recently_used(cache_dir, suffix, max_bytes):
+    """
+    Delete the least recently used files from a cache directory until it fits the size limit.
+    Files are considered used when they are written or touched.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Path to the cache directory.
+    suffix : str
+        Only files with this suffix are considered cache entries.
+    max_bytes : int
+        Maximum total size of the cache entries.
+    """
+    entries = [
+        entry
+        for entry in os.scandir(cache_dir)
+        if entry.name.endswith(suffix)
+    ]
+    entries = sorted(entries, key=lambda entry: entry.stat().st_mtime)
+    total_size = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total_size <= max_bytes:
+            break
+        total_size -= entry.stat().st_size
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _build_key(**key_parts):
+    serialized = json.dumps(key_parts, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class _PendingComputation(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RecognitionResultCache(object):
+    """
+    A two-tier cache for recognition results: a bounded in-process LRU and an optional
+    on-disk directory with size-based eviction.
+
+    Concurrent `get_or_compute` calls for the same key are coalesced, so the result is
+    computed only once and shared with all callers.
+    """
+    def __init__(self, max_entries=DEFAULT_MEMORY_CACHE_ENTRIES, disk_dir=None,
+                 max_disk_bytes=DEFAULT_DISK_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+
+        self._memory = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Look up a result in memory, then on disk.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, as returned by `get_recognition_cache_key`.
+
+        Returns
+        -------
+        object
+            The cached result, or None if it is not cached.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._memory[key])
+
+        result = self._read_from_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_in_memory(key, result)
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        """
+        Store a JSON-serializable result in all cache tiers.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, as returned by `get_recognition_cache_key`.
+        result : object
+            Recognition result to store.
+        """
+        with self._lock:
+            self._put_in_memory(key, copy.deepcopy(result))
+        self._write_to_disk(key, result)
+
+    def get_or_compute(self, key, compute_func):
+        """
+        Return the cached result for the key, computing it with `compute_func` on a miss.
+        If the same key is already being computed by another thread, waits for that result.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, as returned by `get_recognition_cache_key`.
+        compute_func : callable
+            A function without arguments that computes the result.
+
+        Returns
+        -------
+        object
+        """
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            pending = self._pending.get(key)
+            is_leader = pending is None
+            if is_leader:
+                pending = _PendingComputation()
+                self._pending[key] = pending
+
+        if not is_leader:
+            logger.info('Waiting for an identical recognition in progress')
+            with self._lock:
+                self.coalesced += 1
+            pending.done.wait()
+            if pending.error:
+                raise pending.error
+            return copy.deepcopy(pending.result)
+
+        try:
+            pending.result = compute_func()
+            self.put(key, pending.result)
+            return pending.result
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Hit/miss counters and the current number of entries in memory.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'diskHits': self.disk_hits,
+                'coalesced': self.coalesced,
+                'memoryEntries': len(self._memory),
+            }
+
+    def _put_in_memory(self, key, result):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _get_disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.json')
+
+    def _read_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._get_disk_path(key)
+        try:
+            with open(path, 'r') as fp:
+                result = json.load(fp)
+            # Touch the file so that eviction treats it as recently used.
+            os.utime(path)
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def _write_to_disk(self, key, result):
+        if not self.disk_dir:
+            return
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(result, fp)
+            os.replace(temp_path, self._get_disk_path(key))
+            evict_least_recently_used(self.disk_dir, '.json', self.max_disk_bytes)
+        except OSError:
+            logger.warning('Failed to write the recognition result to disk cache', exc_info=True)
+
+
+def get_result_cache():
+    """
+    Create a recognition result cache configured by environment variables:
+
+    * DECHORDER_RESULT_CACHE_ENTRIES: max number of results kept in memory (0 disables the cache).
+    * DECHORDER_RESULT_CACHE_DIR: (optional) directory for the on-disk tier.
+    * DECHORDER_RESULT_CACHE_MAX_BYTES: (optional) size limit of the on-disk tier.
+
+    Returns
+    -------
+    RecognitionResultCache
+        A cache instance, or None if caching is disabled.
+    """
+    max_entries = int(os.environ.get('DECHORDER_RESULT_CACHE_ENTRIES', 0))
+    disk_dir = os.environ.get('DECHORDER_RESULT_CACHE_DIR')
+    if max_entries <= 0 and not disk_dir:
+        return None
+
+    max_disk_bytes = int(os.environ.get(
+        'DECHORDER_RESULT_CACHE_MAX_BYTES',
+        DEFAULT_DISK_CACHE_MAX_BYTES,
+    ))
+    return RecognitionResultCache(max_entries, disk_dir, max_disk_bytes)
+
+
+class FrameFeatureCache(object):
+    """
+    An on-disk cache of frame-level features (RMS and chroma) stored as float32 .npz files,
+    keyed by audio content digest and analysis profile. Lets recognition skip decoding
+    and STFT entirely when only the prediction model or chunking changes.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_FRAME_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, content_digest, streaming=False, profile=None, skip_silence=False):
+        """
+        Load the cached frame-level features.
+
+        Parameters
+        ----------
+        content_digest : str
+            Digest of the audio content, as returned by `get_content_digest`.
+        streaming : bool
+            Whether the features were computed by the streaming featurizer.
+        profile : AnalysisProfile
+            (Optional) The analysis profile of the features. Defaults to the configured one.
+        skip_silence : bool
+            Whether the chroma of silent chunks was left at zero, see `compute_frame_features`.
+
+        Returns
+        -------
+        FrameFeatures
+            Cached features, or None if they are not cached.
+        """
+        path = self._get_path(content_digest, streaming, profile, skip_silence)
+        try:
+            with np.load(path) as data:
+                frames_per_second = float(data['frames_per_second'])
+                frames = FrameFeatures(data['rms'], data['chroma'], frames_per_second)
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return frames
+
+    def put(self, content_digest, frames, streaming=False, profile=None, skip_silence=False):
+        """
+        Store frame-level features in the cache.
+
+        Parameters
+        ----------
+        content_digest : str
+            Digest of the audio content, as returned by `get_content_digest`.
+        frames : FrameFeatures
+            Features to store.
+        streaming : bool
+            Whether the features were computed by the streaming featurizer.
+        profile : AnalysisProfile
+            (Optional) The analysis profile of the features. Defaults to the configured one.
+        skip_silence : bool
+            Whether the chroma of silent chunks was left at zero, see `compute_frame_features`.
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(
+                    fp,
+                    rms=frames.rms.astype(np.float32),
+                    chroma=frames.chroma.astype(np.float32),
+                    frames_per_second=np.array(frames.frames_per_second),
+                )
+            os.replace(temp_path, self._get_path(content_digest, streaming, profile, skip_silence))
+            evict_least_recently_used(self.cache_dir, '.npz', self.max_bytes)
+        except OSError:
+            logger.warning('Failed to write frame-level features to disk cache', exc_info=True)
+
+    def get_or_compute(self, source, streaming=False, profile=None, skip_silence=False):
+        """
+        Return the cached frame-level features for the audio file, computing them on a miss.
+
+        Parameters
+        ----------
+        source : str, bytes or file-like object
+            Path to a saved audio file, or in-memory audio content.
+        streaming : bool
+            Whether to decode and featurize the file block by block on a miss.
+        profile : AnalysisProfile
+            (Optional) The analysis profile of the features. Defaults to the configured one.
+        skip_silence : bool
+            Whether to leave the chroma of silent chunks at zero on a miss, see
+            `compute_frame_features`.
+
+        Returns
+        -------
+        FrameFeatures
+        """
+        content_digest = get_content_digest(source)
+        options = {'streaming': streaming, 'profile': profile, 'skip_silence': skip_silence}
+        frames = self.get(content_digest, **options)
+        if frames is not None:
+            logger.info('Frame-level features loaded from cache')
+            return frames
+
+        frames = compute_frame_features(source, **options)
+        self.put(content_digest, frames, **options)
+        return frames
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Hit/miss counters.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _get_path(self, content_digest, streaming, profile=None, skip_silence=False):
+        analysis_signature = get_analysis_signature(profile)
+        key = _build_key(
+            content=content_digest,
+            analysis=analysis_signature,
+            streaming=streaming,
+            skip_silence=skip_silence,
+        )
+        return os.path.join(self.cache_dir, key + '.npz')
+
+
+def get_frame_cache():
+    """
+    Create a frame-level feature cache configured by environment variables:
+
+    * DECHORDER_FRAME_CACHE_DIR: cache directory (the cache is disabled if not set).
+    * DECHORDER_FRAME_CACHE_MAX_BYTES: (optional) size limit of the cache directory.
+
+    Returns
+    -------
+    FrameFeatureCache
+        A cache instance, or None if caching is disabled.
+    """
+    cache_dir = os.environ.get('DECHORDER_FRAME_CACHE_DIR')
+    if not cache_dir:
+        return None
+
+    max_bytes = int(os.environ.get(
+        'DECHORDER_FRAME_CACHE_MAX_BYTES',
+        DEFAULT_FRAME_CACHE_MAX_BYTES,
+    ))
+    return FrameFeatureCache(cache_dir, max_bytes)
+
+
+def warm_frame_cache(audio_dir, frame_cache, profile=None, skip_silence=True):
+    """
+    Featurize all supported audio files in a directory and store their frames in the cache.
+
+    Parameters
+    ----------
+    audio_dir : str
+        Directory with the audio files to featurize.
+    frame_cache : FrameFeatureCache
+        The cache to warm.
+    profile : AnalysisProfile
+        (Optional) The analysis profile to featurize with. Defaults to the configured one.
+    skip_silence : bool
+        Whether to leave the chroma of silent chunks at zero, as `recognize_saved_file` does
+        when not streaming.
+    """
+    filenames = sorted(
+        os.path.join(audio_dir, filename)
+        for filename in os.listdir(audio_dir)
+        if os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
+    )
+    logger.info(f'Found {len(filenames)} audio files in "{audio_dir}"')
+
+    for filename in filenames:
+        try:
+            frame_cache.get_or_compute(filename, profile=profile, skip_silence=skip_silence)
+        except Exception:
+            logger.warning(f'Failed to featurize "{filename}"', exc_info=True)
+
+    logger.info(f'Frame cache stats: {frame_cache.get_stats()}')
+
+
+def parse_command_line_args(args):
+    program_desc = 'Pre-warm the frame-level feature cache for a directory of recordings'
+    parser = argparse.ArgumentParser(description=program_desc)
+    parser.add_argument(
+        '--mode',
+        required=True,
+        metavar='MODE',
+        help='mode (currently, only "warm" is available)',
+    )
+    parser.add_argument(
+        '--audio-dir',
+        metavar='AUDIODIR',
+        required=True,
+        help='directory with the audio files to featurize',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        metavar='CACHEDIR',
+        required=True,
+        help='frame-level feature cache directory',
+    )
+    parser.add_argument(
+        '--max-bytes',
+        metavar='MAXBYTES',
+        type=int,
+        default=DEFAULT_FRAME_CACHE_MAX_BYTES,
+        help='(optional) size limit of the cache directory',
+    )
+    parser.add_argument(
+        '--analysis-profile',
+        metavar='PROFILE',
+        choices=list(ANALYSIS_PROFILES),
+        help='(optional) analysis profile to featurize with (default: DECHORDER_ANALYSIS_PROFILE)',
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    log_format = '{asctime} | {levelname:<8s} | {message} [{filename}:{lineno}]'
+    logging.basicConfig(level=logging.INFO, format=log_format, style='{')
+
+    logger.info('Running as a standalone script')
+    args = parse_command_line_args(sys.argv[1:])
+    if args.mode == 'warm':
+        frame_cache = FrameFeatureCache(args.cache_dir, args.max_bytes)
+        warm_frame_cache(args.audio_dir, frame_cache, get_analysis_profile(args.analysis_profile))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,28 @@
+import abc
+import contextlib
+import functools
+import inspect
+import io
 import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
 
 import librosa
 import numpy as np
 import pandas as pd
 
+from common.tracing import trace_stage, traced_iter
 from common.utilities import KnownRequestParseError
 
 
 logger = logging.getLogger(__name__)
 
 
-# Resample all uploaded files to this sample rate. Ideally, should match the SR used for training.
+# Resample all uploaded files to this sample rate by default (see ANALYSIS_PROFILES).
+# Ideally, should match the SR used for training.
 SUPPORTED_SAMPLE_RATE = 22050
 
 # Duration of a single unit of recognition. The input file will be split to chunks of this size.
@@ -22,6 +34,188 @@ ABSOLUTE_SILENCE_RMS_THRESHOLD = 1e-5
 # Signal with RMS lower than this percentile in the input file will be considered silence.
 ADAPTIVE_SILENCE_RMS_PERCENTILE = 25
 
+# STFT parameters (librosa defaults) used to compute the spectrogram by default
+# (see ANALYSIS_PROFILES).
+STFT_N_FFT = 2048
+STFT_HOP_LENGTH = 512
+
+# Resampler librosa uses when decoding (`res_type`).
+# Differs between librosa versions, like STFT_PAD_MODE.
+DEFAULT_RESAMPLER = inspect.signature(librosa.load).parameters['res_type'].default
+
+# Duration of a single audio block decoded at once by the streaming featurizer.
+# Peak memory of streaming featurization is proportional to this value, not to the file length.
+STREAMING_BLOCK_SECONDS = 30.0
+
+# Duration of audio featurized in a single batch by `iter_feature_blocks`.
+DEFAULT_FEATURE_BATCH_SECONDS = 30.0
+
+# Padding mode librosa.stft uses for centered frames. Differs between librosa versions,
+# so the streaming featurizer reads it from the signature to produce identical edge frames.
+STFT_PAD_MODE = inspect.signature(librosa.stft).parameters['pad_mode'].default
+
+# Number of STFT frames transformed at once by the float32 featurization engine. Bounds the size
+# of the complex intermediates, which are never allocated for the whole spectrogram.
+FFT_BLOCK_FRAMES = 256
+
+# Older librosa versions take the chroma filterbank tuning as a shifted reference pitch (A440)
+# instead.
+CHROMA_FILTERBANK_HAS_TUNING = 'tuning' in inspect.signature(librosa.filters.chroma).parameters
+
+# Names of the chroma features, in the order they appear in the feature vector.
+FEATURE_NAMES = [
+    'chroma-' + note
+    for note in ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+]
+
+
+class AnalysisProfile(object):
+    """
+    Signal analysis parameters: the sample rate the audio is resampled to, the STFT frame and hop
+    lengths, and the resampler (a librosa `res_type`). Chroma only needs content up to a few kHz,
+    so a lower sample rate loses little, while a longer frame resolves the low notes better.
+
+    Models are trained on features computed with a specific profile and should be used with the
+    same one.
+    """
+    def __init__(self, name, sample_rate, n_fft, hop_length, resampler):
+        if n_fft % hop_length:
+            raise ValueError('The FFT size must be a multiple of the hop length')
+        self.name = name
+        self.sample_rate = sample_rate
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.resampler = resampler
+
+    @property
+    def frames_per_second(self):
+        return self.sample_rate / self.hop_length
+
+    def get_parameters(self):
+        """
+        Returns
+        -------
+        dict
+            The parameters that affect the features, without the name.
+        """
+        return {
+            'sample_rate': self.sample_rate,
+            'n_fft': self.n_fft,
+            'hop_length': self.hop_length,
+            'resampler': self.resampler,
+        }
+
+    def to_dict(self):
+        return dict(name=self.name, **self.get_parameters())
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(
+            name=values['name'],
+            sample_rate=int(values['sample_rate']),
+            n_fft=int(values['n_fft']),
+            hop_length=int(values['hop_length']),
+            resampler=values['resampler'],
+        )
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, AnalysisProfile)
+            and self.get_parameters() == other.get_parameters()
+        )
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.get_parameters().items())))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'
+
+
+# Named analysis profiles.
+# "balanced" matches the librosa defaults the bundled model was trained with.
+ANALYSIS_PROFILES = {
+    # Half the sample rate (chroma up to 5.5 kHz) and half the frames: the same frequency resolution
+    # per bin as "balanced", at about half the decoding and STFT cost.
+    'fast': AnalysisProfile('fast', 11025, 1024, 512, 'soxr_mq'),
+    'balanced': AnalysisProfile(
+        'balanced', SUPPORTED_SAMPLE_RATE, STFT_N_FFT, STFT_HOP_LENGTH, DEFAULT_RESAMPLER,
+    ),
+    # Twice the frame length resolves adjacent semitones in the bass register.
+    'accurate': AnalysisProfile(
+        'accurate', SUPPORTED_SAMPLE_RATE, 2 * STFT_N_FFT, STFT_HOP_LENGTH, 'soxr_vhq',
+    ),
+}
+
+DEFAULT_ANALYSIS_PROFILE = 'balanced'
+
+
+def get_analysis_profile(name=None):
+    """
+    Look up a named analysis profile, by default the one configured by the
+    DECHORDER_ANALYSIS_PROFILE environment variable ('balanced' if not set).
+
+    Parameters
+    ----------
+    name : str
+        (Optional) Profile name from ANALYSIS_PROFILES, overrides DECHORDER_ANALYSIS_PROFILE.
+
+    Returns
+    -------
+    AnalysisProfile
+    """
+    name = name or os.environ.get('DECHORDER_ANALYSIS_PROFILE') or DEFAULT_ANALYSIS_PROFILE
+    if name not in ANALYSIS_PROFILES:
+        raise ValueError(
+            f'Unknown analysis profile: {name}. Expected one of: {", ".join(ANALYSIS_PROFILES)}'
+        )
+    return ANALYSIS_PROFILES[name]
+
+
+def get_analysis_signature(profile=None):
+    """
+    Describe the parameters that affect frame-level features, e.g. for building cache keys.
+
+    Parameters
+    ----------
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the configured one.
+
+    Returns
+    -------
+    dict
+    """
+    signature = (profile or get_analysis_profile()).get_parameters()
+    # Decoders differ slightly in resampling and MP3 encoder delay handling.
+    signature['audio_decoder'] = get_audio_decoder().name
+    signature['featurization_engine'] = get_featurization_engine(profile).name
+    return signature
+
+
+def get_featurization_signature(profile=None, skip_silence=False):
+    """
+    Describe the parameters that affect featurization results, e.g. for building cache keys.
+
+    Parameters
+    ----------
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the configured one.
+    skip_silence : bool
+        Whether the STFT over silent chunks is skipped, see `featurize_file_block`.
+
+    Returns
+    -------
+    dict
+    """
+    signature = get_analysis_signature(profile)
+    signature.update({
+        'seconds_per_chunk': SECONDS_PER_CHUNK,
+        'absolute_silence_rms_threshold': ABSOLUTE_SILENCE_RMS_THRESHOLD,
+        'adaptive_silence_rms_percentile': ADAPTIVE_SILENCE_RMS_PERCENTILE,
+        # Skipping the STFT over silent chunks estimates chroma tuning from non-silent frames only.
+        'silence_prepass': skip_silence,
+    })
+    return signature
+
 
 def is_chunk_silent(rms_chunk, adaptive_threshold):
     """
@@ -59,62 +253,1414 @@ def featurize_chroma_chunk(chunk):
     return np.mean(chunk, axis=1)
 
 
-def featurize_file(filename):
+class FeatureBlock(object):
     """
-    Extracts audio features from the specified audio file.
+    Array-backed audio features of a file, one row for each SECONDS_PER_CHUNK seconds.
+
+    Attributes
+    ----------
+    features : numpy.array
+        A 2D float32 array (n_chunks, 12) of chroma features, columns ordered as FEATURE_NAMES.
+    time_offsets : numpy.array
+        A 1D array of chunk start times in seconds.
+    is_silent : numpy.array
+        A 1D boolean mask of chunks considered silent.
+    """
+    def __init__(self, features, time_offsets, is_silent):
+        self.features = features
+        self.time_offsets = time_offsets
+        self.is_silent = is_silent
+
+    def __len__(self):
+        return len(self.time_offsets)
+
+    @property
+    def shape(self):
+        return self.features.shape
+
+    def get_non_silent(self):
+        """
+        Returns
+        -------
+        FeatureBlock
+            A block containing only the non-silent chunks.
+        """
+        with trace_stage('silence'):
+            mask = ~self.is_silent
+            return FeatureBlock(self.features[mask], self.time_offsets[mask], self.is_silent[mask])
+
+    def to_data_frame(self):
+        """
+        Returns
+        -------
+        pandas.DataFrame
+            A data frame with the chroma features plus 'time_offset' and 'is_silent' columns.
+        """
+        df = pd.DataFrame(self.features, columns=FEATURE_NAMES)
+        df['time_offset'] = self.time_offsets
+        df['is_silent'] = self.is_silent
+        return df
+
+
+@functools.lru_cache(maxsize=256)
+def get_chunk_starts(n_frames, frames_per_chunk):
+    """
+    Compute the frame indices at which each SECONDS_PER_CHUNK chunk starts.
+    The trailing partial chunk is merged into the last full one.
+
+    Recordings of the same length share the plan, so it is cached and returned read-only.
 
     Parameters
     ----------
-    filename : str
-        Path to a saved audio file.
+    n_frames : int
+        Total number of STFT frames.
+    frames_per_chunk : float
+        Number of STFT frames in a single chunk.
 
     Returns
     -------
-    pandas.DataFrame
-        A data frame with extracted audio features, one line for each SECONDS_PER_CHUNK seconds.
+    numpy.array
+        A 1D integer array of chunk start indices, beginning with 0.
+    """
+    chunk_starts = np.round(np.arange(0, n_frames, frames_per_chunk)).astype(int)
+    chunk_starts = chunk_starts[:-1] if len(chunk_starts) > 1 else chunk_starts
+    chunk_starts.flags.writeable = False
+    return chunk_starts
+
+
+def aggregate_chunks(rms, chroma, chunk_starts):
+    """
+    Featurize all chunks and detect silence in a single vectorized pass over the frames.
+
+    Parameters
+    ----------
+    rms : numpy.array
+        A 1D vector of frame-level RMS values.
+    chroma : numpy.array
+        A 2D array (12, n_frames) representing the chromagram.
+    chunk_starts : numpy.array
+        Frame indices at which each chunk starts, as returned by `get_chunk_starts`.
+
+    Returns
+    -------
+    FeatureBlock
     """
+    features = average_chunk_chroma(chroma, chunk_starts)
+    is_silent = detect_silent_chunks(rms, chunk_starts)
+    time_offsets = np.arange(0, len(chunk_starts)) * SECONDS_PER_CHUNK
+    return FeatureBlock(features, time_offsets, is_silent)
+
+
+def average_chunk_chroma(chroma, chunk_starts):
+    """
+    Average the chroma of the frames in each chunk, see `featurize_chroma_chunk`.
+
+    Parameters
+    ----------
+    chroma : numpy.array
+        A 2D array (12, n_frames) representing the chromagram.
+    chunk_starts : numpy.array
+        Frame indices at which each chunk starts. The last chunk ends with the last frame.
+
+    Returns
+    -------
+    numpy.array
+        A 2D float32 array (n_chunks, 12) of chroma features.
+    """
+    with trace_stage('chunking'):
+        chunk_lengths = np.diff(np.append(chunk_starts, chroma.shape[1]))
+        chroma_sums = np.add.reduceat(chroma, chunk_starts, axis=1, dtype=np.float64)
+        return (chroma_sums / chunk_lengths).T.astype(np.float32)
+
+
+def detect_silent_chunks(rms, chunk_starts):
+    """
+    Mark the chunks whose mean RMS is below the absolute or the adaptive silence threshold.
+
+    Parameters
+    ----------
+    rms : numpy.array
+        A 1D vector of frame-level RMS values.
+    chunk_starts : numpy.array
+        Frame indices at which each chunk starts, as returned by `get_chunk_starts`.
+
+    Returns
+    -------
+    numpy.array
+        A 1D boolean mask of silent chunks.
+    """
+    with trace_stage('silence'):
+        chunk_lengths = np.diff(np.append(chunk_starts, len(rms)))
+        mean_rms = np.add.reduceat(rms, chunk_starts, dtype=np.float64) / chunk_lengths
+        adaptive_rms_threshold = np.percentile(rms, ADAPTIVE_SILENCE_RMS_PERCENTILE)
+        return (mean_rms < ABSOLUTE_SILENCE_RMS_THRESHOLD) | (mean_rms < adaptive_rms_threshold)
+
+
+def compute_frame_rms(padded_signal, n_fft=STFT_N_FFT, hop_length=STFT_HOP_LENGTH,
+                      squared_window=None):
+    """
+    Compute frame-level RMS from the time-domain signal, without an STFT.
+
+    By Parseval's theorem, the result equals `librosa.feature.rms` of the magnitude spectrogram
+    (Hann-windowed frames), up to floating point error. The squared signal is split into hop-sized
+    blocks, each block is weighted by every hop-sized part of the squared window in one matrix
+    product, and each frame sums the weights of the blocks it covers.
+
+    Parameters
+    ----------
+    padded_signal : numpy.array
+        A 1D signal padded by n_fft // 2 samples on each side, as for a centered STFT.
+    n_fft : int
+        STFT frame length, a multiple of `hop_length`.
+    hop_length : int
+        STFT hop length.
+    squared_window : numpy.array
+        (Optional) The squared Hann window of length `n_fft`, if already computed.
+
+    Returns
+    -------
+    numpy.array
+        A 1D float32 vector of frame-level RMS values.
+    """
+    # n_fft is a multiple of hop_length, so each frame covers a whole number of blocks.
+    blocks_per_frame = n_fft // hop_length
+    n_frames = 1 + (len(padded_signal) - n_fft) // hop_length
+    n_blocks = n_frames + blocks_per_frame - 1
+
+    if squared_window is None:
+        squared_window = librosa.filters.get_window('hann', n_fft, fftbins=True) ** 2
+    squared_signal = padded_signal[:n_blocks * hop_length].astype(np.float64) ** 2
+    signal_blocks = squared_signal.reshape(n_blocks, hop_length)
+    block_weights = signal_blocks @ squared_window.reshape(blocks_per_frame, -1).T
+
+    power = np.zeros(n_frames)
+    for i in range(blocks_per_frame):
+        power += block_weights[i:i + n_frames, i]
+    return np.sqrt(power / n_fft).astype(np.float32)
+
+
+class FeaturizationEngine(object):
+    """
+    Computes spectrograms, RMS and chroma for a single analysis profile, keeping everything that
+    depends only on the profile between requests: the STFT window, its square for the time-domain
+    RMS, and a chroma filterbank (float32) for each tuning estimated so far. Chroma is then a single
+    product of the cached filterbank and the magnitude spectrogram, the same as
+    `librosa.feature.chroma_stft` computes.
+
+    Tuning is estimated in steps of TUNING_RESOLUTION, so at most 1 / TUNING_RESOLUTION + 1
+    filterbanks are kept per profile. Use `get_featurization_engine` to share engines within
+    the process.
+    """
+    name = 'default'
+
+    # Resolution of `librosa.estimate_tuning`, in fractions of a chroma bin.
+    TUNING_RESOLUTION = 0.01
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.window = librosa.filters.get_window('hann', profile.n_fft, fftbins=True)
+        self.squared_window = self.window ** 2
+        self._chroma_filterbanks = {}
+        self._lock = threading.Lock()
+
+    def compute_spectrogram(self, signal, center=True):
+        """
+        Compute the magnitude spectrogram of the signal with the STFT parameters of the profile.
+
+        Parameters
+        ----------
+        signal : numpy.array
+            A 1D signal sampled at the sample rate of the profile.
+        center : bool
+            Whether to pad the signal so that frames are centered, as `librosa.stft` does
+            by default.
+
+        Returns
+        -------
+        numpy.array
+            A 2D array (1 + n_fft // 2, n_frames).
+        """
+        with trace_stage('stft'):
+            return np.abs(librosa.stft(
+                signal,
+                n_fft=self.profile.n_fft,
+                hop_length=self.profile.hop_length,
+                window=self.window,
+                center=center,
+            ))
+
+    def compute_rms(self, spectrogram):
+        """
+        Returns
+        -------
+        numpy.array
+            A 1D vector of frame-level RMS values of the magnitude spectrogram.
+        """
+        with trace_stage('rms'):
+            return librosa.feature.rms(
+                S=spectrogram,
+                frame_length=self.profile.n_fft,
+                hop_length=self.profile.hop_length,
+            ).ravel()
+
+    def compute_frame_rms(self, padded_signal):
+        """
+        Compute frame-level RMS from the time-domain signal, see `compute_frame_rms`.
+
+        Returns
+        -------
+        numpy.array
+            A 1D float32 vector of frame-level RMS values.
+        """
+        with trace_stage('rms'):
+            return compute_frame_rms(padded_signal, self.profile.n_fft, self.profile.hop_length,
+                                     self.squared_window)
+
+    def estimate_tuning(self, spectrogram):
+        """
+        Returns
+        -------
+        float
+            The tuning deviation of the magnitude spectrogram from A440, in fractions
+            of a chroma bin.
+        """
+        with trace_stage('tuning'):
+            return librosa.estimate_tuning(S=spectrogram, sr=self.profile.sample_rate,
+                                           bins_per_octave=12)
+
+    def get_chroma_filterbank(self, tuning):
+        """
+        Get the chroma filterbank for the tuning, building it on first use.
+
+        Parameters
+        ----------
+        tuning : float
+            Tuning deviation from A440, in fractions of a chroma bin.
+
+        Returns
+        -------
+        numpy.array
+            A read-only float32 array (12, 1 + n_fft // 2).
+        """
+        key = round(float(tuning) / self.TUNING_RESOLUTION)
+        filterbank = self._chroma_filterbanks.get(key)
+        if filterbank is not None:
+            return filterbank
+
+        with self._lock:
+            if key not in self._chroma_filterbanks:
+                filterbank = build_chroma_filterbank(self.profile.sample_rate, self.profile.n_fft,
+                                                     tuning)
+                filterbank.flags.writeable = False
+                self._chroma_filterbanks[key] = filterbank
+            return self._chroma_filterbanks[key]
+
+    def compute_chroma(self, spectrogram, tuning=None):
+        """
+        Compute the chromagram of the magnitude spectrogram, like `librosa.feature.chroma_stft`.
+
+        Parameters
+        ----------
+        spectrogram : numpy.array
+            A 2D magnitude spectrogram (1 + n_fft // 2, n_frames).
+        tuning : float
+            (Optional) Tuning deviation from A440. Estimated from the spectrogram if omitted.
+
+        Returns
+        -------
+        numpy.array
+            A 2D array (12, n_frames), each frame normalized to a maximum of 1.
+        """
+        if tuning is None:
+            tuning = self.estimate_tuning(spectrogram)
+        with trace_stage('chroma'):
+            raw_chroma = self.get_chroma_filterbank(tuning) @ spectrogram
+            return librosa.util.normalize(raw_chroma, norm=np.inf, axis=0)
+
+
+def build_chroma_filterbank(sample_rate, n_fft, tuning):
+    """
+    Build the chroma filterbank `librosa.feature.chroma_stft` uses.
+
+    Parameters
+    ----------
+    sample_rate : int
+    n_fft : int
+    tuning : float
+        Tuning deviation from A440, in fractions of a chroma bin.
+
+    Returns
+    -------
+    numpy.array
+        A float32 array (12, 1 + n_fft // 2).
+    """
+    if CHROMA_FILTERBANK_HAS_TUNING:
+        filterbank = librosa.filters.chroma(sr=sample_rate, n_fft=n_fft, tuning=tuning)
+    else:
+        reference_pitch = 440.0 * 2.0 ** (float(tuning) / 12)
+        filterbank = librosa.filters.chroma(sr=sample_rate, n_fft=n_fft, A440=reference_pitch)
+    return filterbank.astype(np.float32)
+
+
+class Float32FeaturizationEngine(FeaturizationEngine):
+    """
+    A featurization engine that keeps the whole pipeline in single precision and bounds its
+    intermediates.
+
+    The magnitude spectrogram is computed FFT_BLOCK_FRAMES frames at a time from float32 windowed
+    frames, so the complex spectrogram of the whole signal is never allocated. RMS and the tuning
+    estimate are computed over the same column blocks: both are independent per frame, apart from
+    the median magnitude of the tuning estimate, which is taken over the sparse pitch candidates
+    of all blocks.
+    The results match the default engine up to float32 rounding.
+    """
+    name = 'float32'
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self.window_float32 = self.window.astype(np.float32)
+
+    def compute_spectrogram(self, signal, center=True):
+        with trace_stage('stft'):
+            n_fft, hop_length = self.profile.n_fft, self.profile.hop_length
+            signal = np.asarray(signal, dtype=np.float32)
+            if center:
+                signal = np.pad(signal, n_fft // 2, mode=STFT_PAD_MODE)
+            if len(signal) < n_fft:
+                raise ValueError(
+                    f'The signal is shorter than the FFT size ({len(signal)} < {n_fft})'
+                )
+
+            frames = librosa.util.frame(signal, frame_length=n_fft, hop_length=hop_length)
+            spectrogram = np.empty((1 + n_fft // 2, frames.shape[1]), dtype=np.float32)
+            for start in range(0, frames.shape[1], FFT_BLOCK_FRAMES):
+                block = slice(start, start + FFT_BLOCK_FRAMES)
+                windowed_frames = frames[:, block] * self.window_float32[:, np.newaxis]
+                np.abs(np.fft.rfft(windowed_frames, axis=0), out=spectrogram[:, block])
+            return spectrogram
+
+    def compute_rms(self, spectrogram):
+        with trace_stage('rms'):
+            return np.concatenate([
+                super(Float32FeaturizationEngine, self).compute_rms(
+                    spectrogram[:, start:start + FFT_BLOCK_FRAMES]
+                )
+                for start in range(0, spectrogram.shape[1], FFT_BLOCK_FRAMES)
+            ]).astype(np.float32, copy=False)
+
+    def estimate_tuning(self, spectrogram):
+        # The same as `librosa.estimate_tuning`, but keeps only the pitch candidates of each block
+        # instead of the full pitch and magnitude arrays.
+        with trace_stage('tuning'):
+            pitches = []
+            magnitudes = []
+            for start in range(0, spectrogram.shape[1], FFT_BLOCK_FRAMES):
+                pitch, magnitude = librosa.piptrack(
+                    S=spectrogram[:, start:start + FFT_BLOCK_FRAMES],
+                    sr=self.profile.sample_rate,
+                )
+                pitch_mask = pitch > 0
+                pitches.append(pitch[pitch_mask])
+                magnitudes.append(magnitude[pitch_mask])
+
+            pitches = np.concatenate(pitches)
+            magnitudes = np.concatenate(magnitudes)
+            threshold = np.median(magnitudes) if len(magnitudes) else 0.0
+            return librosa.pitch_tuning(
+                pitches[magnitudes >= threshold],
+                resolution=self.TUNING_RESOLUTION,
+                bins_per_octave=12,
+            )
+
+
+FEATURIZATION_ENGINES = {
+    engine_class.name: engine_class
+    for engine_class in [FeaturizationEngine, Float32FeaturizationEngine]
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_featurization_engine(profile=None, name=None):
+    """
+    Get the featurization engine of the analysis profile, shared by all requests in the process.
+    By default, uses the engine configured by the DECHORDER_FEATURIZATION_ENGINE environment
+    variable: 'default' or 'float32' (see `Float32FeaturizationEngine`).
+
+    Parameters
+    ----------
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+    name : str
+        (Optional) Engine name from FEATURIZATION_ENGINES, overrides DECHORDER_FEATURIZATION_ENGINE.
+
+    Returns
+    -------
+    FeaturizationEngine
+    """
+    name = name or os.environ.get('DECHORDER_FEATURIZATION_ENGINE') or FeaturizationEngine.name
+    if name not in FEATURIZATION_ENGINES:
+        raise ValueError(
+            f'Unknown featurization engine: {name}. '
+            f'Expected one of: {", ".join(FEATURIZATION_ENGINES)}'
+        )
+    return FEATURIZATION_ENGINES[name](profile or get_analysis_profile())
+
+
+def compute_frame_features_skipping_silence(signal, profile):
+    """
+    Compute frame-level RMS and chroma, running the STFT only over the non-silent chunks.
+
+    Silence is detected from the time-domain RMS first, with the same chunking and thresholds
+    as `aggregate_chunks`, so the chunks marked silent are the same as with a full STFT.
+    Each non-silent span is transformed together with the padding its edge frames need.
+    Chroma tuning is estimated from the non-silent frames only.
+
+    Parameters
+    ----------
+    signal : numpy.array
+        A 1D signal sampled at the sample rate of the profile.
+    profile : AnalysisProfile
+        Analysis profile.
+
+    Returns
+    -------
+    FrameFeatures
+        The chroma of the frames in silent chunks is zero.
+    """
+    engine = get_featurization_engine(profile)
+    pad_width = profile.n_fft // 2
+    padded_signal = np.pad(signal, pad_width, mode=STFT_PAD_MODE)
+    rms = engine.compute_frame_rms(padded_signal)
+    frames_per_second = len(rms) / (len(signal) / profile.sample_rate)
+
+    chunk_starts = get_chunk_starts(len(rms), frames_per_second * SECONDS_PER_CHUNK)
+    chunk_lengths = np.diff(np.append(chunk_starts, len(rms)))
+    is_frame_voiced = np.repeat(~detect_silent_chunks(rms, chunk_starts), chunk_lengths)
+    logger.info(f'Silence pre-pass: STFT over {is_frame_voiced.sum()} of {len(rms)} frames')
+
+    chroma = np.zeros((12, len(rms)), dtype=np.float32)
+    if not is_frame_voiced.any():
+        return FrameFeatures(rms, chroma, frames_per_second)
+
+    spectrogram = compute_voiced_spectrogram(engine, padded_signal, is_frame_voiced)
+    chroma[:, is_frame_voiced] = engine.compute_chroma(spectrogram)
+    return FrameFeatures(rms, chroma, frames_per_second)
+
+
+def compute_voiced_spectrogram(engine, padded_signal, is_frame_voiced):
+    """
+    Compute the magnitude spectrogram of the voiced frames only. Each span of consecutive voiced
+    frames is transformed together with the padding its edge frames need, so the frames are the same
+    as with a centered STFT over the whole signal.
+
+    Parameters
+    ----------
+    engine : FeaturizationEngine
+        The featurization engine of the analysis profile.
+    padded_signal : numpy.array
+        A 1D signal padded with n_fft // 2 samples at both ends, as for a centered STFT.
+    is_frame_voiced : numpy.array
+        A 1D boolean mask of the frames to compute, at least one of them True.
+
+    Returns
+    -------
+    numpy.array
+        A 2D array (1 + n_fft // 2, n_voiced_frames).
+    """
+    n_fft, hop_length = engine.profile.n_fft, engine.profile.hop_length
+
+    # Frame ranges [start, end) of consecutive voiced frames.
+    is_voiced = np.concatenate([[0], is_frame_voiced.astype(np.int8), [0]])
+    span_edges = np.flatnonzero(np.diff(is_voiced))
+    span_starts, span_ends = span_edges[0::2], span_edges[1::2]
+    return np.concatenate([
+        engine.compute_spectrogram(
+            padded_signal[start * hop_length:(end - 1) * hop_length + n_fft],
+            center=False,
+        )
+        for start, end in zip(span_starts, span_ends)
+    ], axis=1)
+
+
+class FrameFeatures(object):
+    """
+    Frame-level audio features of a file. They depend only on the analysis profile
+    (sample rate, FFT size, hop length, resampler), not on chunking or the prediction model.
+
+    Attributes
+    ----------
+    rms : numpy.array
+        A 1D vector of frame-level RMS values.
+    chroma : numpy.array
+        A 2D array (12, n_frames) representing the chromagram.
+    frames_per_second : float
+        Number of STFT frames per second of audio.
+    """
+    def __init__(self, rms, chroma, frames_per_second):
+        self.rms = rms
+        self.chroma = chroma
+        self.frames_per_second = frames_per_second
+
+    def aggregate(self):
+        """
+        Split the frames into SECONDS_PER_CHUNK chunks and featurize each chunk.
+
+        Returns
+        -------
+        FeatureBlock
+        """
+        logger.info('Generating features')
+        frames_per_chunk = self.frames_per_second * SECONDS_PER_CHUNK
+        chunk_starts = get_chunk_starts(len(self.rms), frames_per_chunk)
+        return aggregate_chunks(self.rms, self.chroma, chunk_starts)
+
+
+def is_in_memory_source(source):
+    """
+    Checks whether the audio source is in-memory content rather than a path to a saved file.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+
+    Returns
+    -------
+    bool
+    """
+    return not isinstance(source, (str, os.PathLike))
+
+
+def describe_audio_source(source):
+    """
+    Returns a short description of the audio source, suitable for log messages.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+
+    Returns
+    -------
+    str
+    """
+    if not is_in_memory_source(source):
+        return f'"{source}"'
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f'<in-memory audio, {len(source)} bytes>'
+    return '<in-memory audio stream>'
+
+
+def open_audio_buffer(source):
+    """
+    Returns a seekable binary buffer positioned at the beginning of the in-memory audio content.
+
+    Parameters
+    ----------
+    source : bytes or file-like object
+        Raw file content, or a seekable binary file-like object.
+
+    Returns
+    -------
+    file-like object
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    source.seek(0)
+    return source
+
+
+@contextlib.contextmanager
+def spool_audio_to_file(source):
+    """
+    Writes the in-memory audio content to a temporary file, for decoders that need a real file.
+    The file is deleted on exit.
+
+    Parameters
+    ----------
+    source : bytes or file-like object
+
+    Yields
+    ------
+    str
+        Path to the temporary file.
+    """
+    with tempfile.NamedTemporaryFile(prefix='dechorder-') as fp:
+        shutil.copyfileobj(open_audio_buffer(source), fp)
+        fp.flush()
+        logger.info(f'Spooled in-memory audio to a temporary file: "{fp.name}"')
+        yield fp.name
+
+
+# Downmix to mono by averaging the channels, like librosa does. The default downmix of ffmpeg
+# (`-ac 1`) is louder, which would shift the silence threshold. Missing channels are ignored,
+# "<" normalizes the gains.
+FFMPEG_DOWNMIX_FILTER = 'pan=mono|c0<' + '+'.join(f'c{channel}' for channel in range(8))
+
+
+class AudioDecoder(object):
+    """
+    Abstract class for a backend that decodes audio files to a mono signal at the sample rate
+    of an analysis profile.
+    """
+    name = None
+
+    @abc.abstractmethod
+    def decode(self, source, profile):
+        """
+        Decode the whole audio source, downmixing it to mono and resampling to the sample rate
+        of the profile.
+
+        Parameters
+        ----------
+        source : str, bytes or file-like object
+            Path to a saved audio file, raw file content, or a seekable binary file-like object.
+        profile : AnalysisProfile
+            Analysis profile with the target sample rate and the resampler.
+
+        Returns
+        -------
+        tuple
+            (signal, sample_rate)
+        """
+        pass
+
+
+class LibrosaAudioDecoder(AudioDecoder):
+    """
+    Decodes audio with `librosa.load` (soundfile or audioread) and resamples it with the resampler
+    of the profile.
+
+    In-memory content is decoded from memory when the format allows it (WAV, MP3, FLAC, OGG).
+    Other formats (e.g. M4A) need a seekable file for the decoder and are spooled to a temporary
+    file.
+    """
+    name = 'librosa'
+
+    def decode(self, source, profile):
+        load = functools.partial(librosa.load, sr=profile.sample_rate, res_type=profile.resampler)
+        if not is_in_memory_source(source):
+            return load(source)
+
+        try:
+            return load(open_audio_buffer(source))
+        except Exception:
+            logger.info(
+                'The format cannot be decoded from memory, falling back to a temporary file'
+            )
+            with spool_audio_to_file(source) as path:
+                return load(path)
+
+
+class FFmpegAudioDecoder(AudioDecoder):
+    """
+    Decodes audio in an ffmpeg subprocess that downmixes and resamples it as well, and writes
+    float32 PCM at the sample rate of the profile to a pipe, read directly into the signal array.
+    ffmpeg uses its own resampler rather than the one set in the profile.
+
+    In-memory content is piped to ffmpeg. Formats that need a seekable input (e.g. M4A with
+    the index at the end) are spooled to a temporary file.
+    """
+    name = 'ffmpeg'
+
+    def __init__(self, ffmpeg_path='ffmpeg'):
+        self.ffmpeg_path = ffmpeg_path
+
+    def decode(self, source, profile):
+        if not is_in_memory_source(source):
+            return self.run_ffmpeg(['-nostdin', '-i', source], profile.sample_rate)
+
+        try:
+            content = open_audio_buffer(source).read()
+            signal, sample_rate = self.run_ffmpeg(['-i', 'pipe:0'], profile.sample_rate, content)
+            # ffmpeg may decode nothing without failing if the format needs seeking.
+            if len(signal):
+                return signal, sample_rate
+        except RuntimeError:
+            pass
+
+        logger.info('The format cannot be decoded from a pipe, falling back to a temporary file')
+        with spool_audio_to_file(source) as path:
+            return self.run_ffmpeg(['-nostdin', '-i', path], profile.sample_rate)
+
+    def iter_blocks(self, source, profile, block_seconds=STREAMING_BLOCK_SECONDS):
+        """
+        Decode the audio source block by block, reading the PCM output of ffmpeg as it is produced.
+
+        Parameters
+        ----------
+        source : str, bytes or file-like object
+            Path to a saved audio file, raw file content, or a seekable binary file-like object.
+        profile : AnalysisProfile
+            Analysis profile with the target sample rate.
+        block_seconds : float
+            Duration of a single decoded block.
+
+        Yields
+        ------
+        numpy.array
+            1D float32 signal blocks sampled at the sample rate of the profile.
+        """
+        if is_in_memory_source(source):
+            with spool_audio_to_file(source) as path:
+                yield from self.iter_blocks(path, profile, block_seconds)
+            return
+
+        process = subprocess.Popen(
+            self.get_command(['-nostdin', '-i', source], profile.sample_rate),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        block_bytes = int(block_seconds * profile.sample_rate) * np.dtype(np.float32).itemsize
+        is_finished = False
+        try:
+            while True:
+                content = process.stdout.read(block_bytes)
+                if not content:
+                    break
+                yield np.frombuffer(content, dtype='<f4')
+            is_finished = True
+        finally:
+            if not is_finished:
+                # The consumer stopped early or failed, no need to decode the rest.
+                process.kill()
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            process.wait()
+
+        if process.returncode != 0:
+            raise RuntimeError(self.get_error_message(process.returncode, stderr))
+
+    def run_ffmpeg(self, input_args, sample_rate, content=None):
+        process = subprocess.run(
+            self.get_command(input_args, sample_rate),
+            input=content,
+            stdin=subprocess.DEVNULL if content is None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if process.returncode != 0:
+            raise RuntimeError(self.get_error_message(process.returncode, process.stderr))
+
+        # A read-only view of the ffmpeg output, without copying it.
+        return np.frombuffer(process.stdout, dtype='<f4'), sample_rate
+
+    def get_command(self, input_args, sample_rate, output_args=()):
+        return [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error'] + input_args + [
+            '-vn',
+            '-af', FFMPEG_DOWNMIX_FILTER,
+            '-ar', str(sample_rate),
+            '-f', 'f32le',
+        ] + list(output_args) + ['pipe:1']
+
+    @staticmethod
+    def get_error_message(returncode, stderr):
+        error_lines = stderr.decode('utf-8', errors='replace').strip().splitlines()
+        return error_lines[-1] if error_lines else f'ffmpeg exited with code {returncode}'
+
+
+@functools.lru_cache(maxsize=None)
+def get_audio_decoder(name=None):
+    """
+    Create an audio decoder, by default the one configured by environment variables:
+
+    * DECHORDER_AUDIO_DECODER: 'librosa' (default) or 'ffmpeg'.
+    * DECHORDER_FFMPEG_PATH: (optional) path to the ffmpeg binary, if not on PATH.
+
+    The ffmpeg decoder falls back to librosa if the ffmpeg binary cannot be found.
+
+    Parameters
+    ----------
+    name : str
+        (Optional) Decoder name, overrides DECHORDER_AUDIO_DECODER.
+
+    Returns
+    -------
+    AudioDecoder
+    """
+    name = name or os.environ.get('DECHORDER_AUDIO_DECODER', LibrosaAudioDecoder.name)
+    if name == FFmpegAudioDecoder.name:
+        ffmpeg_path = shutil.which(os.environ.get('DECHORDER_FFMPEG_PATH') or 'ffmpeg')
+        if ffmpeg_path:
+            return FFmpegAudioDecoder(ffmpeg_path)
+        logger.warning('ffmpeg is not available, falling back to the librosa audio decoder')
+        return LibrosaAudioDecoder()
+
+    if name == LibrosaAudioDecoder.name:
+        return LibrosaAudioDecoder()
+
+    raise ValueError(f'Unknown audio decoder: {name}')
+
+
+def load_audio(source, decoder=None, profile=None):
+    """
+    Decodes the whole audio source, downmixing it to mono and resampling to the sample rate
+    of the analysis profile.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    decoder : AudioDecoder
+        (Optional) The decoder to use instead of the one configured by `get_audio_decoder`.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Returns
+    -------
+    tuple
+        (signal, sample_rate)
+    """
+    decoder = decoder or get_audio_decoder()
+    profile = profile or get_analysis_profile()
+    logger.info(
+        f'Reading audio file with {decoder.name} ({profile.name} profile): '
+        f'{describe_audio_source(source)}'
+    )
     try:
-        logger.info(f'Reading audio file: "{str(filename)}"')
-        signal, sample_rate = librosa.load(filename, sr=SUPPORTED_SAMPLE_RATE)
+        with trace_stage('decode'):
+            return decoder.decode(source, profile)
     except Exception as e:
         error_desc = str(e) or e.__class__.__name__
         raise KnownRequestParseError('Cannot load audio file. Error: ' + error_desc)
 
+
+def compute_frame_features(filename, streaming=False, block_seconds=STREAMING_BLOCK_SECONDS,
+                           skip_silence=False, profile=None):
+    """
+    Decodes the specified audio file and computes frame-level RMS and chroma.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    streaming : bool
+        Whether to decode and featurize the file block by block to keep memory usage bounded.
+    block_seconds : float
+        Duration of a single block of audio to decode at once when streaming.
+    skip_silence : bool
+        Whether to detect silent chunks from the time-domain signal first and leave their chroma
+        at zero, see `compute_frame_features_skipping_silence`. Ignored when streaming.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Returns
+    -------
+    FrameFeatures
+    """
+    profile = profile or get_analysis_profile()
+    if streaming:
+        return _compute_frame_features_streaming(filename, block_seconds, profile)
+
+    signal, sample_rate = load_audio(filename, profile=profile)
+
     duration = len(signal) / sample_rate
     logger.info(f'File duration: {duration:.1f} seconds')
 
-    spectrogram = np.abs(librosa.stft(signal))
+    if skip_silence:
+        return compute_frame_features_skipping_silence(signal, profile)
+
+    engine = get_featurization_engine(profile)
+    spectrogram = engine.compute_spectrogram(signal)
     spectrogram_per_second = spectrogram.shape[1] / duration
     logger.info(f'Spectrogram shape: {spectrogram.shape}')
 
-    rms = librosa.feature.rms(S=spectrogram).T.ravel()
-    chroma = librosa.feature.chroma_stft(S=spectrogram, sr=sample_rate)
-    adaptive_rms_threshold = np.percentile(rms, ADAPTIVE_SILENCE_RMS_PERCENTILE)
-
-    # Split RMS and Chroma arrays into equally sized chunks, each taking SECONDS_PER_CHUNK.
-    chunk_split_points = np.arange(0, chroma.shape[-1], spectrogram_per_second * SECONDS_PER_CHUNK)
-    chunk_split_points = np.round(chunk_split_points).astype(int)[1:-1]
-    rms_chunks = np.split(rms, chunk_split_points)
-    chroma_chunks = np.split(chroma, chunk_split_points, axis=1)
-    time_markers = np.arange(0, len(chroma_chunks)) * SECONDS_PER_CHUNK
-
-    # Featurize each chunk, detect silence, and store the results as a DataFrame row.
-    logger.info('Generating features')
-    features = [
-        featurize_chroma_chunk(chunk)
-        for chunk in chroma_chunks
-    ]
-    feature_names = [
-        'chroma-' + note
-        for note in ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-    ]
-    is_silent = [
-        is_chunk_silent(chunk, adaptive_rms_threshold)
-        for chunk in rms_chunks
-    ]
-
-    # Assemble results.
-    df = pd.DataFrame(features, columns=feature_names)
-    df['time_offset'] = np.array(time_markers)
-    df['is_silent'] = np.array(is_silent)
-    return df
+    rms = engine.compute_rms(spectrogram)
+    chroma = engine.compute_chroma(spectrogram)
+    return FrameFeatures(rms, chroma, spectrogram_per_second)
+
+
+def featurize_file_block(filename, streaming=False, block_seconds=STREAMING_BLOCK_SECONDS,
+                         skip_silence=False, profile=None):
+    """
+    Extracts audio features from the specified audio file as an array-backed block.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    streaming : bool
+        Whether to decode and featurize the file block by block to keep memory usage bounded.
+    block_seconds : float
+        Duration of a single block of audio to decode at once when streaming.
+    skip_silence : bool
+        Whether to skip the STFT over silent chunks.
+        Their features are zero, but `is_silent` is the same. Ignored when streaming.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Returns
+    -------
+    FeatureBlock
+        Extracted audio features, one row for each SECONDS_PER_CHUNK seconds.
+    """
+    if streaming:
+        return _featurize_file_block_streaming(filename, block_seconds,
+                                               profile or get_analysis_profile())
+
+    frame_features = compute_frame_features(filename, skip_silence=skip_silence, profile=profile)
+    return frame_features.aggregate()
+
+
+def featurize_file(filename, profile=None):
+    """
+    Extracts audio features from the specified audio file.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A data frame with extracted audio features, one line for each SECONDS_PER_CHUNK seconds.
+    """
+    return featurize_file_block(filename, profile=profile).to_data_frame()
+
+
+def iter_feature_blocks(filename, batch_seconds=DEFAULT_FEATURE_BATCH_SECONDS, profile=None):
+    """
+    Extracts audio features from the specified audio file in time-ordered batches of chunks,
+    so that the first chunks can be used before the whole file has been featurized.
+
+    The file is decoded at once, and silence is detected over the whole file from the time-domain
+    RMS, so `is_silent` is the same as with `featurize_file_block(skip_silence=True)`. The STFT
+    and chroma then run batch by batch over the non-silent chunks. Chroma tuning is estimated from
+    the first batch with non-silent chunks and reused for the rest of the file, as when streaming.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    batch_seconds : float
+        Duration of audio featurized in a single batch.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Yields
+    ------
+    FeatureBlock
+        Extracted audio features of the next batch, one row for each SECONDS_PER_CHUNK seconds.
+    """
+    profile = profile or get_analysis_profile()
+    signal, sample_rate = load_audio(filename, profile=profile)
+    logger.info(f'File duration: {len(signal) / sample_rate:.1f} seconds')
+
+    engine = get_featurization_engine(profile)
+    padded_signal = np.pad(signal, profile.n_fft // 2, mode=STFT_PAD_MODE)
+    rms = engine.compute_frame_rms(padded_signal)
+    frames_per_second = len(rms) / (len(signal) / profile.sample_rate)
+    chunk_starts = get_chunk_starts(len(rms), frames_per_second * SECONDS_PER_CHUNK)
+    is_silent = detect_silent_chunks(rms, chunk_starts)
+    chunk_ends = np.append(chunk_starts[1:], len(rms))
+
+    chunks_per_batch = max(int(batch_seconds / SECONDS_PER_CHUNK), 1)
+    tuning = None
+    for batch_start in range(0, len(chunk_starts), chunks_per_batch):
+        batch = slice(batch_start, batch_start + chunks_per_batch)
+        frame_start, frame_end = chunk_starts[batch][0], chunk_ends[batch][-1]
+        batch_chunk_starts = chunk_starts[batch] - frame_start
+        chunk_lengths = np.diff(np.append(batch_chunk_starts, frame_end - frame_start))
+        is_frame_voiced = np.repeat(~is_silent[batch], chunk_lengths)
+
+        chroma = np.zeros((12, frame_end - frame_start), dtype=np.float32)
+        if is_frame_voiced.any():
+            signal_start = frame_start * profile.hop_length
+            signal_end = (frame_end - 1) * profile.hop_length + profile.n_fft
+            batch_signal = padded_signal[signal_start:signal_end]
+            spectrogram = compute_voiced_spectrogram(engine, batch_signal, is_frame_voiced)
+            if tuning is None:
+                tuning = engine.estimate_tuning(spectrogram)
+            chroma[:, is_frame_voiced] = engine.compute_chroma(spectrogram, tuning=tuning)
+
+        batch_end = batch_start + len(batch_chunk_starts)
+        time_offsets = np.arange(batch_start, batch_end) * SECONDS_PER_CHUNK
+        chunk_chroma = average_chunk_chroma(chroma, batch_chunk_starts)
+        yield FeatureBlock(chunk_chroma, time_offsets, is_silent[batch])
+
+
+def iter_audio_blocks(filename, block_seconds=STREAMING_BLOCK_SECONDS, profile=None):
+    """
+    Decodes the specified audio file block by block, downmixing and resampling it on the fly.
+
+    Uses the ffmpeg decoder if it is configured, otherwise soundfile + soxr when available.
+    Formats soundfile cannot read (e.g. M4A) fall back to decoding the whole file with librosa
+    and slicing it, which is correct but not memory-bounded.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    block_seconds : float
+        Duration of a single decoded block.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Yields
+    ------
+    numpy.array
+        1D float32 signal blocks sampled at the sample rate of the profile.
+    """
+    profile = profile or get_analysis_profile()
+    decoder = get_audio_decoder()
+    if isinstance(decoder, FFmpegAudioDecoder):
+        yield from decoder.iter_blocks(filename, profile, block_seconds)
+        return
+
+    try:
+        # Both are needed below, fall back to whole-file decoding if either is missing.
+        import soundfile
+        import soxr
+        if is_in_memory_source(filename):
+            audio_file = soundfile.SoundFile(open_audio_buffer(filename))
+        else:
+            audio_file = soundfile.SoundFile(filename)
+    except Exception:
+        logger.info('Block decoding is not available for this file, decoding it as a whole')
+        signal, sample_rate = load_audio(filename, profile=profile)
+        block_size = int(block_seconds * sample_rate)
+        for start in range(0, len(signal), block_size):
+            yield signal[start:start + block_size]
+        return
+
+    with audio_file:
+        native_rate = audio_file.samplerate
+        resampler = None
+        if native_rate != profile.sample_rate:
+            resampler = create_resample_stream(native_rate, profile)
+
+        block_size = int(block_seconds * native_rate)
+        for block in audio_file.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+            block = np.mean(block, axis=1)
+            if resampler:
+                block = resampler.resample_chunk(block)
+            yield block
+
+        if resampler:
+            yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+def create_resample_stream(native_rate, profile):
+    """
+    Create a soxr resampler for a mono float32 signal that arrives block by block.
+    Requires the `soxr` package.
+
+    Parameters
+    ----------
+    native_rate : int
+        Sample rate of the input signal.
+    profile : AnalysisProfile
+        Analysis profile with the target sample rate and the resampler.
+
+    Returns
+    -------
+    soxr.ResampleStream
+    """
+    import soxr
+
+    # The soxr quality of the profile resampler (e.g. "soxr_vhq"),
+    # other librosa resamplers map to HQ.
+    quality = 'HQ'
+    if profile.resampler.startswith('soxr_'):
+        quality = profile.resampler[len('soxr_'):].upper()
+    return soxr.ResampleStream(native_rate, profile.sample_rate, num_channels=1, dtype='float32',
+                               quality=quality)
+
+
+class RMSHistogram(object):
+    """
+    Estimates percentiles of a stream of RMS values in constant memory and time, from a histogram
+    with log-spaced bins: 100 bins per decade keep the relative error of an estimate below 2.4%.
+    """
+    BINS_PER_DECADE = 100
+    MIN_LOG10_RMS = -12
+    MAX_LOG10_RMS = 2
+
+    def __init__(self):
+        n_bins = (self.MAX_LOG10_RMS - self.MIN_LOG10_RMS) * self.BINS_PER_DECADE
+        self.bin_edges = np.logspace(self.MIN_LOG10_RMS, self.MAX_LOG10_RMS, n_bins + 1)
+        # Plus an underflow and an overflow bin.
+        self.counts = np.zeros(n_bins + 2, dtype=np.int64)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def add(self, rms):
+        """
+        Parameters
+        ----------
+        rms : numpy.array
+            A 1D vector of RMS values.
+        """
+        bin_indices = np.searchsorted(self.bin_edges, rms, side='right')
+        self.counts += np.bincount(bin_indices, minlength=len(self.counts))
+
+    def percentile(self, q):
+        """
+        Parameters
+        ----------
+        q : float
+            Percentile to estimate, from 0 to 100.
+
+        Returns
+        -------
+        float
+            The estimate, interpolated geometrically within its bin, or 0.0 if there are no values.
+        """
+        n_values = len(self)
+        if not n_values:
+            return 0.0
+
+        # The rank of the percentile, as `np.percentile` computes it.
+        rank = q / 100 * (n_values - 1)
+        cumulative_counts = np.cumsum(self.counts)
+        bin_index = int(np.searchsorted(cumulative_counts, rank, side='right'))
+        if bin_index == 0:
+            return 0.0
+        if bin_index == len(self.counts) - 1:
+            return float(self.bin_edges[-1])
+
+        fraction = (rank - cumulative_counts[bin_index - 1]) / self.counts[bin_index]
+        lower_edge, upper_edge = self.bin_edges[bin_index - 1], self.bin_edges[bin_index]
+        return float(lower_edge * (upper_edge / lower_edge) ** fraction)
+
+
+class StreamingFeaturizer(object):
+    """
+    Computes chunk-level audio features incrementally from consecutive signal blocks.
+
+    STFT frames that straddle block boundaries are carried over to the next block, so the
+    resulting frames are identical to a centered `librosa.stft` over the whole signal.
+    The adaptive silence threshold of the frames so far is estimated from an `RMSHistogram`,
+    so memory does not grow with the signal. With `keep_frames`, the frame-level RMS and chroma
+    are retained for the entire signal, and the threshold is exact. With `keep_rms`, only the
+    frame-level RMS is retained, which is enough for the exact threshold.
+
+    For a file, the trailing partial chunk is merged into the last full one, as in `featurize_file`,
+    so each chunk is emitted one chunk later than it completes. With `live`, the end of the signal
+    is unknown: each chunk is emitted as soon as its last frame is computed, and the trailing
+    partial chunk becomes a chunk of its own.
+    """
+    def __init__(self, profile=None, keep_frames=False, keep_rms=False, live=False):
+        self.profile = profile or get_analysis_profile()
+        self.engine = get_featurization_engine(self.profile)
+        self.sample_rate = self.profile.sample_rate
+        self.frames_per_chunk = self.profile.frames_per_second * SECONDS_PER_CHUNK
+        self.keep_frames = keep_frames
+        self.keep_rms = keep_frames or keep_rms
+        self.live = live
+        self.tuning = None
+        self.duration = 0.0
+
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._is_padded = False
+        self._frame_count = 0
+        self._chunk_index = 0
+        self._pending_chroma = np.zeros((12, 0), dtype=np.float32)
+        self._pending_rms = np.zeros(0, dtype=np.float32)
+        self._rms_histogram = RMSHistogram()
+        self._rms_history = []
+        self._chroma_history = []
+
+    def push(self, samples):
+        """
+        Feed the next block of the signal.
+
+        Parameters
+        ----------
+        samples : numpy.array
+            A 1D signal block sampled at `sample_rate`.
+
+        Returns
+        -------
+        list
+            Completed chunks as (time_offset, chroma_features, mean_rms) tuples.
+        """
+        self.duration += len(samples) / self.sample_rate
+        self._buffer = np.concatenate([self._buffer, samples.astype(np.float32)])
+        self._compute_frames(is_final=False)
+        return self._collect_chunks(is_final=False)
+
+    def finish(self):
+        """
+        Flush the remaining signal and return the last chunk(s).
+
+        Returns
+        -------
+        list
+            Completed chunks as (time_offset, chroma_features, mean_rms) tuples.
+        """
+        self._compute_frames(is_final=True)
+        return self._collect_chunks(is_final=True)
+
+    def get_adaptive_rms_threshold(self):
+        """
+        Compute the adaptive silence threshold from all frames processed so far:
+        exactly with `keep_frames` or `keep_rms`, otherwise an estimate in constant time.
+
+        Returns
+        -------
+        float
+        """
+        if not self.keep_rms:
+            return self._rms_histogram.percentile(ADAPTIVE_SILENCE_RMS_PERCENTILE)
+        if not self._rms_history:
+            return 0.0
+        return np.percentile(np.concatenate(self._rms_history), ADAPTIVE_SILENCE_RMS_PERCENTILE)
+
+    def get_frame_features(self):
+        """
+        Collect all frames processed so far. Requires `keep_frames`.
+
+        Returns
+        -------
+        FrameFeatures
+        """
+        rms = np.concatenate(self._rms_history or [np.zeros(0, dtype=np.float32)])
+        chroma = np.concatenate(
+            self._chroma_history or [np.zeros((12, 0), dtype=np.float32)],
+            axis=1,
+        )
+        return FrameFeatures(rms, chroma, self.profile.frames_per_second)
+
+    def _compute_frames(self, is_final):
+        # Chroma tuning is estimated from the first frames, so small blocks (e.g. live input)
+        # are collected until there is at least a chunk of signal.
+        if self.tuning is None and not is_final and self.duration < SECONDS_PER_CHUNK:
+            return
+
+        n_fft, hop_length = self.profile.n_fft, self.profile.hop_length
+        pad_width = n_fft // 2
+        if not self._is_padded:
+            if len(self._buffer) <= pad_width and not is_final:
+                return
+            self._buffer = np.pad(self._buffer, (pad_width, 0), mode=STFT_PAD_MODE)
+            self._is_padded = True
+
+        if is_final:
+            self._buffer = np.pad(self._buffer, (0, pad_width), mode=STFT_PAD_MODE)
+
+        if len(self._buffer) < n_fft:
+            return
+
+        n_frames = 1 + (len(self._buffer) - n_fft) // hop_length
+        frame_span = (n_frames - 1) * hop_length + n_fft
+        spectrogram = self.engine.compute_spectrogram(self._buffer[:frame_span], center=False)
+        self._buffer = self._buffer[n_frames * hop_length:]
+
+        # Chroma tuning is estimated once, from the first block, and reused for the whole stream.
+        if self.tuning is None:
+            self.tuning = self.engine.estimate_tuning(spectrogram)
+
+        rms = self.engine.compute_rms(spectrogram).astype(np.float32)
+        chroma = self.engine.compute_chroma(spectrogram, tuning=self.tuning)
+        if self.keep_rms:
+            self._rms_history.append(rms)
+        else:
+            self._rms_histogram.add(rms)
+        if self.keep_frames:
+            self._chroma_history.append(chroma.astype(np.float32))
+        self._pending_rms = np.concatenate([self._pending_rms, rms])
+        self._pending_chroma = np.concatenate([self._pending_chroma, chroma], axis=1)
+        self._frame_count += n_frames
+
+    def _collect_chunks(self, is_final):
+        # The last chunk absorbs the trailing partial chunk, same as in `featurize_file`,
+        # so a chunk is emitted only when we know at least one more chunk follows it.
+        chunks_ahead = 1 if self.live else 2
+        chunks = []
+        with trace_stage('chunking'):
+            while self._frame_count > (self._chunk_index + chunks_ahead) * self.frames_per_chunk:
+                chunk_start = int(np.round(self._chunk_index * self.frames_per_chunk))
+                chunk_end = int(np.round((self._chunk_index + 1) * self.frames_per_chunk))
+                chunks.append(self._pop_chunk(chunk_end - chunk_start))
+
+            if is_final and len(self._pending_rms):
+                chunks.append(self._pop_chunk(len(self._pending_rms)))
+        return chunks
+
+    def _pop_chunk(self, chunk_length):
+        time_offset = self._chunk_index * SECONDS_PER_CHUNK
+        chunk = (
+            time_offset,
+            featurize_chroma_chunk(self._pending_chroma[:, :chunk_length]),
+            np.mean(self._pending_rms[:chunk_length]),
+        )
+        self._pending_chroma = self._pending_chroma[:, chunk_length:]
+        self._pending_rms = self._pending_rms[chunk_length:]
+        self._chunk_index += 1
+        return chunk
+
+
+def _iter_streaming_chunks(featurizer, filename, block_seconds, profile):
+    # Decodes the file block by block and yields the chunks as the featurizer completes them.
+    source_description = describe_audio_source(filename)
+    logger.info(f'Reading audio file in {block_seconds:.0f}-second blocks: {source_description}')
+    try:
+        for block in traced_iter('decode', iter_audio_blocks(filename, block_seconds, profile)):
+            yield from featurizer.push(block)
+    except KnownRequestParseError:
+        raise
+    except Exception as e:
+        error_desc = str(e) or e.__class__.__name__
+        raise KnownRequestParseError('Cannot load audio file. Error: ' + error_desc)
+    yield from featurizer.finish()
+
+
+def _compute_frame_features_streaming(filename, block_seconds, profile):
+    # The frame cache stores every frame, so they are all retained here.
+    featurizer = StreamingFeaturizer(profile, keep_frames=True)
+    for _ in _iter_streaming_chunks(featurizer, filename, block_seconds, profile):
+        pass
+
+    frames = featurizer.get_frame_features()
+    if not len(frames.rms):
+        raise KnownRequestParseError('Cannot load audio file. Error: the file contains no audio')
+    logger.info(f'File duration: {featurizer.duration:.1f} seconds')
+    return frames
+
+
+def _featurize_file_block_streaming(filename, block_seconds, profile):
+    # Chunks are aggregated as they are completed. Only the frame-level RMS is retained until
+    # the end of the file, for the adaptive silence threshold.
+    featurizer = StreamingFeaturizer(profile, keep_rms=True)
+    chunks = list(_iter_streaming_chunks(featurizer, filename, block_seconds, profile))
+    if not chunks:
+        raise KnownRequestParseError('Cannot load audio file. Error: the file contains no audio')
+    logger.info(f'File duration: {featurizer.duration:.1f} seconds')
+
+    time_offsets, features, mean_rms = zip(*chunks)
+    with trace_stage('silence'):
+        mean_rms = np.array(mean_rms)
+        adaptive_rms_threshold = featurizer.get_adaptive_rms_threshold()
+        is_silent = mean_rms < max(ABSOLUTE_SILENCE_RMS_THRESHOLD, adaptive_rms_threshold)
+    return FeatureBlock(np.array(features, dtype=np.float32), np.array(time_offsets), is_silent)
+
+
+def featurize_file_streaming(filename, block_seconds=STREAMING_BLOCK_SECONDS, profile=None):
+    """
+    Extracts audio features from the specified audio file without loading it into memory at once.
+
+    Produces the same rows as `featurize_file`. Chunk boundaries are derived from the nominal
+    frame rate rather than the exact file duration, so they may differ by one STFT frame.
+
+    Parameters
+    ----------
+    filename : str, bytes or file-like object
+        Path to a saved audio file, raw file content, or a seekable binary file-like object.
+    block_seconds : float
+        Duration of a single block of audio to decode and featurize at once.
+    profile : AnalysisProfile
+        (Optional) Analysis profile. Defaults to the one configured by `get_analysis_profile`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A data frame with extracted audio features, one line for each SECONDS_PER_CHUNK seconds.
+    """
+    feature_block = featurize_file_block(filename, streaming=True, block_seconds=block_seconds,
+                                         profile=profile)
+    return feature_block.to_data_frame()
@@ -0,0 +1,312 @@
+import abc
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+from common.recognition import recognize_saved_file
+from common.utilities import KnownRequestParseError
+
+
+logger = logging.getLogger(__name__)
+
+
+JOB_STATUS_PENDING = 'pending'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_SUCCEEDED = 'succeeded'
+JOB_STATUS_FAILED = 'failed'
+
+# Finished jobs are deleted after this many seconds.
+DEFAULT_JOB_TTL_SECONDS = 3600
+
+# Unfinished jobs are failed this many seconds after their creation, e.g. if their worker died.
+DEFAULT_JOB_TIMEOUT_SECONDS = 3600
+
+
+class Job(object):
+    """
+    Represents an asynchronous recognition job.
+    """
+    def __init__(self, job_id, status, original_filename, upload_path,
+                 created_at, finished_at=None, result=None, error=None):
+        self.job_id = job_id
+        self.status = status
+        self.original_filename = original_filename
+        self.upload_path = upload_path
+        self.created_at = created_at
+        self.finished_at = finished_at
+        self.result = result
+        self.error = error
+
+    def to_dict(self):
+        """
+        Returns
+        -------
+        dict
+            Job representation for API responses.
+        """
+        job_dict = {
+            'jobId': self.job_id,
+            'status': self.status,
+            'filename': self.original_filename,
+        }
+        if self.status == JOB_STATUS_SUCCEEDED:
+            job_dict['chords'] = self.result
+        elif self.status == JOB_STATUS_FAILED:
+            job_dict['message'] = self.error
+        return job_dict
+
+
+class JobStore(object):
+    """
+    Abstract class for storing asynchronous recognition jobs along with their uploads.
+    """
+    @abc.abstractmethod
+    def create_job(self, original_filename, source_path):
+        """
+        Register a new pending job, taking ownership of the uploaded file.
+
+        Parameters
+        ----------
+        original_filename : str
+            Original name of the uploaded file.
+        source_path : str
+            Path to the saved upload. The file is moved into the store.
+
+        Returns
+        -------
+        Job
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_job(self, job_id):
+        """
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        Job
+            The job, or None if it does not exist.
+        """
+        pass
+
+    @abc.abstractmethod
+    def update_job(self, job_id, status, result=None, error=None):
+        """
+        Change the job status. Finished jobs also get their result or error message,
+        and their upload is deleted.
+
+        Parameters
+        ----------
+        job_id : str
+        status : str
+            One of the JOB_STATUS_* values.
+        result : list
+            (Optional) Recognized chords for a succeeded job.
+        error : str
+            (Optional) Error message for a failed job.
+        """
+        pass
+
+    @abc.abstractmethod
+    def purge_expired(self, ttl_seconds, timeout_seconds=DEFAULT_JOB_TIMEOUT_SECONDS):
+        """
+        Delete the jobs that finished more than `ttl_seconds` ago. Jobs that are still unfinished
+        `timeout_seconds` after their creation are marked as failed, and their upload is deleted.
+
+        Parameters
+        ----------
+        ttl_seconds : float
+        timeout_seconds : float
+
+        Returns
+        -------
+        int
+            Number of deleted jobs.
+        """
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """
+    A job store keeping job records in a local SQLite database and uploads in a directory
+    next to it. Multiple processes (or Lambda containers sharing an EFS mount) can use
+    the same directory.
+    """
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.upload_dir = os.path.join(root_dir, 'uploads')
+        self.db_path = os.path.join(root_dir, 'jobs.sqlite3')
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    original_filename TEXT NOT NULL,
+                    upload_path TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            ''')
+
+    def create_job(self, original_filename, source_path):
+        job_id = uuid.uuid4().hex
+        extension = os.path.splitext(source_path)[1]
+        upload_path = os.path.join(self.upload_dir, job_id + extension)
+        shutil.move(source_path, upload_path)
+
+        job = Job(
+            job_id,
+            JOB_STATUS_PENDING,
+            original_filename,
+            upload_path,
+            created_at=time.time(),
+        )
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO jobs (job_id, status, original_filename, upload_path, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (job.job_id, job.status, job.original_filename, job.upload_path, job.created_at),
+            )
+        logger.info(f'Created job {job_id} for "{original_filename}"')
+        return job
+
+    def get_job(self, job_id):
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT job_id, status, original_filename, upload_path, created_at, finished_at, '
+                'result, error FROM jobs WHERE job_id = ?',
+                (job_id,),
+            ).fetchone()
+        if not row:
+            return None
+
+        job = Job(*row)
+        job.result = json.loads(job.result) if job.result else None
+        return job
+
+    def update_job(self, job_id, status, result=None, error=None):
+        is_finished = status in (JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED)
+        finished_at = time.time() if is_finished else None
+        serialized_result = json.dumps(result) if result is not None else None
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? '
+                'WHERE job_id = ?',
+                (status, finished_at, serialized_result, error, job_id),
+            )
+
+        if is_finished:
+            # The job may have timed out and been purged in the meantime.
+            job = self.get_job(job_id)
+            if job:
+                self._remove_upload(job.upload_path)
+
+    def purge_expired(self, ttl_seconds, timeout_seconds=DEFAULT_JOB_TIMEOUT_SECONDS):
+        now = time.time()
+        expiration_time = now - ttl_seconds
+        with self._connect() as connection:
+            timed_out_rows = connection.execute(
+                'SELECT job_id, upload_path FROM jobs '
+                'WHERE finished_at IS NULL AND created_at < ?',
+                (now - timeout_seconds,),
+            ).fetchall()
+            connection.executemany(
+                'UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ?',
+                [(JOB_STATUS_FAILED, now, 'The job timed out', row[0]) for row in timed_out_rows],
+            )
+
+            rows = connection.execute(
+                'SELECT job_id, upload_path FROM jobs '
+                'WHERE finished_at IS NOT NULL AND finished_at < ?',
+                (expiration_time,),
+            ).fetchall()
+            connection.executemany('DELETE FROM jobs WHERE job_id = ?', [(row[0],) for row in rows])
+
+        for _, upload_path in timed_out_rows + rows:
+            self._remove_upload(upload_path)
+        if timed_out_rows:
+            logger.warning(f'Failed {len(timed_out_rows)} timed out jobs')
+        if rows:
+            logger.info(f'Purged {len(rows)} expired jobs')
+        return len(rows)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection used as a context manager only commits or rolls back, it is not closed.
+        with contextlib.closing(sqlite3.connect(self.db_path, timeout=30)) as connection:
+            with connection:
+                yield connection
+
+    @staticmethod
+    def _remove_upload(upload_path):
+        try:
+            os.remove(upload_path)
+        except OSError:
+            pass
+
+
+def run_job(job_store, job_id, prediction_service, **options):
+    """
+    Run chord recognition for a pending job and store the outcome.
+
+    Parameters
+    ----------
+    job_store : JobStore
+        The store holding the job.
+    job_id : str
+        ID of the job to run.
+    prediction_service : PredictionService
+        A service used to make chord name predictions.
+    options
+        Keyword arguments for `recognize_saved_file`.
+    """
+    job = job_store.get_job(job_id)
+    if not job or job.status != JOB_STATUS_PENDING:
+        logger.warning(f'Job {job_id} does not exist or is not pending, skipping')
+        return
+
+    logger.info(f'Starting job {job_id}')
+    job_store.update_job(job_id, JOB_STATUS_RUNNING)
+    try:
+        result = recognize_saved_file(job.upload_path, prediction_service, **options)
+    except KnownRequestParseError as e:
+        logger.info(f'Job {job_id} failed with user error: {str(e)}')
+        job_store.update_job(job_id, JOB_STATUS_FAILED, error=str(e))
+        return
+    except Exception as e:
+        logger.warning(f'Job {job_id} failed with internal error', exc_info=True)
+        job_store.update_job(job_id, JOB_STATUS_FAILED, error=str(e) or e.__class__.__name__)
+        return
+
+    job_store.update_job(job_id, JOB_STATUS_SUCCEEDED, result=result)
+    logger.info(f'Job {job_id} finished, {len(result)} records')
+
+
+def get_job_store():
+    """
+    Create a job store configured by environment variables:
+
+    * DECHORDER_JOB_STORE_DIR: directory for the job database and uploads
+      (async jobs are disabled if not set).
+
+    Returns
+    -------
+    JobStore
+        A job store instance, or None if async jobs are disabled.
+    """
+    root_dir = os.environ.get('DECHORDER_JOB_STORE_DIR')
+    if not root_dir:
+        return None
+    return SQLiteJobStore(root_dir)
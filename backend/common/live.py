@@ -0,0 +1,531 @@
+import abc
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from common.features import (
+    FFmpegAudioDecoder,
+    StreamingFeaturizer,
+    create_resample_stream,
+    get_audio_decoder,
+    is_chunk_silent,
+)
+from common.recognition import postprocess_predictions, resolve_analysis_profile
+from common.tracing import trace_stage
+from common.utilities import KnownRequestParseError
+
+
+logger = logging.getLogger(__name__)
+
+
+# Raw PCM formats of live audio, with the numpy type of a single sample. Channels are interleaved.
+PCM_FORMATS = {
+    's16le': '<i2',
+    'f32le': '<f4',
+}
+
+# Compressed formats of live audio, decoded by ffmpeg (the names of its demuxers).
+# ADTS is streamable AAC.
+COMPRESSED_FORMATS = ['mp3', 'adts', 'ogg', 'webm']
+
+DEFAULT_PCM_SAMPLE_RATE = 44100
+MAX_PCM_CHANNELS = 8
+
+# Live sessions that receive no audio for this many seconds are closed.
+DEFAULT_LIVE_IDLE_TIMEOUT_SECONDS = 60
+
+
+class LiveSessionLimitError(Exception):
+    """
+    Occurs when the maximum number of live sessions are open and a new one cannot be started.
+    """
+    pass
+
+
+class LiveAudioDecoder(object):
+    """
+    Abstract class for decoding live audio that arrives in arbitrary pieces, e.g. as sent
+    by the client, to a mono float32 signal at the sample rate of the analysis profile.
+    """
+    @abc.abstractmethod
+    def decode(self, content):
+        """
+        Decode the next piece of audio.
+        Incomplete samples or frames are kept until the next piece arrives.
+
+        Parameters
+        ----------
+        content : bytes
+            The next piece of the audio stream.
+
+        Returns
+        -------
+        numpy.array
+            The decoded signal, possibly empty.
+        """
+        pass
+
+    @abc.abstractmethod
+    def finish(self):
+        """
+        Signal the end of the audio stream.
+
+        Returns
+        -------
+        numpy.array
+            The rest of the decoded signal.
+        """
+        pass
+
+    def close(self):
+        """
+        Release the resources of the decoder, e.g. when the session is abandoned.
+        """
+        pass
+
+
+class PCMStreamDecoder(LiveAudioDecoder):
+    """
+    Decodes raw interleaved PCM, downmixing it to mono and resampling it with soxr if needed.
+    """
+    def __init__(self, sample_format, sample_rate, channels, profile):
+        self.dtype = np.dtype(PCM_FORMATS[sample_format])
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.resampler = None
+        if sample_rate != profile.sample_rate:
+            self.resampler = create_resample_stream(sample_rate, profile)
+        self._remainder = b''
+
+    def decode(self, content):
+        content = self._remainder + content
+        frame_bytes = self.dtype.itemsize * self.channels
+        n_bytes = len(content) // frame_bytes * frame_bytes
+        self._remainder = content[n_bytes:]
+
+        samples = np.frombuffer(content[:n_bytes], dtype=self.dtype).astype(np.float32)
+        if self.dtype.kind == 'i':
+            samples /= np.iinfo(self.dtype).max + 1
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        if self.resampler:
+            samples = self.resampler.resample_chunk(samples)
+        return samples
+
+    def finish(self):
+        if self.resampler:
+            return self.resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+        return np.zeros(0, dtype=np.float32)
+
+
+class FFmpegStreamDecoder(LiveAudioDecoder):
+    """
+    Decodes compressed audio in an ffmpeg subprocess that stays open for the whole session.
+    The audio is written to its input as it arrives, and a background thread collects the decoded
+    PCM, so that decoding never waits for more input than ffmpeg needs for the next frame.
+    """
+    def __init__(self, ffmpeg_path, input_format, profile):
+        # Start decoding the first frame at once rather than probing the input first.
+        input_args = [
+            '-probesize', '32', '-analyzeduration', '0', '-fflags', 'nobuffer',
+            '-f', input_format,
+        ]
+        command = FFmpegAudioDecoder(ffmpeg_path).get_command(
+            input_args + ['-i', 'pipe:0'],
+            profile.sample_rate,
+            output_args=['-flush_packets', '1'],
+        )
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._output = bytearray()
+        self._stderr = bytearray()
+        self._lock = threading.Lock()
+        self._readers = [
+            threading.Thread(target=self._read_output, daemon=True),
+            threading.Thread(target=self._read_stderr, daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+
+    def decode(self, content):
+        try:
+            self.process.stdin.write(content)
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            self.finish()
+        return self._take_output()
+
+    def finish(self):
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        for reader in self._readers:
+            reader.join()
+        self.process.wait()
+
+        if self.process.returncode != 0:
+            error_desc = FFmpegAudioDecoder.get_error_message(self.process.returncode,
+                                                              bytes(self._stderr))
+            raise KnownRequestParseError('Cannot decode live audio. Error: ' + error_desc)
+        return self._take_output()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        self.process.wait()
+
+    def _read_output(self):
+        while True:
+            content = os.read(self.process.stdout.fileno(), 65536)
+            if not content:
+                break
+            with self._lock:
+                self._output.extend(content)
+        self.process.stdout.close()
+
+    def _read_stderr(self):
+        self._stderr.extend(self.process.stderr.read())
+        self.process.stderr.close()
+
+    def _take_output(self):
+        # Only whole float32 samples, the rest stays until more output arrives.
+        with self._lock:
+            n_bytes = len(self._output) // 4 * 4
+            content = bytes(self._output[:n_bytes])
+            del self._output[:n_bytes]
+        return np.frombuffer(content, dtype='<f4')
+
+
+def create_live_decoder(input_format, profile, sample_rate=None, channels=None):
+    """
+    Create a decoder for live audio in the specified format.
+
+    Parameters
+    ----------
+    input_format : str
+        One of PCM_FORMATS or COMPRESSED_FORMATS.
+    profile : AnalysisProfile
+        Analysis profile with the target sample rate.
+    sample_rate : str or int
+        (Optional) Sample rate of PCM input. Defaults to DEFAULT_PCM_SAMPLE_RATE.
+    channels : str or int
+        (Optional) Number of interleaved channels of PCM input. Defaults to 1.
+
+    Returns
+    -------
+    LiveAudioDecoder
+    """
+    if input_format in PCM_FORMATS:
+        try:
+            sample_rate = int(sample_rate or DEFAULT_PCM_SAMPLE_RATE)
+            channels = int(channels or 1)
+        except ValueError:
+            sample_rate = channels = 0
+        if sample_rate <= 0 or not 1 <= channels <= MAX_PCM_CHANNELS:
+            raise KnownRequestParseError(
+                'Expected a positive sample rate '
+                f'and from 1 to {MAX_PCM_CHANNELS} channels of PCM audio'
+            )
+        try:
+            return PCMStreamDecoder(input_format, sample_rate, channels, profile)
+        except ImportError:
+            raise KnownRequestParseError(
+                f'Cannot resample live audio from {sample_rate} Hz, '
+                f'send {profile.sample_rate} Hz instead'
+            )
+
+    if input_format in COMPRESSED_FORMATS:
+        decoder = get_audio_decoder(FFmpegAudioDecoder.name)
+        if not isinstance(decoder, FFmpegAudioDecoder):
+            raise KnownRequestParseError(
+                'Compressed live audio is not supported, send PCM audio instead'
+            )
+        return FFmpegStreamDecoder(decoder.ffmpeg_path, input_format, profile)
+
+    supported_formats = list(PCM_FORMATS) + COMPRESSED_FORMATS
+    raise KnownRequestParseError(
+        f'Expected the live audio format to be one of: {", ".join(supported_formats)}'
+    )
+
+
+class LiveRecognitionSession(object):
+    """
+    Recognizes chords in live audio while it is being recorded.
+
+    The STFT and chroma state is kept between pieces of audio, and a chord event is emitted
+    as soon as a SECONDS_PER_CHUNK chunk completes: the chunk is predicted unless it is silent,
+    and repeating chords are removed across the whole session, as `remove_repeating_chords`
+    does for a file.
+
+    Silence is detected with the adaptive threshold of the frames received so far, so it may differ
+    from the recognition of the complete recording.
+    """
+    def __init__(self, session_id, prediction_service, decoder, profile, top_k=0):
+        self.session_id = session_id
+        self.prediction_service = prediction_service
+        self.decoder = decoder
+        self.profile = profile
+        self.top_k = top_k
+        self.featurizer = StreamingFeaturizer(profile, live=True)
+
+        self.chunk_count = 0
+        self.event_count = 0
+        self.last_activity = time.monotonic()
+        self._last_chord_name = None
+        self._lock = threading.Lock()
+
+    def push(self, content):
+        """
+        Recognize the next piece of the audio stream.
+
+        Parameters
+        ----------
+        content : bytes
+            The next piece of the audio stream, in the format of the session decoder.
+
+        Returns
+        -------
+        list
+            Chords that start in the chunks completed by this piece,
+            in the `recognize_saved_file` format.
+        """
+        with self._lock:
+            self.last_activity = time.monotonic()
+            with trace_stage('decode'):
+                signal = self.decoder.decode(content)
+            return self._recognize_chunks(self.featurizer.push(signal))
+
+    def finish(self):
+        """
+        End the audio stream and recognize the remaining signal.
+
+        Returns
+        -------
+        list
+            Chords that start in the remaining chunks, in the `recognize_saved_file` format.
+        """
+        with self._lock:
+            try:
+                with trace_stage('decode'):
+                    signal = self.decoder.finish()
+                chunks = self.featurizer.push(signal)
+                chunks += self.featurizer.finish()
+            finally:
+                self.decoder.close()
+            return self._recognize_chunks(chunks)
+
+    def close(self):
+        """
+        Abandon the session without recognizing the remaining signal.
+        """
+        with self._lock:
+            self.decoder.close()
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Session progress: the duration of the received audio
+            and the numbers of chunks and chord events.
+        """
+        return {
+            'sessionId': self.session_id,
+            'seconds': self.featurizer.duration,
+            'chunks': self.chunk_count,
+            'chords': self.event_count,
+        }
+
+    def _recognize_chunks(self, chunks):
+        self.chunk_count += len(chunks)
+        with trace_stage('silence'):
+            adaptive_threshold = self.featurizer.get_adaptive_rms_threshold()
+            voiced_chunks = [
+                (time_offset, chroma)
+                for time_offset, chroma, mean_rms in chunks
+                if not is_chunk_silent(mean_rms, adaptive_threshold)
+            ]
+        if not voiced_chunks:
+            return []
+
+        features = np.array([chroma for _, chroma in voiced_chunks], dtype=np.float32)
+        time_offsets = np.array([time_offset for time_offset, _ in voiced_chunks])
+        with trace_stage('predict'):
+            df_predictions = self.prediction_service.predict(features, top_k=self.top_k)
+        chords = postprocess_predictions(df_predictions, time_offsets)
+
+        # The previous pieces may have ended with the same chord.
+        if chords and chords[0]['name'] == self._last_chord_name:
+            chords = chords[1:]
+        if chords:
+            self._last_chord_name = chords[-1]['name']
+        self.event_count += len(chords)
+        return chords
+
+
+class LiveSessionStore(object):
+    """
+    Keeps the live recognition sessions of the process. Sessions live in memory, so all requests
+    of a session must reach the same process. Idle sessions are closed to free their decoders,
+    by a background thread and on every access to the store, even if their clients never return.
+    """
+    def __init__(self, max_sessions, idle_timeout_seconds=DEFAULT_LIVE_IDLE_TIMEOUT_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._purger = None
+
+    def create_session(self, prediction_service, input_format, sample_rate=None, channels=None,
+                       top_k=0, analysis_profile=None):
+        """
+        Start a new live recognition session.
+
+        Parameters
+        ----------
+        prediction_service : PredictionService
+            A service used to make chord name predictions.
+        input_format : str
+            Format of the live audio, one of PCM_FORMATS or COMPRESSED_FORMATS.
+        sample_rate : str or int
+            (Optional) Sample rate of PCM input.
+        channels : str or int
+            (Optional) Number of interleaved channels of PCM input.
+        top_k : int
+            Number of most likely chords to return as alternatives for each chord.
+            0 disables alternatives.
+        analysis_profile : str
+            (Optional) Name of the analysis profile to featurize with,
+            see `resolve_analysis_profile`.
+
+        Returns
+        -------
+        LiveRecognitionSession
+        """
+        self.purge_idle()
+        profile = resolve_analysis_profile(prediction_service, analysis_profile)
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise LiveSessionLimitError('Too many live sessions, please try again later')
+            decoder = create_live_decoder(input_format, profile, sample_rate, channels)
+            session = LiveRecognitionSession(uuid.uuid4().hex, prediction_service, decoder, profile,
+                                             top_k)
+            self._sessions[session.session_id] = session
+            if not self._purger:
+                self._purger = threading.Thread(target=self._purge_forever, daemon=True)
+                self._purger.start()
+
+        logger.info(
+            f'Live session {session.session_id} started '
+            f'({input_format}, {profile.name} analysis profile)'
+        )
+        return session
+
+    def get_session(self, session_id):
+        """
+        Returns
+        -------
+        LiveRecognitionSession
+            The session, or None if it does not exist or has been closed.
+        """
+        self.purge_idle()
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def finish_session(self, session_id):
+        """
+        End the audio stream of the session and remove it.
+
+        Returns
+        -------
+        list
+            The remaining chords, or None if the session does not exist.
+        """
+        self.purge_idle()
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if not session:
+            return None
+
+        chords = session.finish()
+        logger.info(f'Live session finished: {session.get_stats()}')
+        return chords
+
+    def purge_idle(self):
+        """
+        Close the sessions that have received no audio for `idle_timeout_seconds`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle_session_ids = [
+                session_id
+                for session_id, session in self._sessions.items()
+                if now - session.last_activity > self.idle_timeout_seconds
+            ]
+            idle_sessions = [self._sessions.pop(session_id) for session_id in idle_session_ids]
+
+        for session in idle_sessions:
+            logger.info(f'Closing idle live session: {session.get_stats()}')
+            session.close()
+
+    def _purge_forever(self):
+        # A session is closed at most half a timeout after it became idle.
+        while True:
+            time.sleep(self.idle_timeout_seconds / 2)
+            self.purge_idle()
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            The number of open sessions and the progress of each one.
+        """
+        self.purge_idle()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'sessions': len(sessions),
+            'maxSessions': self.max_sessions,
+            'openSessions': [session.get_stats() for session in sessions],
+        }
+
+
+def get_live_session_store():
+    """
+    Create a live session store configured by environment variables:
+
+    * DECHORDER_LIVE_MAX_SESSIONS: max number of concurrent live sessions
+      (live recognition is disabled if not set).
+    * DECHORDER_LIVE_IDLE_TIMEOUT_SECONDS: (optional) idle sessions are closed after this many
+      seconds.
+
+    Returns
+    -------
+    LiveSessionStore
+        A live session store, or None if live recognition is disabled.
+    """
+    max_sessions = int(os.environ.get('DECHORDER_LIVE_MAX_SESSIONS', 0))
+    if max_sessions <= 0:
+        return None
+    idle_timeout_seconds = float(os.environ.get(
+        'DECHORDER_LIVE_IDLE_TIMEOUT_SECONDS',
+        DEFAULT_LIVE_IDLE_TIMEOUT_SECONDS,
+    ))
+    return LiveSessionStore(max_sessions, idle_timeout_seconds)
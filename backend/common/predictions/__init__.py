@@ -1,28 +1,73 @@
 import abc
+import logging
 import os
 
+import numpy as np
+import pandas as pd
+
+from common.features import FEATURE_NAMES
+
+
+logger = logging.getLogger(__name__)
+
 
 class PredictionService(object):
     """
     Abstract class for a service that can make chord predictions given audio features.
     """
     @abc.abstractmethod
-    def predict(self, df):
+    def predict(self, df, top_k=0):
         """
         Predict chord labels with confidence.
 
         Parameters
         ----------
-        df : pandas.DataFrame
-            Input data frame with audio features.
+        df : pandas.DataFrame or numpy.array
+            Input data frame with audio features, or a 2D feature matrix with columns
+            ordered as `common.features.FEATURE_NAMES`.
+        top_k : int
+            (Optional) Number of most likely chords to return for each row, in addition
+            to the prediction.
 
         Returns
         -------
         pandas.DataFrame
-            Prediction data frame with two columns: 'name', 'confidence'.
+            Prediction data frame with two columns: 'name', 'confidence'. If `top_k` is set, also
+            an 'alternatives' column: a list of up to `top_k` dictionaries {'name', 'confidence'}
+            per row, most likely first (the predicted chord included).
         """
         pass
 
+    def get_identity(self):
+        """
+        Describe the service and model version, e.g. for building cache keys.
+        Services whose predictions depend on configuration or model files should override this.
+
+        Returns
+        -------
+        str
+        """
+        return self.__class__.__name__
+
+    def preload(self):
+        """
+        Load the model or open connections ahead of the first prediction,
+        e.g. while a serverless container is being initialized. Does nothing by default.
+        """
+        pass
+
+    def get_analysis_profile(self):
+        """
+        The analysis profile the model was trained with, so that features for it are computed
+        the same way.
+
+        Returns
+        -------
+        common.features.AnalysisProfile
+            The profile, or None if the service works with features of any profile.
+        """
+        return None
+
 
 class PredictionError(Exception):
     """
@@ -31,6 +76,61 @@ class PredictionError(Exception):
     pass
 
 
+def to_feature_frame(features):
+    """
+    Convert prediction service input to a data frame with named feature columns.
+
+    Parameters
+    ----------
+    features : pandas.DataFrame or numpy.array
+        A data frame with audio features or a 2D feature matrix.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if isinstance(features, pd.DataFrame):
+        return features
+    return pd.DataFrame(features, columns=FEATURE_NAMES)
+
+
+def to_prediction_frame(probabilities, classes, top_k=0):
+    """
+    Convert class probabilities to the prediction data frame format.
+
+    Parameters
+    ----------
+    probabilities : numpy.array
+        2D matrix of class probabilities, one row per prediction.
+    classes : numpy.array
+        Class labels, one per column of `probabilities`.
+    top_k : int
+        (Optional) Number of most likely chords to include as alternatives.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Prediction data frame in the `PredictionService.predict` format.
+    """
+    classes = np.asarray(classes)
+    best_indices = np.argmax(probabilities, axis=1)
+    df = pd.DataFrame({
+        'name': classes[best_indices],
+        'confidence': probabilities[np.arange(len(probabilities)), best_indices],
+    })
+
+    if top_k:
+        top_indices = np.argsort(-probabilities, axis=1, kind='stable')[:, :top_k]
+        df['alternatives'] = [
+            [
+                {'name': str(classes[i]), 'confidence': float(row_probabilities[i])}
+                for i in row_top_indices
+            ]
+            for row_probabilities, row_top_indices in zip(probabilities, top_indices)
+        ]
+    return df
+
+
 def get_prediction_service(service_key):
     """
     Instantiates a prediction service by its key.
@@ -45,18 +145,66 @@ def get_prediction_service(service_key):
     An instance of PredictionService
     """
     if service_key == 'DataRobotV1APIPredictionService':
-        from common.predictions.datarobot import DataRobotV1APIPredictionService
-        return DataRobotV1APIPredictionService(
+        from common.predictions import datarobot
+        return datarobot.DataRobotV1APIPredictionService(
             server=os.environ['DATAROBOT_SERVER'],
             server_key=os.environ['DATAROBOT_SERVER_KEY'],
             deployment_id=os.environ['DATAROBOT_DEPLOYMENT_ID'],
             username=os.environ['DATAROBOT_USERNAME'],
             api_token=os.environ['DATAROBOT_API_TOKEN'],
+            max_rows_per_request=int(os.environ.get(
+                'DATAROBOT_MAX_ROWS_PER_REQUEST',
+                datarobot.DEFAULT_MAX_ROWS_PER_REQUEST,
+            )),
+            max_concurrent_requests=int(os.environ.get(
+                'DATAROBOT_MAX_CONCURRENT_REQUESTS',
+                datarobot.DEFAULT_MAX_CONCURRENT_REQUESTS,
+            )),
+            timeout=float(os.environ.get(
+                'DATAROBOT_TIMEOUT_SECONDS',
+                datarobot.DEFAULT_TIMEOUT_SECONDS,
+            )),
+            max_retries=int(os.environ.get('DATAROBOT_MAX_RETRIES', datarobot.DEFAULT_MAX_RETRIES)),
+            payload_format=os.environ.get('DATAROBOT_PAYLOAD_FORMAT', 'csv'),
         )
 
     elif service_key == 'EmbeddedPredictionService':
         from common.predictions.embedded import EmbeddedPredictionService
-        return EmbeddedPredictionService()
+        service = EmbeddedPredictionService(
+            model_filename=os.environ.get('DECHORDER_EMBEDDED_MODEL_PATH'),
+        )
+
+        # Optionally degrade to template matching rather than fail every request
+        # without the model file.
+        model_filename = service.get_model_filename()
+        is_fallback_enabled = os.environ.get('DECHORDER_TEMPLATE_FALLBACK') == '1'
+        if is_fallback_enabled and not os.path.exists(model_filename):
+            logger.warning(
+                f'Model file ({model_filename}) does not exist, falling back to template matching'
+            )
+            return get_prediction_service('TemplatePredictionService')
+        return service
+
+    elif service_key == 'TemplatePredictionService':
+        from common.predictions.template import DEFAULT_QUALITIES, TemplatePredictionService
+        qualities = os.environ.get('DECHORDER_TEMPLATE_QUALITIES', ','.join(DEFAULT_QUALITIES))
+        return TemplatePredictionService(qualities=qualities.split(','))
+
+    elif service_key == 'CascadePredictionService':
+        from common.predictions import cascade
+        return cascade.CascadePredictionService(
+            fast_service=get_prediction_service(
+                os.environ.get('DECHORDER_CASCADE_FAST_SERVICE', 'TemplatePredictionService')
+            ),
+            accurate_service=get_prediction_service(os.environ.get(
+                'DECHORDER_CASCADE_ACCURATE_SERVICE',
+                'DataRobotV1APIPredictionService',
+            )),
+            confidence_threshold=float(os.environ.get(
+                'DECHORDER_CASCADE_CONFIDENCE_THRESHOLD',
+                cascade.DEFAULT_CONFIDENCE_THRESHOLD,
+            )),
+        )
 
     elif service_key == 'DummyPredictionService':
         from common.predictions.dummy import DummyPredictionService
@@ -0,0 +1,195 @@
+import bisect
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from common.predictions import PredictionService, to_feature_frame
+
+
+logger = logging.getLogger(__name__)
+
+
+# Max number of rows coalesced into a single batched prediction.
+DEFAULT_MAX_BATCH_ROWS = 1024
+
+# Max time the first request in a batch waits for other requests to join it.
+DEFAULT_MAX_WAIT_SECONDS = 0.005
+
+# Upper bounds of the histogram buckets for the number of rows in a batch.
+BATCH_ROWS_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+# Upper bounds of the histogram buckets for the time a request waits before its batch is dispatched.
+WAIT_MS_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+class Histogram(object):
+    """
+    A thread-unsafe counter of observations in fixed buckets.
+    """
+    def __init__(self, bucket_bounds):
+        self.bucket_bounds = bucket_bounds
+        self.counts = [0] * (len(bucket_bounds) + 1)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bucket_bounds, value)] += 1
+
+    def to_list(self):
+        """
+        Returns
+        -------
+        list
+            Buckets in ascending order, each a dictionary with the keys: {'upperBound', 'count'}.
+            The upper bound of the last bucket is None.
+        """
+        return [
+            {'upperBound': bound, 'count': count}
+            for bound, count in zip(self.bucket_bounds + [None], self.counts)
+        ]
+
+
+class PendingPrediction(object):
+    """
+    Rows of a single `predict` call waiting to be included into a batch.
+    """
+    def __init__(self, df, top_k):
+        self.df = df
+        self.top_k = top_k
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatchingPredictionService(PredictionService):
+    """
+    Wraps another prediction service, coalescing the rows of concurrent `predict` calls into
+    a single batched prediction and routing each caller's slice of the result back to it.
+
+    A batch is dispatched when it reaches `max_batch_rows`, or when its first request has waited
+    for `max_wait_seconds`, whichever comes first. Empty calls and calls with at least
+    `max_batch_rows` rows bypass batching.
+    """
+    def __init__(self, service, max_batch_rows=DEFAULT_MAX_BATCH_ROWS,
+                 max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS):
+        self.service = service
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_seconds = max_wait_seconds
+
+        self.batch_rows_histogram = Histogram(BATCH_ROWS_BUCKETS)
+        self.wait_ms_histogram = Histogram(WAIT_MS_BUCKETS)
+        self.batches = 0
+        self.requests = 0
+
+        self._pending = collections.deque()
+        self._pending_rows = 0
+        self._condition = threading.Condition()
+        self._dispatcher = None
+
+    def get_identity(self):
+        return self.service.get_identity()
+
+    def get_analysis_profile(self):
+        return self.service.get_analysis_profile()
+
+    def preload(self):
+        self.service.preload()
+
+    def predict(self, df, top_k=0):
+        df = to_feature_frame(df)
+        if not len(df) or len(df) >= self.max_batch_rows:
+            return self.service.predict(df, top_k=top_k)
+
+        pending_prediction = PendingPrediction(df, top_k)
+        with self._condition:
+            if not self._dispatcher:
+                self._dispatcher = threading.Thread(target=self._dispatch_forever, daemon=True)
+                self._dispatcher.start()
+            self._pending.append(pending_prediction)
+            self._pending_rows += len(df)
+            self._condition.notify()
+        return pending_prediction.future.result()
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Batch counters along with batch size and wait time histograms.
+        """
+        with self._condition:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'maxBatchRows': self.max_batch_rows,
+                'maxWaitMs': self.max_wait_seconds * 1000,
+                'batchRowsHistogram': self.batch_rows_histogram.to_list(),
+                'waitMsHistogram': self.wait_ms_histogram.to_list(),
+            }
+
+    def _dispatch_forever(self):
+        while True:
+            batch = self._collect_batch()
+            self._run_batch(batch)
+
+    def _collect_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            # Wait for more rows until the batch is full
+            # or its first request has waited long enough.
+            deadline = self._pending[0].enqueued_at + self.max_wait_seconds
+            while self._pending_rows < self.max_batch_rows:
+                remaining_seconds = deadline - time.monotonic()
+                if remaining_seconds <= 0:
+                    break
+                self._condition.wait(remaining_seconds)
+
+            batch = [self._pending.popleft()]
+            batch_rows = len(batch[0].df)
+            while self._pending and batch_rows + len(self._pending[0].df) <= self.max_batch_rows:
+                batch.append(self._pending.popleft())
+                batch_rows += len(batch[-1].df)
+            self._pending_rows -= batch_rows
+
+            dispatched_at = time.monotonic()
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_rows_histogram.observe(batch_rows)
+            for pending_prediction in batch:
+                wait_seconds = dispatched_at - pending_prediction.enqueued_at
+                self.wait_ms_histogram.observe(wait_seconds * 1000)
+            return batch
+
+    def _run_batch(self, batch):
+        try:
+            df_batch = pd.concat(
+                [pending_prediction.df for pending_prediction in batch],
+                ignore_index=True,
+            )
+            logger.info(f'Predicting a micro-batch of {len(batch)} requests, {len(df_batch)} rows')
+
+            # Callers may ask for different numbers of alternatives:
+            # predict the most, trim for each caller.
+            top_k = max(pending_prediction.top_k for pending_prediction in batch)
+            df_predictions = self.service.predict(df_batch, top_k=top_k)
+        except Exception as e:
+            for pending_prediction in batch:
+                pending_prediction.future.set_exception(e)
+            return
+
+        start = 0
+        for pending_prediction in batch:
+            end = start + len(pending_prediction.df)
+            df_slice = df_predictions.iloc[start:end].reset_index(drop=True)
+            if pending_prediction.top_k < top_k:
+                df_slice = df_slice.drop(columns='alternatives')
+                if pending_prediction.top_k:
+                    df_slice['alternatives'] = [
+                        alternatives[:pending_prediction.top_k]
+                        for alternatives in df_predictions['alternatives'].iloc[start:end]
+                    ]
+            pending_prediction.future.set_result(df_slice)
+            start = end
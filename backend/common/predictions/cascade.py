@@ -0,0 +1,104 @@
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from common.predictions import PredictionService, PredictionError, to_feature_frame
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rows predicted by the fast service with a lower confidence are sent to the accurate service.
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+
+class CascadePredictionService(PredictionService):
+    """
+    Runs a cheap local prediction service on all rows, and sends only the rows it is not confident
+    about to a slower, more accurate service (e.g. a remote model). The predictions of both services
+    are merged back in the original row order.
+    """
+    def __init__(self, fast_service, accurate_service,
+                 confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+        self.fast_service = fast_service
+        self.accurate_service = accurate_service
+        self.confidence_threshold = confidence_threshold
+
+        self.requests = 0
+        self.rows = 0
+        self.escalated_rows = 0
+        self._lock = threading.Lock()
+
+    def get_identity(self):
+        fast_identity = self.fast_service.get_identity()
+        accurate_identity = self.accurate_service.get_identity()
+        return (
+            f'{self.__class__.__name__}:{fast_identity}:{accurate_identity}:'
+            f'{self.confidence_threshold}'
+        )
+
+    def preload(self):
+        self.fast_service.preload()
+        self.accurate_service.preload()
+
+    def get_analysis_profile(self):
+        # Both services receive the same features, so their models must agree on the profile.
+        fast_profile = self.fast_service.get_analysis_profile()
+        accurate_profile = self.accurate_service.get_analysis_profile()
+        if fast_profile and accurate_profile and fast_profile != accurate_profile:
+            raise PredictionError(
+                f'The fast service expects the "{fast_profile.name}" analysis profile, '
+                f'the accurate service expects "{accurate_profile.name}"'
+            )
+        return fast_profile or accurate_profile
+
+    def predict(self, df, top_k=0):
+        df = to_feature_frame(df)
+        df_predictions = self.fast_service.predict(df, top_k=top_k)
+        is_escalated = df_predictions['confidence'].to_numpy() < self.confidence_threshold
+        escalated_positions = np.flatnonzero(is_escalated)
+        self.log_escalation(len(df), len(escalated_positions))
+        if not len(escalated_positions):
+            return df_predictions
+
+        df_escalated = df.iloc[escalated_positions].reset_index(drop=True)
+        df_accurate = self.accurate_service.predict(df_escalated, top_k=top_k)
+
+        # Merge by position: the accurate predictions replace the low-confidence ones.
+        merged = {}
+        for column in df_predictions.columns:
+            values = df_predictions[column].to_numpy(copy=True)
+            values[escalated_positions] = df_accurate[column].to_numpy()
+            merged[column] = values
+        return pd.DataFrame(merged, columns=df_predictions.columns)
+
+    def log_escalation(self, n_rows, n_escalated_rows):
+        with self._lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.escalated_rows += n_escalated_rows
+            total_rate = self.escalated_rows / max(self.rows, 1)
+
+        rate = n_escalated_rows / max(n_rows, 1)
+        logger.info(
+            f'Escalated {n_escalated_rows} of {n_rows} rows ({rate:.1%}) to the accurate service, '
+            f'{total_rate:.1%} of all rows so far'
+        )
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Request and row counters, and the fraction of rows escalated to the accurate service.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'rows': self.rows,
+                'escalatedRows': self.escalated_rows,
+                'escalationRate': self.escalated_rows / max(self.rows, 1),
+                'confidenceThreshold': self.confidence_threshold,
+            }
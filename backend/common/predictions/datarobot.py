@@ -1,51 +1,174 @@
+import concurrent.futures
 import logging
+import random
+import threading
+import time
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
-from common.predictions import PredictionService, PredictionError
+from common.predictions import PredictionService, PredictionError, to_feature_frame
 
 
 logger = logging.getLogger(__name__)
 
 
+# Max number of rows sent to DataRobot in a single prediction request.
+DEFAULT_MAX_ROWS_PER_REQUEST = 1000
+
+# Max number of prediction requests in flight at once (also the size of the connection pool).
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+
+# Connect and read timeout of a single prediction request.
+DEFAULT_TIMEOUT_SECONDS = 30
+
+# Number of times a failed request is retried before giving up.
+DEFAULT_MAX_RETRIES = 3
+
+# Base delay between retries. Doubles with every attempt, with random jitter on top.
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+# Responses with these status codes are transient and will be retried.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Supported request payload formats: CSV sends the column names once, JSON repeats them in each row.
+PAYLOAD_FORMATS = ['csv', 'json']
+
+
 class DataRobotV1APIPredictionService(PredictionService):
     """
     A chord prediction service powered by DataRobot V1 API for model deployments.
+
+    Rows are split into batches of at most `max_rows_per_request`, which are sent concurrently
+    over a pooled keep-alive session. Transient failures are retried with jittered exponential
+    backoff.
     """
-    def __init__(self, server, server_key, deployment_id, username, api_token):
+    def __init__(self, server, server_key, deployment_id, username, api_token,
+                 max_rows_per_request=DEFAULT_MAX_ROWS_PER_REQUEST,
+                 max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS,
+                 timeout=DEFAULT_TIMEOUT_SECONDS,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                 payload_format='csv'):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f'Unsupported payload format: {payload_format}')
+
         self.server = server
         self.server_key = server_key
         self.deployment_id = deployment_id
         self.username = username
         self.api_token = api_token
+        self.max_rows_per_request = max_rows_per_request
+        self.max_concurrent_requests = max_concurrent_requests
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.payload_format = payload_format
+
+        self.session = requests.Session()
+        self.session.auth = (username, api_token)
+        self.session.headers.update({'datarobot-key': server_key})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_requests)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def get_identity(self):
+        return f'{self.__class__.__name__}:{self.server}:{self.deployment_id}'
+
+    def preload(self):
+        # Open a connection so that the first prediction does not pay for the TCP/TLS handshake.
+        try:
+            self.session.head(self.server, timeout=self.timeout)
+        except requests.RequestException:
+            logger.warning('Cannot connect to the DataRobot server in advance', exc_info=True)
 
-    def predict(self, df):
+    def predict(self, df, top_k=0):
         logger.info(f'Using DataRobot V1 prediction service on data shape {df.shape}')
-        rows = df.to_dict(orient='records')
-        dr_payload = self.get_datarobot_predictions(rows)
-        result = [
-            self.get_label_and_confidence(row)
-            for row in dr_payload['data']
+        df = to_feature_frame(df)
+        batches = [
+            df.iloc[start:start + self.max_rows_per_request]
+            for start in range(0, len(df), self.max_rows_per_request)
         ]
-        return pd.DataFrame(result, columns=['name', 'confidence'])
 
-    def get_datarobot_predictions(self, rows):
-        logger.info(f'Requesting DataRobot predictions for {len(rows)} rows')
+        if len(batches) > 1 and self.max_concurrent_requests > 1:
+            dr_payloads = list(self.get_executor().map(self.get_datarobot_predictions, batches))
+        else:
+            dr_payloads = [self.get_datarobot_predictions(batch) for batch in batches]
+
+        rows = [
+            row
+            for dr_payload in dr_payloads
+            for row in sorted(dr_payload['data'], key=lambda row: row.get('rowId', 0))
+        ]
+        df_predictions = pd.DataFrame(
+            [self.get_label_and_confidence(row) for row in rows],
+            columns=['name', 'confidence'],
+        )
+
+        # DataRobot returns the probabilities of all classes, so alternatives come at no extra cost.
+        if top_k:
+            df_predictions['alternatives'] = [self.get_alternatives(row, top_k) for row in rows]
+        return df_predictions
+
+    def get_executor(self):
+        with self._executor_lock:
+            if not self._executor:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_requests,
+                )
+            return self._executor
+
+    def get_datarobot_predictions(self, df):
+        logger.info(f'Requesting DataRobot predictions for {len(df)} rows')
         url = f'{self.server}/predApi/v1.0/deployments/{self.deployment_id}/predictions'
-        response = requests.post(
-            url=url,
-            json=rows,
-            auth=(self.username, self.api_token),
-            headers={
-                'Content-Type': 'application/json',
-                'datarobot-key': self.server_key,
+        if self.payload_format == 'csv':
+            request_args = {
+                'data': df.to_csv(index=False).encode('utf-8'),
+                'headers': {'Content-Type': 'text/csv; charset=UTF-8'},
+            }
+        else:
+            request_args = {
+                'json': df.to_dict(orient='records'),
+                'headers': {'Content-Type': 'application/json'},
             }
+
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.post(url=url, timeout=self.timeout, **request_args)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if is_last_attempt:
+                    raise PredictionError(f'DataRobot request failed: {str(e)}')
+                logger.info(f'DataRobot request failed, retrying: {str(e)}')
+            else:
+                logger.info(f'DataRobot response code: {response.status_code}')
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRYABLE_STATUS_CODES or is_last_attempt:
+                    raise PredictionError(response.text)
+
+            time.sleep(self.get_backoff_seconds(attempt))
+
+    def get_backoff_seconds(self, attempt):
+        # "Full jitter": a random delay up to the exponential backoff, so that concurrent
+        # clients that failed at the same time do not retry at the same time.
+        return random.uniform(0, self.backoff_seconds * 2 ** attempt)
+
+    @staticmethod
+    def get_alternatives(row, top_k):
+        prediction_values = sorted(
+            row['predictionValues'],
+            key=lambda val: val['value'],
+            reverse=True,
         )
-        logger.info(f'DataRobot response code: {response.status_code}')
-        if response.status_code != 200:
-            raise PredictionError(response.text)
-        return response.json()
+        return [
+            {'name': val['label'], 'confidence': val['value']}
+            for val in prediction_values[:top_k]
+        ]
 
     @staticmethod
     def get_label_and_confidence(row):
@@ -20,11 +20,20 @@ class DummyPredictionService(PredictionService):
         ]
         self.rng = np.random.RandomState(random_state)
 
-    def predict(self, df):
+    def predict(self, df, top_k=0):
         logger.info(f'Using dummy prediction service on data shape {df.shape}')
         names = self.rng.choice(self.chord_names, size=len(df))
         confidences = self.rng.uniform(low=0.0, high=1.0, size=len(df))
-        return pd.DataFrame({
+        df_predictions = pd.DataFrame({
             'name': names,
             'confidence': confidences,
         })
+
+        # The only alternative is the prediction itself,
+        # so that the random sequence does not depend on top_k.
+        if top_k:
+            df_predictions['alternatives'] = [
+                [{'name': name, 'confidence': confidence}]
+                for name, confidence in zip(names, confidences)
+            ]
+        return df_predictions
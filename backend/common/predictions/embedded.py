@@ -1,12 +1,19 @@
 """
-Standalone usage: embedded.py [-h] --mode MODE --data-path DATAPATH [--model-path MODELPATH]
+Standalone usage: embedded.py [-h] --mode MODE [--data-path DATAPATH] [--pickle-path PICKLEPATH]
+                              [--model-path MODELPATH] [--dtype DTYPE] [--analysis-profile PROFILE]
 
-Train the embedded model for classifying chords
+Train the embedded model for classifying chords, or export a pickled model to the compact format
 
 optional arguments:
-  --mode MODE              mode (currently, only "train" is available)
-  --data-path DATAPATH     path to the training dataset in CSV format
-  --model-path MODELPATH   (optional) file path for saving the trained model
+  --mode MODE              mode ("train" or "export")
+  --data-path DATAPATH     path to the training dataset in CSV format (train mode)
+  --pickle-path PICKLEPATH path to a pickled scikit-learn model (export mode)
+  --model-path MODELPATH   (optional) file path for saving the compact model
+  --dtype DTYPE            (optional) storage type of the weights: float64, float32 (default)
+                           or int8
+  --analysis-profile PROFILE
+                           (optional) analysis profile the training data was featurized with
+                           (default: balanced)
 
 Note: you might need to set PYTHONPATH when running this. Example:
 
@@ -15,92 +22,236 @@ PYTHONPATH=/project-root/backend \
 """
 
 import argparse
+import hashlib
 import logging
 import os
 import pickle
 import pprint
 import sys
 
-import numpy as np
 import pandas as pd
-from sklearn.model_selection import KFold, cross_validate
-from sklearn.neural_network import MLPClassifier
 
-from common.predictions import PredictionService, PredictionError
+from common.features import ANALYSIS_PROFILES, DEFAULT_ANALYSIS_PROFILE, AnalysisProfile
+from common.predictions import (
+    PredictionService,
+    PredictionError,
+    to_feature_frame,
+    to_prediction_frame,
+)
+from common.predictions.mlp import MLP_STORAGE_DTYPES, NumpyMLPClassifier
 
 
 logger = logging.getLogger(__name__)
-DEFAULT_MODEL_FILENAME = 'embedded_model.pkl'
+DEFAULT_MODEL_FILENAME = 'embedded_model.npz'
+
+# The model format used before the compact one: a pickled scikit-learn MLPClassifier.
+PICKLE_MODEL_FILENAME = 'embedded_model.pkl'
+
+# Modules that were renamed in scikit-learn after the bundled pickle was saved (0.20 -> 0.22+).
+RENAMED_SKLEARN_MODULES = {
+    'sklearn.neural_network.multilayer_perceptron': 'sklearn.neural_network._multilayer_perceptron',
+    'sklearn.preprocessing.label': 'sklearn.preprocessing._label',
+}
 
 
 class EmbeddedPredictionService(PredictionService):
     """
     A chord prediction service powered by a neural network classifier embedded in the backend
-    application. Requires the model to be saved as `DEFAULT_MODEL_FILENAME` in the local directory.
+    application. Requires the model to be saved as `DEFAULT_MODEL_FILENAME` in the local directory,
+    unless another model file is specified.
+
+    Models in the compact .npz format run on NumPy alone; pickled scikit-learn models are still
+    supported.
     """
-    def __init__(self):
+    def __init__(self, model_filename=None):
         super().__init__()
         self.model = None
+        self.model_digest = None
+        self.model_filename = model_filename
+
+    def get_model_filename(self):
+        if self.model_filename:
+            return self.model_filename
+        current_dir_path = os.path.dirname(os.path.realpath(__file__))
+        return os.path.join(current_dir_path, DEFAULT_MODEL_FILENAME)
+
+    def get_identity(self):
+        if not self.model_digest:
+            with open(self.get_model_filename(), 'rb') as fp:
+                self.model_digest = hashlib.sha256(fp.read()).hexdigest()
+        return f'{self.__class__.__name__}:{self.model_digest}'
+
+    def preload(self):
+        self.load_model_if_needed()
+
+    def get_analysis_profile(self):
+        self.load_model_if_needed()
+        recorded_profile = getattr(self.model, 'metadata', {}).get('analysis_profile')
+        if recorded_profile:
+            return AnalysisProfile.from_dict(recorded_profile)
+
+        # Models without a recorded profile (including pickled ones)
+        # were trained on the librosa defaults.
+        return ANALYSIS_PROFILES[DEFAULT_ANALYSIS_PROFILE]
 
     def load_model_if_needed(self):
         if self.model:
             # Already loaded.
             return
 
-        # Unpickle the model from disk and keep it in memory.
-        current_dir_path = os.path.dirname(os.path.realpath(__file__))
-        pickle_filename = os.path.join(current_dir_path, DEFAULT_MODEL_FILENAME)
-        if not os.path.exists(pickle_filename):
-            msg = f'Model file ({pickle_filename}) does not exist. '
+        # Load the model from disk and keep it in memory.
+        model_filename = self.get_model_filename()
+        if not os.path.exists(model_filename):
+            msg = f'Model file ({model_filename}) does not exist. '
             msg += 'Please train it first by running "python embedded.py --mode train".'
             raise PredictionError(msg)
 
-        with open(pickle_filename, 'rb') as fp:
-            self.model = pickle.load(fp)
+        if model_filename.endswith('.npz'):
+            self.model = NumpyMLPClassifier.load(model_filename)
+        else:
+            self.model = load_pickled_model(model_filename)
 
-    def predict(self, df):
+    def predict(self, df, top_k=0):
         logger.info(f'Using embedded prediction service on data shape {df.shape}')
         self.load_model_if_needed()
-        names = self.model.predict(df)
-        confidences = np.max(self.model.predict_proba(df), axis=1)
-        return pd.DataFrame({
-            'name': names,
-            'confidence': confidences,
-        })
+
+        # A single forward pass: the predicted label is the most probable class.
+        probabilities = self.model.predict_proba(to_feature_frame(df))
+        return to_prediction_frame(probabilities, self.model.classes_, top_k)
+
+
+class _RenamedModuleUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        return super().find_class(RENAMED_SKLEARN_MODULES.get(module, module), name)
+
+
+def load_pickled_model(pickle_filename):
+    """
+    Load a pickled scikit-learn model, including ones saved by older scikit-learn versions
+    whose modules have since been renamed.
+
+    Parameters
+    ----------
+    pickle_filename : str
+        Path to the pickled model.
+
+    Returns
+    -------
+    sklearn.neural_network.MLPClassifier
+    """
+    with open(pickle_filename, 'rb') as fp:
+        return _RenamedModuleUnpickler(fp).load()
+
+
+def export_model(model, model_path=None, dtype='float32',
+                 analysis_profile=DEFAULT_ANALYSIS_PROFILE):
+    """
+    Save a fitted MLPClassifier in the compact .npz format.
+
+    Parameters
+    ----------
+    model : sklearn.neural_network.MLPClassifier
+        A fitted model.
+    model_path : str
+        (Optional) Path for saving the model. If omitted, will use the default path.
+    dtype : str
+        Storage type of the weights, one of `MLP_STORAGE_DTYPES`.
+    analysis_profile : str
+        Name of the analysis profile the training data was featurized with. Recorded in the model
+        file, so that recognition computes features for the model the same way.
+    """
+    current_dir_path = os.path.dirname(os.path.realpath(__file__))
+    model_filename = model_path or os.path.join(current_dir_path, DEFAULT_MODEL_FILENAME)
+    logger.info(
+        f'Saving the {dtype} model ({analysis_profile} analysis profile) to {model_filename}...'
+    )
+    numpy_model = NumpyMLPClassifier.from_sklearn(model)
+    numpy_model.metadata['analysis_profile'] = ANALYSIS_PROFILES[analysis_profile].to_dict()
+    numpy_model.save(model_filename, dtype=dtype)
 
 
 def parse_command_line_args(args):
-    program_desc = 'Train the embedded model for classifying chords'
+    program_desc = (
+        'Train the embedded model for classifying chords, '
+        'or export a pickled model to the compact format'
+    )
     parser = argparse.ArgumentParser(description=program_desc)
     parser.add_argument(
         '--mode',
         required=True,
         metavar='MODE',
-        help='mode (currently, only "train" is available)',
+        help='mode ("train" or "export")',
     )
     parser.add_argument(
         '--data-path',
         metavar='DATAPATH',
-        required=True,
-        help='path to the training dataset in CSV format',
+        required=False,
+        help='path to the training dataset in CSV format (train mode)',
+    )
+    parser.add_argument(
+        '--pickle-path',
+        metavar='PICKLEPATH',
+        required=False,
+        help='path to a pickled scikit-learn model (export mode)',
     )
     parser.add_argument(
         '--model-path',
         metavar='MODELPATH',
         required=False,
-        help='(optional) file path for saving the trained model',
+        help='(optional) file path for saving the compact model',
+    )
+    parser.add_argument(
+        '--dtype',
+        metavar='DTYPE',
+        choices=MLP_STORAGE_DTYPES,
+        default='float32',
+        help='(optional) storage type of the weights: float64, float32 (default) or int8',
+    )
+    parser.add_argument(
+        '--analysis-profile',
+        metavar='PROFILE',
+        choices=list(ANALYSIS_PROFILES),
+        default=DEFAULT_ANALYSIS_PROFILE,
+        help=(
+            '(optional) analysis profile the training data was featurized with '
+            f'(default: {DEFAULT_ANALYSIS_PROFILE})'
+        ),
     )
     return parser.parse_args(args)
 
 
-def train(data_path, model_path=None):
+def create_classifier():
+    """
+    Create an untrained classifier with the hyperparameters of the embedded model.
+
+    Returns
+    -------
+    sklearn.neural_network.MLPClassifier
+    """
+    from sklearn.neural_network import MLPClassifier
+    return MLPClassifier(
+        hidden_layer_sizes=(13, 19),
+        activation='relu',
+        alpha=0.001,
+        solver='lbfgs',
+        shuffle=True,
+        batch_size='auto',
+        learning_rate_init=0.001,
+        nesterovs_momentum=True,
+        momentum=0.9,
+        random_state=42,
+        verbose=False,
+    )
+
+
+def train(data_path, model_path=None, dtype='float32', analysis_profile=DEFAULT_ANALYSIS_PROFILE):
     """
     Train a built-in neural network classifier using the specified training dataset
-    and save it to disk.
+    and save it to disk in the compact .npz format.
 
     We're using scikit-learn instead of TensorFlow, PyTorch or Keras here to minimize the size of
-    AWS Lambda deployment package. Scikit-learn is already used in librosa so this creates no
-    additional overhead other than the pickle file.
+    AWS Lambda deployment package. Scikit-learn is already used in librosa, and is only needed
+    for training: inference runs on the exported weights with NumPy.
 
     Parameters
     ----------
@@ -108,7 +259,13 @@ def train(data_path, model_path=None):
         Path to the CSV training dataset.
     model_path : str
         (Optional) Path for saving the trained model. If omitted, will use the default path.
+    dtype : str
+        Storage type of the weights, one of `MLP_STORAGE_DTYPES`.
+    analysis_profile : str
+        Name of the analysis profile the training data was featurized with.
     """
+    from sklearn.model_selection import KFold, cross_validate
+
     logger.info(f'Reading the training data from "{data_path}"...')
     df = pd.read_csv(data_path)
 
@@ -116,26 +273,9 @@ def train(data_path, model_path=None):
     y = df['chord']
 
     logger.info('Training the neural network...')
-    model = MLPClassifier(
-        hidden_layer_sizes=(13, 19),
-        activation='relu',
-        alpha=0.001,
-        solver='lbfgs',
-        shuffle=True,
-        batch_size='auto',
-        learning_rate_init=0.001,
-        nesterovs_momentum=True,
-        momentum=0.9,
-        random_state=42,
-        verbose=False,
-    )
+    model = create_classifier()
     model.fit(X, y)
-
-    current_dir_path = os.path.dirname(os.path.realpath(__file__))
-    pickle_filename = model_path or os.path.join(current_dir_path, DEFAULT_MODEL_FILENAME)
-    logger.info(f'Saving the model to {pickle_filename}...')
-    with open(pickle_filename, 'wb') as fp:
-        pickle.dump(model, fp)
+    export_model(model, model_path, dtype, analysis_profile)
 
     logger.info('Starting cross-validation...')
     cv = KFold(n_splits=5, shuffle=True, random_state=42)
@@ -155,7 +295,10 @@ def main():
     logger.info('Running as a standalone script')
     args = parse_command_line_args(sys.argv[1:])
     if args.mode == 'train':
-        train(args.data_path, args.model_path)
+        train(args.data_path, args.model_path, args.dtype, args.analysis_profile)
+    elif args.mode == 'export':
+        model = load_pickled_model(args.pickle_path)
+        export_model(model, args.model_path, args.dtype, args.analysis_profile)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,277 @@
+"""
+A compact, pickle-free file format for the embedded multi-layer perceptron,
+and a NumPy-only forward pass that does not require scikit-learn at inference time.
+
+The model is stored as an uncompressed .npz archive with the following arrays:
+
+* format_version: MLP_FORMAT_VERSION
+* dtype: storage type of the weights ('float64', 'float32' or 'int8')
+* activation, out_activation: activation function names, as in scikit-learn
+* classes: class labels
+* weights_<i>, biases_<i>: parameters of layer i
+* weights_scale_<i>: per-unit dequantization scale of the weights of layer i (int8 only)
+* metadata: (optional) a JSON object describing the model, e.g. the analysis profile
+  of its training features
+"""
+
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+
+# Version of the .npz layout. Bump when the layout changes incompatibly.
+MLP_FORMAT_VERSION = 1
+
+# Storage types supported for the weights.
+MLP_STORAGE_DTYPES = ['float64', 'float32', 'int8']
+
+# Max absolute difference from the float64 class probabilities for each storage type, verified
+# on the bundled model with the training dataset (data/featurized/major-minor.csv) and the test
+# recording. int8 mostly moves the probabilities of ambiguous rows; the predicted labels stay
+# the same on that data.
+MLP_PROBABILITY_TOLERANCE = {
+    'float64': 1e-9,
+    'float32': 1e-5,
+    'int8': 0.25,
+}
+
+HIDDEN_ACTIVATIONS = {
+    'identity': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'logistic': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+}
+
+
+class NumpyMLPClassifier(object):
+    """
+    A feed-forward classifier equivalent to a fitted scikit-learn MLPClassifier,
+    exposing the same `predict` and `predict_proba` methods.
+    """
+    def __init__(self, weights, biases, classes, activation='relu', out_activation='softmax',
+                 dtype='float64', metadata=None):
+        self.weights = weights
+        self.biases = biases
+        self.classes_ = np.asarray(classes)
+        self.activation = activation
+        self.out_activation = out_activation
+        self.dtype = dtype
+        self.metadata = metadata or {}
+
+        # int8 weights are dequantized to float32 for computation.
+        self.compute_dtype = np.float64 if dtype == 'float64' else np.float32
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Copy the parameters of a fitted scikit-learn MLPClassifier.
+
+        Parameters
+        ----------
+        model : sklearn.neural_network.MLPClassifier
+
+        Returns
+        -------
+        NumpyMLPClassifier
+        """
+        return cls(
+            weights=[np.asarray(w, dtype=np.float64) for w in model.coefs_],
+            biases=[np.asarray(b, dtype=np.float64) for b in model.intercepts_],
+            classes=model.classes_,
+            activation=model.activation,
+            out_activation=model.out_activation_,
+        )
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a model saved by `save`.
+
+        Parameters
+        ----------
+        path : str
+            Path to the .npz model file.
+        mmap : bool
+            Whether to memory-map the weights instead of reading them into memory,
+            so that processes loading the same file share its pages.
+
+        Returns
+        -------
+        NumpyMLPClassifier
+        """
+        arrays = load_npz_arrays(path, mmap)
+        format_version = int(arrays['format_version'])
+        if format_version != MLP_FORMAT_VERSION:
+            msg = (
+                f'Unsupported model format version {format_version} in {path}, '
+                f'expected {MLP_FORMAT_VERSION}'
+            )
+            raise ValueError(msg)
+
+        dtype = str(arrays['dtype'])
+        n_layers = int(arrays['n_layers'])
+        weights = []
+        for i in range(n_layers):
+            layer_weights = arrays[f'weights_{i}']
+            if dtype == 'int8':
+                layer_weights = layer_weights.astype(np.float32) * arrays[f'weights_scale_{i}']
+            weights.append(layer_weights)
+
+        return cls(
+            weights=weights,
+            biases=[arrays[f'biases_{i}'] for i in range(n_layers)],
+            classes=arrays['classes'],
+            activation=str(arrays['activation']),
+            out_activation=str(arrays['out_activation']),
+            dtype=dtype,
+            metadata=json.loads(str(arrays['metadata'])) if 'metadata' in arrays else None,
+        )
+
+    def save(self, path, dtype='float32'):
+        """
+        Save the model in the compact .npz format.
+
+        Parameters
+        ----------
+        path : str
+            Path to the .npz model file.
+        dtype : str
+            Storage type of the weights, one of MLP_STORAGE_DTYPES. int8 weights are quantized
+            symmetrically with a separate scale for each unit; biases are kept in float32.
+        """
+        if dtype not in MLP_STORAGE_DTYPES:
+            raise ValueError(f'Unsupported storage type: {dtype}')
+
+        arrays = {
+            'format_version': np.array(MLP_FORMAT_VERSION),
+            'dtype': np.array(dtype),
+            'activation': np.array(self.activation),
+            'out_activation': np.array(self.out_activation),
+            'classes': self.classes_.astype(str),
+            'n_layers': np.array(len(self.weights)),
+        }
+        if self.metadata:
+            arrays['metadata'] = np.array(json.dumps(self.metadata, sort_keys=True))
+        float_dtype = np.float64 if dtype == 'float64' else np.float32
+        for i, (layer_weights, layer_biases) in enumerate(zip(self.weights, self.biases)):
+            if dtype == 'int8':
+                scale = np.max(np.abs(layer_weights), axis=0) / 127
+                scale[scale == 0] = 1
+                arrays[f'weights_{i}'] = np.round(layer_weights / scale).astype(np.int8)
+                arrays[f'weights_scale_{i}'] = scale.astype(np.float32)
+            else:
+                arrays[f'weights_{i}'] = np.asarray(layer_weights, dtype=float_dtype)
+            arrays[f'biases_{i}'] = np.asarray(layer_biases, dtype=float_dtype)
+
+        # Uncompressed, so that the arrays can be memory-mapped on load.
+        with open(path, 'wb') as fp:
+            np.savez(fp, **arrays)
+
+    def predict_proba(self, X):
+        """
+        Parameters
+        ----------
+        X : numpy.array or pandas.DataFrame
+            2D feature matrix.
+
+        Returns
+        -------
+        numpy.array
+            Class probabilities, one column per class in `classes_`.
+        """
+        activations = np.asarray(X, dtype=self.compute_dtype)
+        hidden_activation = HIDDEN_ACTIVATIONS[self.activation]
+        last_layer = len(self.weights) - 1
+
+        for i, (layer_weights, layer_biases) in enumerate(zip(self.weights, self.biases)):
+            activations = activations @ layer_weights.astype(self.compute_dtype, copy=False)
+            activations += layer_biases
+            if i != last_layer:
+                activations = hidden_activation(activations)
+
+        if self.out_activation == 'softmax':
+            activations -= activations.max(axis=1, keepdims=True)
+            np.exp(activations, out=activations)
+            activations /= activations.sum(axis=1, keepdims=True)
+            return activations
+
+        if self.out_activation == 'logistic':
+            positive = 1 / (1 + np.exp(-activations))
+            if positive.shape[1] == 1:
+                return np.hstack([1 - positive, positive])
+            return positive
+
+        return activations
+
+    def predict(self, X):
+        """
+        Parameters
+        ----------
+        X : numpy.array or pandas.DataFrame
+            2D feature matrix.
+
+        Returns
+        -------
+        numpy.array
+            Predicted class labels.
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def load_npz_arrays(path, mmap=True):
+    """
+    Read all arrays from an .npz file. Arrays stored without compression are memory-mapped
+    if requested; numpy.load cannot memory-map archive members by itself.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .npz file.
+    mmap : bool
+        Whether to memory-map uncompressed arrays.
+
+    Returns
+    -------
+    dict
+        Array name -> numpy.array. Memory-mapped arrays are read-only.
+    """
+    arrays = {}
+    with np.load(path, allow_pickle=False) as npz, zipfile.ZipFile(path) as archive:
+        with open(path, 'rb') as fp:
+            for info in archive.infolist():
+                name = info.filename[:-len('.npy')]
+                array = None
+                if mmap and info.compress_type == zipfile.ZIP_STORED:
+                    array = _memory_map_member(path, fp, info)
+                arrays[name] = array if array is not None else npz[name]
+    return arrays
+
+
+def _memory_map_member(path, fp, info):
+    # Skip the local file header of the member, then the .npy header.
+    fp.seek(info.header_offset)
+    local_header = fp.read(30)
+    filename_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    fp.seek(info.header_offset + 30 + filename_length + extra_length)
+
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+
+    # Scalars are cheaper to read than to map.
+    if not shape or dtype.hasobject:
+        return None
+    order = 'F' if fortran_order else 'C'
+    mapped_array = np.memmap(
+        path,
+        dtype=dtype,
+        mode='r',
+        offset=fp.tell(),
+        shape=shape,
+        order=order,
+    )
+    return np.asarray(mapped_array)
@@ -1,52 +1,493 @@
+import functools
 import logging
 
-from common.features import featurize_file
+import numpy as np
+
+from common.caching import get_content_digest, get_recognition_cache_key
+from common.features import (
+    DEFAULT_FEATURE_BATCH_SECONDS,
+    describe_audio_source,
+    featurize_file_block,
+    get_analysis_profile,
+    iter_feature_blocks,
+)
+from common.tracing import trace_stage
+from common.utilities import KnownRequestParseError
 
 
 logger = logging.getLogger(__name__)
 
 
-def recognize_saved_file(path, prediction_service):
+def recognize_saved_file(source, prediction_service, streaming=False, cache=None, frame_cache=None,
+                         top_k=0, change_threshold=0.0, analysis_profile=None):
     """
     Recognize chords in the specified audio file.
 
     Parameters
     ----------
-    path : str
-        A path to the saved audio file.
+    source : str, bytes or file-like object
+        A path to the saved audio file, or in-memory audio content.
     prediction_service : PredictionService
         A service used to make chord name predictions.
+    streaming : bool
+        Whether to decode and featurize the file block by block to keep memory usage bounded.
+    cache : RecognitionResultCache
+        (Optional) A cache to look up and store recognition results by file content.
+    frame_cache : FrameFeatureCache
+        (Optional) A cache of frame-level features, lets recognition skip decoding and STFT.
+    top_k : int
+        Number of most likely chords to return as alternatives for each time offset.
+        They come from the same prediction pass as the chord names. 0 disables alternatives.
+    change_threshold : float
+        Min cosine distance between the chroma of adjacent chunks that starts a new chord segment.
+        Only one averaged row per segment is predicted, see `predict_stable_segments`.
+        0 predicts every chunk.
+    analysis_profile : str
+        (Optional) Name of the analysis profile to featurize with, see `resolve_analysis_profile`.
 
     Returns
     -------
     list
-        A list of dictionaries, each with the keys: {'timeOffset', 'name', 'confidence'}.
+        A list of dictionaries, each with the keys: {'timeOffset', 'name', 'confidence'},
+        plus 'alternatives' if `top_k` is set.
     """
-    logger.info(f'Starting recognition of: "{path}"')
-    exclude_columns = ['time_offset', 'is_silent']
-    df_features = featurize_file(path)
-    logger.info(f'Featurized data shape: {df_features.shape}')
+    if cache:
+        def recognize_func():
+            return recognize_saved_file(
+                source,
+                prediction_service,
+                streaming,
+                frame_cache=frame_cache,
+                top_k=top_k,
+                change_threshold=change_threshold,
+                analysis_profile=analysis_profile,
+            )
+
+        return recognize_with_cache(
+            source,
+            prediction_service,
+            cache,
+            recognize_func,
+            streaming=streaming,
+            top_k=top_k,
+            change_threshold=change_threshold,
+            analysis_profile=analysis_profile,
+        )
 
-    # Prepare dataset for predictions. This involves removing features we use for internal purposes.
-    df_features_not_silent = df_features[~df_features['is_silent']]
-    df_features_pred = df_features_not_silent.drop(columns=exclude_columns)
-    logger.info(f'Non-silent data shape: {df_features_not_silent.shape}')
+    profile = resolve_analysis_profile(prediction_service, analysis_profile)
+    logger.info(
+        f'Starting recognition of: {describe_audio_source(source)} '
+        f'({profile.name} analysis profile)'
+    )
+    if frame_cache:
+        frame_features = frame_cache.get_or_compute(
+            source,
+            streaming=streaming,
+            profile=profile,
+            skip_silence=uses_silence_prepass(streaming),
+        )
+        features = frame_features.aggregate()
+    else:
+        # Silent chunks are discarded below, so the STFT does not need to run over them.
+        features = featurize_file_block(source, streaming=streaming,
+                                        skip_silence=uses_silence_prepass(streaming),
+                                        profile=profile)
+    logger.info(f'Featurized data shape: {features.shape}')
+
+    # Prepare dataset for predictions. Silent chunks are not sent to the prediction service.
+    features_not_silent = features.get_non_silent()
+    logger.info(f'Non-silent data shape: {features_not_silent.shape}')
 
     # Request predictions.
-    df_predictions = prediction_service.predict(df_features_pred)
+    df_predictions = predict_stable_segments(
+        features_not_silent.features,
+        prediction_service,
+        change_threshold,
+        top_k=top_k,
+    )
+
+    return postprocess_predictions(df_predictions, features_not_silent.time_offsets)
+
+
+def iter_recognized_chords(source, prediction_service, cache=None, top_k=0, change_threshold=0.0,
+                           analysis_profile=None, batch_seconds=DEFAULT_FEATURE_BATCH_SECONDS):
+    """
+    Recognize chords in the specified audio file batch by batch, yielding the chords of each batch
+    as soon as it has been featurized and predicted, see `iter_feature_blocks`.
+
+    The concatenated batches are the same as the `recognize_saved_file` result, except where
+    the tuning estimated from the first batch differs from the one of the whole file. Repeating
+    chords are removed across batches. Change-point gating (`change_threshold`) does not merge
+    segments across batches.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+        A path to the saved audio file, or in-memory audio content.
+    prediction_service : PredictionService
+        A service used to make chord name predictions.
+    cache : RecognitionResultCache
+        (Optional) A cache to look up and store recognition results by file content.
+        A cached result is yielded as a single batch.
+    top_k : int
+        Number of most likely chords to return as alternatives for each time offset.
+        0 disables alternatives.
+    change_threshold : float
+        Min cosine distance between the chroma of adjacent chunks that starts a new chord segment.
+        Only one averaged row per segment is predicted. 0 predicts every chunk.
+    analysis_profile : str
+        (Optional) Name of the analysis profile to featurize with, see `resolve_analysis_profile`.
+    batch_seconds : float
+        Duration of audio recognized in a single batch.
+
+    Yields
+    ------
+    list
+        The chords that start in the next batch, in the `recognize_saved_file` format. May be empty.
+    """
+    profile = resolve_analysis_profile(prediction_service, analysis_profile)
+    if cache:
+        cache_key = get_recognition_cache_key(
+            get_content_digest(source),
+            prediction_service,
+            profile,
+            skip_silence=True,
+            top_k=top_k,
+            change_threshold=change_threshold,
+            batch_seconds=batch_seconds,
+        )
+        result = cache.get(cache_key)
+        if result is not None:
+            yield result
+            return
+
+    logger.info(
+        f'Starting batch-by-batch recognition of: {describe_audio_source(source)} '
+        f'({profile.name} profile)'
+    )
+    result = []
+    for features in iter_feature_blocks(source, batch_seconds, profile):
+        features_not_silent = features.get_non_silent()
+        chords = []
+        if len(features_not_silent):
+            df_predictions = predict_stable_segments(
+                features_not_silent.features,
+                prediction_service,
+                change_threshold,
+                top_k=top_k,
+            )
+            chords = postprocess_predictions(df_predictions, features_not_silent.time_offsets)
+
+        # The previous batch may have ended with the same chord.
+        if chords and result and chords[0]['name'] == result[-1]['name']:
+            chords = chords[1:]
+        result.extend(chords)
+        yield chords
+
+    if cache:
+        cache.put(cache_key, result)
+
+
+def resolve_analysis_profile(prediction_service, name=None):
+    """
+    Choose the analysis profile for recognition: the requested one, otherwise the one the model
+    of the prediction service was trained with, otherwise the configured default.
+
+    Parameters
+    ----------
+    prediction_service : PredictionService
+        A service used to make chord name predictions.
+    name : str
+        (Optional) Name of the requested analysis profile.
+
+    Returns
+    -------
+    AnalysisProfile
+    """
+    model_profile = prediction_service.get_analysis_profile()
+    if not name:
+        return model_profile or get_analysis_profile()
 
-    # Attach some of the information we removed earlier.
-    df_predictions['time_offset'] = df_features_not_silent.reset_index(drop=True)['time_offset']
+    try:
+        profile = get_analysis_profile(name)
+    except ValueError as e:
+        raise KnownRequestParseError(str(e))
 
-    # Final smoothing and postprocessing.
-    logger.info('Postprocessing started')
-    result = df_predictions.rename(columns={'time_offset': 'timeOffset'}).to_dict(orient='records')
-    result = remove_repeating_chords(result)
-    logger.info('Postprocessing finished')
+    # Features computed differently from the training data would silently degrade the predictions.
+    if model_profile and profile != model_profile:
+        msg = f'The "{name}" analysis profile does not match the prediction model, '
+        msg += f'which was trained with the "{model_profile.name}" profile'
+        raise KnownRequestParseError(msg)
+    return profile
 
+
+def find_stable_segments(features, change_threshold):
+    """
+    Split consecutive feature rows into segments of similar chroma. A new segment starts wherever
+    the cosine distance between a row and the previous one exceeds `change_threshold`.
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D feature matrix, one row per chunk.
+    change_threshold : float
+        Min cosine distance between adjacent rows that starts a new segment.
+
+    Returns
+    -------
+    numpy.array
+        Segment index of each row: 0 for the first segment, increasing by 1 at each change point.
+    """
+    norms = np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-10)
+    normalized = features / norms
+    distances = 1 - np.sum(normalized[1:] * normalized[:-1], axis=1)
+    is_change_point = np.concatenate([[True], distances > change_threshold])
+    return np.cumsum(is_change_point) - 1
+
+
+def get_segment_representatives(features, change_threshold):
+    """
+    Average the feature rows of each stable segment, see `find_stable_segments`.
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D feature matrix, one row per chunk.
+    change_threshold : float
+        Min cosine distance between adjacent rows that starts a new segment.
+        0 disables segmentation.
+
+    Returns
+    -------
+    tuple
+        (representatives, segment_ids): a feature matrix with one row per segment,
+        and the segment index of each input row.
+    """
+    if not change_threshold or not len(features):
+        return features, np.arange(len(features))
+
+    segment_ids = find_stable_segments(features, change_threshold)
+    segment_starts = np.flatnonzero(np.diff(segment_ids, prepend=-1))
+    segment_lengths = np.diff(np.append(segment_starts, len(features)))
+    segment_sums = np.add.reduceat(features, segment_starts, axis=0)
+    representatives = segment_sums / segment_lengths[:, np.newaxis]
+    return representatives, segment_ids
+
+
+def predict_stable_segments(features, prediction_service, change_threshold, top_k=0):
+    """
+    Predict one averaged row per stable chroma segment and expand the predictions back to all rows.
+
+    Parameters
+    ----------
+    features : numpy.array
+        2D feature matrix, one row per chunk.
+    prediction_service : PredictionService
+        A service used to make chord name predictions.
+    change_threshold : float
+        Min cosine distance between adjacent rows that starts a new segment. 0 predicts every row.
+    top_k : int
+        Number of alternatives to predict for each row.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Prediction data frame with one row per input row.
+    """
+    representatives, segment_ids = get_segment_representatives(features, change_threshold)
+    if len(representatives) < len(features):
+        logger.info(
+            f'Change-point gating: predicting {len(representatives)} of {len(features)} rows'
+        )
+    with trace_stage('predict'):
+        df_predictions = prediction_service.predict(representatives, top_k=top_k)
+    return expand_segment_predictions(df_predictions, segment_ids)
+
+
+def expand_segment_predictions(df_predictions, segment_ids):
+    """
+    Repeat the prediction of each segment for all rows in it.
+
+    Parameters
+    ----------
+    df_predictions : pandas.DataFrame
+        Prediction data frame with one row per segment.
+    segment_ids : numpy.array
+        Segment index of each row, as returned by `get_segment_representatives`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Prediction data frame with one row per element of `segment_ids`.
+    """
+    if len(df_predictions) == len(segment_ids):
+        return df_predictions
+    return df_predictions.iloc[segment_ids].reset_index(drop=True)
+
+
+def uses_silence_prepass(streaming):
+    """
+    Whether `recognize_saved_file` skips the STFT over silent chunks. The streaming featurizer
+    runs it over the whole signal.
+
+    Parameters
+    ----------
+    streaming : bool
+        Whether the file is featurized block by block.
+
+    Returns
+    -------
+    bool
+    """
+    return not streaming
+
+
+def recognize_with_cache(source, prediction_service, cache, recognize_func, analysis_profile=None,
+                         skip_silence=None, **options):
+    """
+    Look up the recognition result for the audio file in the cache, running `recognize_func`
+    on a miss. Identical concurrent requests are computed only once.
+
+    Parameters
+    ----------
+    source : str, bytes or file-like object
+        A path to the saved audio file, or in-memory audio content.
+    prediction_service : PredictionService
+        The service used to make predictions. Its identity becomes part of the cache key.
+    cache : RecognitionResultCache
+        A cache to look up and store recognition results.
+    recognize_func : callable
+        A function without arguments that recognizes the file.
+    analysis_profile : str
+        (Optional) Name of the requested analysis profile, see `resolve_analysis_profile`.
+    skip_silence : bool
+        (Optional) Whether `recognize_func` skips the STFT over silent chunks.
+        Defaults to what `recognize_saved_file` does, see `uses_silence_prepass`.
+    options
+        Other recognition options that affect the result.
+
+    Returns
+    -------
+    list
+        The recognition result.
+    """
+    profile = resolve_analysis_profile(prediction_service, analysis_profile)
+    if skip_silence is None:
+        skip_silence = uses_silence_prepass(options.get('streaming', False))
+    content_digest = get_content_digest(source)
+    cache_key = get_recognition_cache_key(content_digest, prediction_service, profile,
+                                          skip_silence, **options)
+    result = cache.get_or_compute(cache_key, recognize_func)
+    logger.info(f'Recognition cache stats: {cache.get_stats()}')
     return result
 
 
+def postprocess_predictions(df_predictions, time_offsets):
+    """
+    Convert raw predictions to the recognition result format.
+
+    Parameters
+    ----------
+    df_predictions : pandas.DataFrame
+        Prediction data frame with the columns: 'name', 'confidence' and optionally 'alternatives'.
+    time_offsets : numpy.array
+        Time offsets of the predicted chunks.
+
+    Returns
+    -------
+    list
+        A list of dictionaries, each with the keys: {'timeOffset', 'name', 'confidence'},
+        plus 'alternatives' if present in the predictions.
+    """
+    with trace_stage('postprocess'):
+        # Attach the time offsets of the predicted chunks.
+        df_predictions['time_offset'] = time_offsets
+
+        # Final smoothing and postprocessing.
+        logger.info('Postprocessing started')
+        df_result = df_predictions.rename(columns={'time_offset': 'timeOffset'})
+        result = df_result.to_dict(orient='records')
+        result = remove_repeating_chords(result)
+        logger.info('Postprocessing finished')
+
+    return result
+
+
+def recognize_saved_files(sources, prediction_service, executor=None, streaming=False, top_k=0,
+                          change_threshold=0.0, analysis_profile=None):
+    """
+    Recognize chords in multiple audio files. The files are featurized in parallel,
+    then the non-silent chunks of all files are sent to the prediction service at once.
+
+    Parameters
+    ----------
+    sources : list
+        Paths to the saved audio files, or in-memory audio content.
+    prediction_service : PredictionService
+        A service used to make chord name predictions.
+    executor : concurrent.futures.Executor
+        (Optional) An executor for featurizing files in parallel, e.g. a process pool.
+        If omitted, the files are featurized sequentially.
+    streaming : bool
+        Whether to decode and featurize the files block by block to keep memory usage bounded.
+    top_k : int
+        Number of most likely chords to return as alternatives for each time offset.
+        0 disables alternatives.
+    change_threshold : float
+        Min cosine distance between the chroma of adjacent chunks that starts a new chord segment.
+        Only one averaged row per segment is predicted. 0 predicts every chunk.
+    analysis_profile : str
+        (Optional) Name of the analysis profile to featurize with, see `resolve_analysis_profile`.
+
+    Returns
+    -------
+    list
+        One dictionary per input file, in the same order: either {'chords': [...]} with the
+        chords in the `recognize_saved_file` format, or {'error': message} for files that
+        cannot be recognized.
+    """
+    profile = resolve_analysis_profile(prediction_service, analysis_profile)
+    logger.info(
+        f'Starting batch recognition of {len(sources)} files ({profile.name} analysis profile)'
+    )
+    featurize = functools.partial(featurize_file_block, streaming=streaming,
+                                  skip_silence=uses_silence_prepass(streaming), profile=profile)
+    futures = [executor.submit(featurize, source) for source in sources] if executor else None
+
+    results = [None] * len(sources)
+    batch_features = []
+    for i, source in enumerate(sources):
+        try:
+            features = futures[i].result() if futures else featurize(source)
+            batch_features.append((i, features.get_non_silent()))
+        except KnownRequestParseError as e:
+            logger.info(f'Cannot recognize {describe_audio_source(source)}: {str(e)}')
+            results[i] = {'error': str(e)}
+
+    # Request predictions for all files at once, one row per stable segment of each file.
+    if batch_features:
+        segments = [
+            get_segment_representatives(features.features, change_threshold)
+            for _, features in batch_features
+        ]
+        feature_matrix = np.concatenate([representatives for representatives, _ in segments])
+        logger.info(f'Non-silent batch data shape: {feature_matrix.shape}')
+        with trace_stage('predict'):
+            df_predictions = prediction_service.predict(feature_matrix, top_k=top_k)
+
+        # Split the predictions back by file.
+        start = 0
+        for (i, features), (representatives, segment_ids) in zip(batch_features, segments):
+            end = start + len(representatives)
+            df_file_predictions = df_predictions.iloc[start:end].reset_index(drop=True)
+            df_file_predictions = expand_segment_predictions(df_file_predictions, segment_ids)
+            chords = postprocess_predictions(df_file_predictions, features.time_offsets)
+            results[i] = {'chords': chords}
+            start += len(representatives)
+
+    return results
+
+
 def remove_repeating_chords(chords):
     """
     Post-process the recognized chords, replacing identical adjacent chords with a single one.
@@ -0,0 +1,287 @@
+"""
+Per-stage latency tracing of the recognition pipeline.
+
+A trace is started for a request with `start_trace`, and the pipeline times its stages
+with `trace_stage`:
+
+* upload: parsing and saving the uploaded file
+* decode: decoding and resampling the audio
+* stft: magnitude spectrogram
+* rms: frame-level RMS
+* tuning: chroma tuning estimate
+* chroma: chromagram
+* chunking: aggregating the frames into chunks
+* silence: detecting and filtering out silent chunks
+* predict: chord predictions, including remote calls and micro-batching waits
+* postprocess: converting the predictions to chords
+* serialize: encoding the response
+
+When no trace is active, e.g. when tracing is disabled, `trace_stage` returns a shared no-op
+context manager.
+"""
+import collections
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import numpy as np
+
+
+# Number of the most recent durations of each stage kept for percentiles.
+DEFAULT_TRACE_HISTORY_SIZE = 1024
+
+# Name of the traces that are not started for a specific operation.
+DEFAULT_TRACE_NAME = 'request'
+
+_current_trace = contextvars.ContextVar('dechorder_trace', default=None)
+_disabled_stage = contextlib.nullcontext()
+
+
+class Trace(object):
+    """
+    Stage durations of a single request. Traces are aggregated by name, e.g. of the endpoint.
+
+    Stages may be nested, e.g. the RMS of the float32 engine is computed by the default one,
+    but only the outermost open stage is timed, so that no time is counted twice.
+    A stage that runs more than once, e.g. for each block of a stream, accumulates its durations.
+    """
+    def __init__(self, name=DEFAULT_TRACE_NAME):
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.stages = collections.OrderedDict()
+        self._open_stage = None
+
+    def stage(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            Stage name.
+
+        Returns
+        -------
+        A context manager that times the stage.
+        """
+        return _TraceStage(self, name)
+
+    def add(self, name, seconds):
+        """
+        Add the duration of a stage measured elsewhere.
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def get_total_seconds(self):
+        """
+        Returns
+        -------
+        float
+            Time since the trace was started.
+        """
+        return time.perf_counter() - self.start_time
+
+    def to_server_timing(self):
+        """
+        Returns
+        -------
+        str
+            The stage durations and the total time, formatted as a `Server-Timing` header value.
+        """
+        metrics = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.stages.items()]
+        metrics.append(f'total;dur={self.get_total_seconds() * 1000:.3f}')
+        return ', '.join(metrics)
+
+    def to_log_fields(self):
+        """
+        Returns
+        -------
+        dict
+            The stage durations and the total time in milliseconds, for structured logs.
+        """
+        return {
+            'totalMs': round(self.get_total_seconds() * 1000, 3),
+            'stagesMs': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+        }
+
+
+class _TraceStage(object):
+    __slots__ = ['trace', 'name', 'start_time', 'is_outermost']
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start_time = None
+        self.is_outermost = False
+
+    def __enter__(self):
+        self.is_outermost = self.trace._open_stage is None
+        if self.is_outermost:
+            self.trace._open_stage = self.name
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.is_outermost:
+            self.trace.add(self.name, time.perf_counter() - self.start_time)
+            self.trace._open_stage = None
+
+
+def start_trace(name=DEFAULT_TRACE_NAME):
+    """
+    Start tracing the current request in the current thread (or context).
+
+    Parameters
+    ----------
+    name : str
+        (Optional) Trace name, e.g. of the endpoint.
+
+    Returns
+    -------
+    tuple
+        (trace, token): the new trace, and the token to pass to `end_trace`.
+    """
+    trace = Trace(name)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    """
+    Stop tracing the request started with `start_trace`.
+    """
+    _current_trace.reset(token)
+
+
+def get_current_trace():
+    """
+    Returns
+    -------
+    Trace
+        The trace of the current request, or None if it is not traced.
+    """
+    return _current_trace.get()
+
+
+def trace_stage(name):
+    """
+    Time a stage of the current request:
+
+        with trace_stage('decode'):
+            ...
+
+    Parameters
+    ----------
+    name : str
+        Stage name.
+
+    Returns
+    -------
+    A context manager that times the stage, or does nothing if the request is not traced.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _disabled_stage
+    return trace.stage(name)
+
+
+def traced_iter(name, iterable):
+    """
+    Time the production of each item of an iterable as the stage, e.g. decoding of audio blocks.
+
+    Parameters
+    ----------
+    name : str
+        Stage name.
+    iterable : iterable
+        The items to produce.
+
+    Yields
+    ------
+    The items of the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        with trace_stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class TraceAggregator(object):
+    """
+    Aggregates the stage durations of all traced requests in the process, by trace name:
+    the number of requests that ran each stage, the mean and max durations, and the percentiles
+    of the recent ones.
+    """
+    def __init__(self, history_size=DEFAULT_TRACE_HISTORY_SIZE):
+        self.history_size = history_size
+        self._request_counts = collections.Counter()
+        # Keyed by (trace name, stage name).
+        self._stage_counts = collections.Counter()
+        self._stage_totals = collections.Counter()
+        self._stage_max = {}
+        self._stage_history = {}
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        """
+        Parameters
+        ----------
+        trace : Trace
+            A finished request trace.
+        """
+        stages = dict(trace.stages, total=trace.get_total_seconds())
+        with self._lock:
+            self._request_counts[trace.name] += 1
+            for name, seconds in stages.items():
+                key = (trace.name, name)
+                self._stage_counts[key] += 1
+                self._stage_totals[key] += seconds
+                self._stage_max[key] = max(self._stage_max.get(key, 0.0), seconds)
+                history = self._stage_history.setdefault(
+                    key,
+                    collections.deque(maxlen=self.history_size),
+                )
+                history.append(seconds)
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            For each trace name, the number of traced requests and the durations of each stage
+            in milliseconds.
+        """
+        with self._lock:
+            stats = {
+                trace_name: {'requests': count, 'stages': {}}
+                for trace_name, count in self._request_counts.items()
+            }
+            for (trace_name, name), count in self._stage_counts.items():
+                history = np.array(self._stage_history[trace_name, name]) * 1000
+                stats[trace_name]['stages'][name] = {
+                    'requests': count,
+                    'meanMs': self._stage_totals[trace_name, name] * 1000 / count,
+                    'p50Ms': float(np.percentile(history, 50)),
+                    'p95Ms': float(np.percentile(history, 95)),
+                    'maxMs': self._stage_max[trace_name, name] * 1000,
+                }
+            return stats
+
+
+def get_trace_aggregator():
+    """
+    Create a trace aggregator if tracing is enabled by the environment variable:
+
+    * DECHORDER_TRACING: set to 1 to trace the stages of each request.
+
+    Returns
+    -------
+    TraceAggregator
+        A trace aggregator, or None if tracing is disabled.
+    """
+    if os.environ.get('DECHORDER_TRACING') != '1':
+        return None
+    return TraceAggregator()
@@ -1,4 +1,4 @@
-import json
+import binascii
 import logging
 import os
 import uuid
@@ -9,6 +9,9 @@ logger = logging.getLogger(__name__)
 
 ALLOWED_EXTENSIONS = ['.wav', '.mp3', '.m4a']
 
+# Max number of chord alternatives a client can request for each time offset.
+MAX_ALTERNATIVES = 5
+
 
 class KnownRequestParseError(Exception):
     """
@@ -19,16 +22,183 @@ class KnownRequestParseError(Exception):
 
 class UploadedFile(object):
     """
-    Represents a file extracted from a multipart/form-data HTTP request and saved to disk.
+    Represents a file extracted from a multipart/form-data HTTP request,
+    either saved to disk (`stored_filename`) or kept in memory (`content`).
     """
-    def __init__(self, original_filename, stored_filename, mime_type, metadata=None):
+    def __init__(self, original_filename, stored_filename, mime_type, metadata=None, content=None):
         self.original_filename = original_filename
         self.stored_filename = stored_filename
         self.mime_type = mime_type
         self.metadata = metadata or {}
+        self.content = content
+
+    @property
+    def source(self):
+        """
+        Audio source to pass to recognition: the in-memory content if available,
+        otherwise the saved file path.
+        """
+        return self.content if self.content is not None else self.stored_filename
+
+
+# Size of the base64 text decoded at once. Must be a multiple of 4.
+BASE64_DECODE_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def decode_base64_body(encoded_body, chunk_size=BASE64_DECODE_CHUNK_SIZE):
+    """
+    Decode a base64-encoded request body (e.g. the body of an API Gateway event) chunk by chunk
+    into a preallocated buffer, so that no intermediate full-size copies are made.
+
+    Parameters
+    ----------
+    encoded_body : str or bytes
+        Base64-encoded body without line breaks.
+    chunk_size : int
+        Number of base64 characters decoded at once.
+
+    Returns
+    -------
+    bytearray
+        Decoded body.
+    """
+    # Both str and bytes slices are accepted by binascii,
+    # so the encoded body is never copied as a whole.
+    tail = encoded_body[-2:]
+    padding = tail.count('=' if isinstance(tail, str) else b'=')
+    decoded_body = bytearray(max(len(encoded_body) // 4 * 3 - padding, 0))
+    decoded_view = memoryview(decoded_body)
+
+    position = 0
+    try:
+        for start in range(0, len(encoded_body), chunk_size):
+            decoded_chunk = binascii.a2b_base64(encoded_body[start:start + chunk_size])
+            decoded_view[position:position + len(decoded_chunk)] = decoded_chunk
+            position += len(decoded_chunk)
+    except (binascii.Error, ValueError):
+        raise KnownRequestParseError('Malformed base64-encoded request body')
+
+    if position != len(decoded_body):
+        raise KnownRequestParseError('Malformed base64-encoded request body')
+    return decoded_body
+
+
+def parse_multipart_part_headers(header_block):
+    """
+    Parse the headers of a single multipart/form-data part.
+
+    Parameters
+    ----------
+    header_block : bytes
+        Raw header lines of the part, separated by CRLF.
+
+    Returns
+    -------
+    tuple
+        (content_disposition_params, content_type), where the params is a dict with the
+        Content-Disposition parameters (e.g. 'name', 'filename'), and content_type may be None.
+    """
+    disposition_params = None
+    content_type = None
+
+    for line in header_block.decode('utf-8').split('\r\n'):
+        header, _, value = line.partition(':')
+        header = header.strip().lower()
+        if header == 'content-disposition':
+            disposition_params = {}
+            for param in value.split(';')[1:]:
+                key, _, param_value = param.strip().partition('=')
+                disposition_params[key.lower()] = param_value.strip('"')
+        elif header == 'content-type':
+            content_type = value.strip()
+
+    if disposition_params is None or 'name' not in disposition_params:
+        logger.warning(f'Failed to parse multipart part headers: {header_block!r}')
+        raise KnownRequestParseError('Malformed request body')
+    return disposition_params, content_type
+
+
+def find_multipart_file(body, boundary, field_name):
+    """
+    Find a file field in a multipart/form-data body in a single pass,
+    without copying the file content.
+
+    Parameters
+    ----------
+    body : bytes or bytearray
+        Raw request body.
+    boundary : bytes
+        Multipart boundary from the Content-Type header.
+    field_name : str
+        Name of the form field to find.
+
+    Returns
+    -------
+    tuple
+        (content_disposition_params, content_type, payload), where the payload
+        is a memoryview slice of the body. None if the field is not present.
+    """
+    newline = b'\r\n'
+    delimiter = b'--' + boundary
+    body_view = memoryview(body)
+
+    position = body.find(delimiter)
+    while position >= 0:
+        position += len(delimiter)
+        if body[position:position + 2] == b'--':
+            # Final delimiter, no more parts.
+            return None
+        if body[position:position + 2] != newline:
+            break
+
+        headers_start = position + 2
+        headers_end = body.find(newline + newline, headers_start)
+        if headers_end < 0:
+            break
+
+        payload_start = headers_end + 4
+        payload_end = body.find(newline + delimiter, payload_start)
+        if payload_end < 0:
+            break
+
+        part_headers = body[headers_start:headers_end]
+        disposition_params, content_type = parse_multipart_part_headers(part_headers)
+        if disposition_params['name'] == field_name:
+            return disposition_params, content_type, body_view[payload_start:payload_end]
+
+        position = payload_end + 2
+
+    logger.warning('Failed to parse the raw multipart body')
+    raise KnownRequestParseError('Expected a non-empty multipart/form-data body')
+
+
+def parse_alternatives_count(value):
+    """
+    Parse the number of chord alternatives requested by the client.
+
+    Parameters
+    ----------
+    value : str
+        Value of the 'alternatives' query string parameter, or None if it is missing.
+
+    Returns
+    -------
+    int
+        Number of alternatives, from 0 (no alternatives) to MAX_ALTERNATIVES.
+    """
+    if value is None or value == '':
+        return 0
+    try:
+        count = int(value)
+    except ValueError:
+        count = -1
+    if not 0 <= count <= MAX_ALTERNATIVES:
+        msg = f'Expected "alternatives" to be an integer from 0 to {MAX_ALTERNATIVES}'
+        raise KnownRequestParseError(msg)
+    return count
 
 
-def extract_file_from_http_request(headers, body, upload_dir, unique_id=None):
+def extract_file_from_http_request(headers, body, upload_dir=None, unique_id=None):
     """
     Parse the raw HTTP POST request and extract the audio file from it.
 
@@ -36,16 +206,18 @@ def extract_file_from_http_request(headers, body, upload_dir, unique_id=None):
     ----------
     headers : dict
         Request headers.
-    body : bytes
+    body : bytes or bytearray
         Raw request body.
-    upload_dir: str
+    upload_dir: str (optional)
         Path to the folder for storing extracted files.
+        If omitted, the file content is kept in memory and nothing is written to disk.
     unique_id : str (optional)
         A string uniquely identifying this HTTP request.
 
     Returns
     -------
     UploadedFile
+        The file, with in-memory content as a memoryview into `body`.
     """
     headers = {
         header.lower(): value
@@ -57,56 +229,39 @@ def extract_file_from_http_request(headers, body, upload_dir, unique_id=None):
 
     unique_id = unique_id or str(uuid.uuid4())
     content_type = headers['content-type']
+    boundary = content_type.split('boundary=')[-1].split(';')[0].strip().replace('"', '')
+    boundary = boundary.encode('utf-8')
 
-    # Separate the file part from multipart form data.
-    newline = b'\r\n'
-    boundary = content_type.split('boundary=')[-1].replace('"', '').encode('utf-8')
-    initial_delimiter = b'--' + boundary + newline
-    final_delimiter = newline + b'--' + boundary + b'--'
-    try:
-        file_part = body.split(initial_delimiter)[1].split(final_delimiter)[0]
-    except Exception:
-        logger.warning('Failed to parse the raw multipart body', exc_info=True)
+    # Find the file part. The payload is a view into the body rather than a copy.
+    if not body:
         raise KnownRequestParseError('Expected a non-empty multipart/form-data body')
-
-    # Separate Content-Disposition, Content-Type (optional), and file content.
-    file_part_lines = [line for line in file_part.split(newline) if line]
-    cdisp_line = None
-    ctype_line = None
-    file_content = None
-
-    for i, line in enumerate(file_part_lines):
-        if line.startswith(b'Content-Disposition'):
-            cdisp_line = line.decode('utf-8')
-        elif line.startswith(b'Content-Type'):
-            ctype_line = line.decode('utf-8')
-        else:
-            file_content = newline.join([fpl for fpl in file_part_lines[i:]])
-            break
-
-    # Parse Content-Disposition to extract parameter name and original filename.
-    cdisp_line = cdisp_line.replace('; name=', '"name": ')
-    cdisp_line = cdisp_line.replace('; filename=', ', "filename": ')
-    cdisp_line = '{' + cdisp_line.replace('Content-Disposition: form-data', '') + '}'
-    try:
-        content_disposition = json.loads(cdisp_line)
-    except Exception:
-        logger.warning(f'Failed to parse Content-Disposition line: {cdisp_line}', exc_info=True)
-        raise KnownRequestParseError('Malformed request body')
+    file_part = find_multipart_file(body, boundary, 'audio-file')
+    if not file_part:
+        raise KnownRequestParseError('Expected a file with key "audio-file" in the request')
+    content_disposition, mime_type, file_content = file_part
 
     # Check if the request form is valid.
-    if content_disposition['name'] != 'audio-file':
+    if 'filename' not in content_disposition:
         raise KnownRequestParseError('Expected a file with key "audio-file" in the request')
 
     original_filename = content_disposition['filename']
     original_extension = os.path.splitext(original_filename)[1].lower()
-    mime_type = ctype_line.replace('Content-Type: ', '') if ctype_line else 'text/plain'
+    mime_type = mime_type or 'text/plain'
     logger.info(f'Original filename: "{original_filename}". Inferred MIME type: {mime_type}')
 
     if original_extension not in ALLOWED_EXTENSIONS:
         msg = 'Only the following file extensions are supported: ' + ', '.join(ALLOWED_EXTENSIONS)
         raise KnownRequestParseError(msg)
 
+    if not upload_dir:
+        logger.info('Keeping uploaded file ({} bytes) in memory'.format(len(file_content)))
+        return UploadedFile(
+            original_filename=original_filename,
+            stored_filename=None,
+            mime_type=mime_type,
+            content=file_content,
+        )
+
     # Save the file to disk.
     storage_path = os.path.join(upload_dir, f'{unique_id}{original_extension}')
     logger.info('Saving uploaded file ({} bytes) to: "{}"'.format(len(file_content), storage_path))
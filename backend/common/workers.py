@@ -0,0 +1,141 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+
+from common.predictions import get_prediction_service
+from common.recognition import recognize_saved_file
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of requests that may wait for a free worker before new ones are rejected, per worker.
+DEFAULT_QUEUE_SIZE_PER_WORKER = 2
+
+# Worker processes are started by a fork server rather than forked from a multithreaded web server:
+# a lock held by another thread at the time of the fork (e.g. of logging) would never be released
+# in the child.
+WORKER_PROCESS_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+
+class WorkerPoolBusyError(Exception):
+    """
+    Occurs when the recognition queue is full and the request cannot be admitted.
+    """
+    pass
+
+
+# Prediction service of the current worker process. Created once by the pool initializer
+# so that the model is loaded once per process rather than once per task.
+_worker_prediction_service = None
+
+
+def _initialize_worker(service_key):
+    global _worker_prediction_service
+    _worker_prediction_service = get_prediction_service(service_key)
+    logger.info(f'Recognition worker initialized with {service_key}')
+
+
+def _recognize_in_worker(source, options):
+    return recognize_saved_file(source, _worker_prediction_service, **options)
+
+
+class RecognitionWorkerPool(object):
+    """
+    Runs chord recognition on a pool of worker processes, keeping CPU-heavy featurization
+    off the web server threads. Admission is bounded: once all workers are busy and the queue
+    is full, new requests are rejected with WorkerPoolBusyError instead of piling up.
+    """
+    def __init__(self, service_key, max_workers, max_queue_size):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=WORKER_PROCESS_CONTEXT,
+            initializer=_initialize_worker,
+            initargs=(service_key,),
+        )
+        self.completed = 0
+        self.rejected = 0
+
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, source, **options):
+        """
+        Schedule recognition of the specified audio file.
+
+        Parameters
+        ----------
+        source : str or bytes
+            A path to the saved audio file, or in-memory audio content.
+        options
+            Keyword arguments for `recognize_saved_file`.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            A future with the `recognize_saved_file` result.
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue_size:
+                self.rejected += 1
+                raise WorkerPoolBusyError('The server is busy, please retry later')
+            self._in_flight += 1
+
+        try:
+            future = self.executor.submit(_recognize_in_worker, source, options)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release(is_completed=True))
+        return future
+
+    def recognize(self, source, **options):
+        """
+        Recognize chords in the specified audio file on a worker and wait for the result.
+
+        Parameters
+        ----------
+        source : str or bytes
+            A path to the saved audio file, or in-memory audio content.
+        options
+            Keyword arguments for `recognize_saved_file`.
+
+        Returns
+        -------
+        list
+            The `recognize_saved_file` result.
+        """
+        return self.submit(source, **options).result()
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Queue depth, worker utilization and request counters.
+        """
+        with self._lock:
+            busy_workers = min(self._in_flight, self.max_workers)
+            return {
+                'workers': self.max_workers,
+                'busyWorkers': busy_workers,
+                'utilization': busy_workers / self.max_workers,
+                'queueDepth': self._in_flight - busy_workers,
+                'queueCapacity': self.max_queue_size,
+                'completed': self.completed,
+                'rejected': self.rejected,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def _release(self, is_completed=False):
+        with self._lock:
+            self._in_flight -= 1
+            if is_completed:
+                self.completed += 1
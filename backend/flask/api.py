@@ -6,25 +6,100 @@ Flask API serving the chord recognition routes.
 * To run in test mode and recognize a single file, run it as a Python script:
   PYTHONPATH=.. ./api.py <filename>
 """
+import concurrent.futures
 import datetime
+import itertools
 import logging
 import os
 import sys
+import time
+import uuid
 
-from flask import Flask, request, jsonify
+from flask import Flask, g, json, request, jsonify
 from flask.logging import default_handler
 
+from common.caching import get_frame_cache, get_result_cache
+from common.features import DEFAULT_FEATURE_BATCH_SECONDS, SECONDS_PER_CHUNK
+from common.jobs import (
+    DEFAULT_JOB_TIMEOUT_SECONDS,
+    DEFAULT_JOB_TTL_SECONDS,
+    get_job_store,
+    run_job,
+)
+from common.live import LiveSessionLimitError, get_live_session_store
 from common.predictions import get_prediction_service
-from common.recognition import recognize_saved_file
-from common.utilities import ALLOWED_EXTENSIONS, KnownRequestParseError, UploadedFile
+from common.predictions.batching import DEFAULT_MAX_BATCH_ROWS, MicroBatchingPredictionService
+from common.predictions.cascade import CascadePredictionService
+from common.recognition import (
+    iter_recognized_chords,
+    recognize_saved_file,
+    recognize_saved_files,
+    recognize_with_cache,
+    resolve_analysis_profile,
+)
+from common.tracing import end_trace, get_trace_aggregator, start_trace, trace_stage
+from common.utilities import (
+    ALLOWED_EXTENSIONS,
+    KnownRequestParseError,
+    UploadedFile,
+    parse_alternatives_count,
+)
+from common.workers import (
+    DEFAULT_QUEUE_SIZE_PER_WORKER,
+    WORKER_PROCESS_CONTEXT,
+    RecognitionWorkerPool,
+    WorkerPoolBusyError,
+)
 
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = os.environ['FLASK_UPLOAD_FOLDER']
 app.config['PREDICTION_SERVICE'] = os.environ['DECHORDER_PREDICTION_SERVICE']
+app.config['STREAMING_FEATURIZATION'] = os.environ.get('DECHORDER_STREAMING_FEATURIZATION') == '1'
+app.config['CHANGE_THRESHOLD'] = float(os.environ.get('DECHORDER_CHANGE_THRESHOLD', 0))
+app.config['IN_MEMORY_UPLOADS'] = os.environ.get('DECHORDER_IN_MEMORY_UPLOADS') == '1'
+app.config['BATCH_WORKERS'] = int(os.environ.get('DECHORDER_BATCH_WORKERS', 0)) or os.cpu_count()
+app.config['RECOGNITION_WORKERS'] = int(os.environ.get('DECHORDER_RECOGNITION_WORKERS', 0))
+app.config['RECOGNITION_QUEUE_SIZE'] = int(os.environ.get(
+    'DECHORDER_RECOGNITION_QUEUE_SIZE',
+    app.config['RECOGNITION_WORKERS'] * DEFAULT_QUEUE_SIZE_PER_WORKER,
+))
+app.config['RETRY_AFTER_SECONDS'] = int(os.environ.get('DECHORDER_RETRY_AFTER_SECONDS', 5))
+app.config['JOB_WORKERS'] = int(os.environ.get('DECHORDER_JOB_WORKERS', 2))
+app.config['MICRO_BATCHING_MAX_WAIT_MS'] = float(os.environ.get(
+    'DECHORDER_MICRO_BATCHING_MAX_WAIT_MS',
+    0,
+))
+app.config['MICRO_BATCHING_MAX_ROWS'] = int(os.environ.get(
+    'DECHORDER_MICRO_BATCHING_MAX_ROWS',
+    DEFAULT_MAX_BATCH_ROWS,
+))
+app.config['NDJSON_BATCH_SECONDS'] = float(os.environ.get(
+    'DECHORDER_NDJSON_BATCH_SECONDS',
+    DEFAULT_FEATURE_BATCH_SECONDS,
+))
+app.config['JOB_TTL_SECONDS'] = int(os.environ.get(
+    'DECHORDER_JOB_TTL_SECONDS',
+    DEFAULT_JOB_TTL_SECONDS,
+))
+app.config['JOB_TIMEOUT_SECONDS'] = int(os.environ.get(
+    'DECHORDER_JOB_TIMEOUT_SECONDS',
+    DEFAULT_JOB_TIMEOUT_SECONDS,
+))
+
+# Endpoints whose pipeline stages are traced when tracing is enabled, aggregated separately.
+TRACED_ENDPOINTS = ['recognize_file', 'recognize_files', 'push_live_audio', 'finish_live_session']
 
 
 prediction_service = None
+result_cache = None
+frame_cache = None
+batch_executor = None
+worker_pool = None
+job_store = None
+job_executor = None
+live_store = None
+trace_aggregator = None
 
 
 def bootstrap():
@@ -37,6 +112,65 @@ def bootstrap():
     global prediction_service
     prediction_service = get_prediction_service(app.config['PREDICTION_SERVICE'])
 
+    # Concurrent requests share batched predictions when micro-batching is enabled.
+    if app.config['MICRO_BATCHING_MAX_WAIT_MS'] > 0:
+        prediction_service = MicroBatchingPredictionService(
+            prediction_service,
+            max_batch_rows=app.config['MICRO_BATCHING_MAX_ROWS'],
+            max_wait_seconds=app.config['MICRO_BATCHING_MAX_WAIT_MS'] / 1000,
+        )
+
+    global result_cache
+    result_cache = get_result_cache()
+
+    global frame_cache
+    frame_cache = get_frame_cache()
+
+    # Recognition runs in the request thread unless a pool of worker processes is configured.
+    global worker_pool
+    if app.config['RECOGNITION_WORKERS'] > 0:
+        worker_pool = RecognitionWorkerPool(
+            app.config['PREDICTION_SERVICE'],
+            max_workers=app.config['RECOGNITION_WORKERS'],
+            max_queue_size=app.config['RECOGNITION_QUEUE_SIZE'],
+        )
+
+    # Asynchronous jobs are enabled when a job store is configured.
+    global job_store, job_executor
+    job_store = get_job_store()
+    if job_store:
+        job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'])
+
+    # Live recognition sessions are enabled when their max number is configured.
+    global live_store
+    live_store = get_live_session_store()
+
+    # Per-stage latencies of the recognition endpoints are aggregated when tracing is enabled.
+    global trace_aggregator
+    trace_aggregator = get_trace_aggregator()
+
+
+@app.before_request
+def start_request_trace():
+    if trace_aggregator and request.endpoint in TRACED_ENDPOINTS:
+        g.trace, g.trace_token = start_trace(request.endpoint)
+
+
+@app.after_request
+def add_server_timing(response):
+    trace = g.get('trace')
+    if trace:
+        response.headers['Server-Timing'] = trace.to_server_timing()
+        trace_aggregator.add(trace)
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exception):
+    token = g.pop('trace_token', None)
+    if token:
+        end_trace(token)
+
 
 class RequestFormatter(logging.Formatter):
     def format(self, record):
@@ -45,11 +179,7 @@ class RequestFormatter(logging.Formatter):
         return super().format(record)
 
 
-def extract_uploaded_file():
-    if 'audio-file' not in request.files:
-        raise KnownRequestParseError('Expected a file with key "audio-file" in the request')
-
-    audio_file = request.files['audio-file']
+def save_uploaded_file(audio_file, in_memory=False):
     if not audio_file:
         raise KnownRequestParseError('Audio file missing')
 
@@ -58,7 +188,18 @@ def extract_uploaded_file():
         msg = 'Only the following file extensions are supported: ' + ', '.join(ALLOWED_EXTENSIONS)
         raise KnownRequestParseError(msg)
 
-    filename = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + ext
+    if in_memory:
+        content = audio_file.read()
+        app.logger.info(f'Keeping uploaded file ({len(content)} bytes) in memory')
+        return UploadedFile(
+            original_filename=audio_file.filename,
+            stored_filename=None,
+            mime_type=audio_file.content_type,
+            content=content,
+        )
+
+    # A random suffix keeps the names unique for concurrent and batch uploads.
+    filename = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:8] + ext
     saved_audio_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     audio_file.save(saved_audio_path)
     file_size = os.stat(saved_audio_path).st_size
@@ -71,22 +212,141 @@ def extract_uploaded_file():
     )
 
 
-def serve_error(message, status_code=500):
-    return jsonify({'message': message}), status_code
+def extract_uploaded_file(in_memory=False):
+    with trace_stage('upload'):
+        if 'audio-file' not in request.files:
+            raise KnownRequestParseError('Expected a file with key "audio-file" in the request')
+
+        return save_uploaded_file(request.files['audio-file'], in_memory)
+
+
+def extract_uploaded_files(in_memory=False):
+    with trace_stage('upload'):
+        audio_files = request.files.getlist('audio-file')
+        if not audio_files:
+            raise KnownRequestParseError(
+                'Expected one or more files with key "audio-file" in the request'
+            )
+
+        return [save_uploaded_file(audio_file, in_memory) for audio_file in audio_files]
+
+
+def get_batch_executor():
+    global batch_executor
+    if not batch_executor:
+        batch_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=app.config['BATCH_WORKERS'],
+            mp_context=WORKER_PROCESS_CONTEXT,
+        )
+    return batch_executor
+
+
+def serve_error(message, status_code=500, headers=None):
+    return jsonify({'message': message}), status_code, headers or {}
 
 
 def serve_ok(result_obj):
-    return jsonify(result_obj)
+    with trace_stage('serialize'):
+        return jsonify(result_obj)
+
+
+def serve_ndjson(batches, start_time):
+    # The first batch is recognized before the response starts, so that undecodable files still get
+    # an error status. Errors after that can only be reported in the stream.
+    first_batch = next(batches, [])
+    first_batch_seconds = time.perf_counter() - start_time
+
+    def generate():
+        n_records = 0
+        try:
+            for chords in itertools.chain([first_batch], batches):
+                for chord in chords:
+                    n_records += 1
+                    yield json.dumps(chord) + '\n'
+        except Exception as e:
+            app.logger.info(f'Streaming recognition failed after {n_records} records: {str(e)}')
+            yield json.dumps({'error': str(e)}) + '\n'
+            return
+
+        app.logger.info(
+            f'Streaming recognition successful, returned {n_records} records, '
+            f'first batch after {first_batch_seconds:.3f} s, '
+            f'all after {time.perf_counter() - start_time:.3f} s'
+        )
+
+    return app.response_class(generate(), mimetype='application/x-ndjson')
+
+
+def is_streaming_requested():
+    return request.args.get('stream') == '1'
+
+
+def get_alternatives_count():
+    return parse_alternatives_count(request.args.get('alternatives'))
+
+
+def get_analysis_profile_name():
+    return request.args.get('profile') or None
+
+
+def get_recognition_options(top_k=0, analysis_profile=None):
+    # Options that affect the recognition result, and therefore are a part of the cache key.
+    return {
+        'streaming': app.config['STREAMING_FEATURIZATION'],
+        'top_k': top_k,
+        'change_threshold': app.config['CHANGE_THRESHOLD'],
+        'analysis_profile': analysis_profile,
+    }
+
+
+def recognize_uploaded_file(uploaded_file, top_k=0, analysis_profile=None):
+    source = uploaded_file.source
+    options = get_recognition_options(top_k, analysis_profile)
+    if not worker_pool:
+        return recognize_saved_file(source, prediction_service, cache=result_cache,
+                                    frame_cache=frame_cache, **options)
+
+    def recognize_func():
+        return worker_pool.recognize(source, frame_cache=frame_cache, **options)
+
+    if not result_cache:
+        return recognize_func()
+    return recognize_with_cache(source, prediction_service, result_cache, recognize_func, **options)
+
+
+def recognize_uploaded_file_ndjson(uploaded_file, start_time, top_k=0, analysis_profile=None):
+    # Batches are yielded by the request thread, so the worker pool is not used.
+    batches = iter_recognized_chords(
+        uploaded_file.source,
+        prediction_service,
+        cache=result_cache,
+        top_k=top_k,
+        change_threshold=app.config['CHANGE_THRESHOLD'],
+        analysis_profile=analysis_profile,
+        batch_seconds=app.config['NDJSON_BATCH_SECONDS'],
+    )
+    return serve_ndjson(batches, start_time)
 
 
 @app.route('/api/recognize', methods=['POST'])
 def recognize_file():
     try:
-        uploaded_file = extract_uploaded_file()
-        response_payload = recognize_saved_file(uploaded_file.stored_filename, prediction_service)
+        start_time = time.perf_counter()
+        top_k = get_alternatives_count()
+        analysis_profile = get_analysis_profile_name()
+        uploaded_file = extract_uploaded_file(app.config['IN_MEMORY_UPLOADS'])
+        if is_streaming_requested():
+            return recognize_uploaded_file_ndjson(uploaded_file, start_time, top_k,
+                                                  analysis_profile)
+
+        response_payload = recognize_uploaded_file(uploaded_file, top_k, analysis_profile)
         app.logger.info(f'Recognition successful, returning {len(response_payload)} records')
         return serve_ok(response_payload)
 
+    except WorkerPoolBusyError as e:
+        app.logger.info(f'Recognition rejected, queue is full: {worker_pool.get_stats()}')
+        return serve_error(str(e), 503, {'Retry-After': str(app.config['RETRY_AFTER_SECONDS'])})
+
     except KnownRequestParseError as e:
         app.logger.info(f'Recognition failed, returning user error: {str(e)}')
         return serve_error(str(e), 400)
@@ -96,6 +356,204 @@ def recognize_file():
         return serve_error(str(e), 500)
 
 
+@app.route('/api/recognize/batch', methods=['POST'])
+def recognize_files():
+    try:
+        top_k = get_alternatives_count()
+        analysis_profile = get_analysis_profile_name()
+        uploaded_files = extract_uploaded_files(app.config['IN_MEMORY_UPLOADS'])
+        file_results = recognize_saved_files(
+            [uploaded_file.source for uploaded_file in uploaded_files],
+            prediction_service,
+            executor=get_batch_executor(),
+            **get_recognition_options(top_k, analysis_profile),
+        )
+        response_payload = [
+            dict(filename=uploaded_file.original_filename, **file_result)
+            for uploaded_file, file_result in zip(uploaded_files, file_results)
+        ]
+        app.logger.info(f'Batch recognition finished for {len(response_payload)} files')
+        return serve_ok(response_payload)
+
+    except KnownRequestParseError as e:
+        app.logger.info(f'Batch recognition failed, returning user error: {str(e)}')
+        return serve_error(str(e), 400)
+
+    except Exception as e:
+        app.logger.info(f'Batch recognition failed, returning internal error: {str(e)}')
+        return serve_error(str(e), 500)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    if not job_store:
+        return serve_error('Asynchronous jobs are disabled', 404)
+
+    try:
+        job_store.purge_expired(app.config['JOB_TTL_SECONDS'], app.config['JOB_TIMEOUT_SECONDS'])
+        top_k = get_alternatives_count()
+        analysis_profile = get_analysis_profile_name()
+        # Reject an unknown or mismatching profile now rather than in the job.
+        resolve_analysis_profile(prediction_service, analysis_profile)
+
+        uploaded_file = extract_uploaded_file()
+        job = job_store.create_job(uploaded_file.original_filename, uploaded_file.stored_filename)
+        job_executor.submit(
+            run_job,
+            job_store,
+            job.job_id,
+            prediction_service,
+            cache=result_cache,
+            frame_cache=frame_cache,
+            **get_recognition_options(top_k, analysis_profile),
+        )
+        app.logger.info(f'Job {job.job_id} submitted')
+        return jsonify(job.to_dict()), 202, {'Location': f'/api/jobs/{job.job_id}'}
+
+    except KnownRequestParseError as e:
+        app.logger.info(f'Job submission failed, returning user error: {str(e)}')
+        return serve_error(str(e), 400)
+
+    except Exception as e:
+        app.logger.info(f'Job submission failed, returning internal error: {str(e)}')
+        return serve_error(str(e), 500)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if not job_store:
+        return serve_error('Asynchronous jobs are disabled', 404)
+
+    job = job_store.get_job(job_id)
+    if not job:
+        return serve_error(f'Job {job_id} does not exist or has expired', 404)
+    return serve_ok(job.to_dict())
+
+
+@app.route('/api/live', methods=['POST'])
+def create_live_session():
+    if not live_store:
+        return serve_error('Live recognition is disabled', 404)
+
+    try:
+        input_format = request.args.get('format', 's16le')
+        session = live_store.create_session(
+            prediction_service,
+            input_format,
+            sample_rate=request.args.get('sampleRate'),
+            channels=request.args.get('channels'),
+            top_k=get_alternatives_count(),
+            analysis_profile=get_analysis_profile_name(),
+        )
+        response_payload = {
+            'sessionId': session.session_id,
+            'format': input_format,
+            'secondsPerChunk': SECONDS_PER_CHUNK,
+        }
+        return jsonify(response_payload), 201, {'Location': f'/api/live/{session.session_id}'}
+
+    except LiveSessionLimitError as e:
+        open_sessions = live_store.get_stats()['sessions']
+        app.logger.info(f'Live session rejected: {open_sessions} sessions are open')
+        return serve_error(str(e), 503, {'Retry-After': str(app.config['RETRY_AFTER_SECONDS'])})
+
+    except KnownRequestParseError as e:
+        app.logger.info(f'Live session failed to start, returning user error: {str(e)}')
+        return serve_error(str(e), 400)
+
+    except Exception as e:
+        app.logger.info(f'Live session failed to start, returning internal error: {str(e)}')
+        return serve_error(str(e), 500)
+
+
+@app.route('/api/live/<session_id>/audio', methods=['POST'])
+def push_live_audio(session_id):
+    if not live_store:
+        return serve_error('Live recognition is disabled', 404)
+
+    session = live_store.get_session(session_id)
+    if not session:
+        return serve_error(f'Live session {session_id} does not exist or has expired', 404)
+
+    try:
+        with trace_stage('upload'):
+            content = request.get_data()
+        return serve_ok({'chords': session.push(content)})
+
+    except KnownRequestParseError as e:
+        app.logger.info(f'Live recognition failed, returning user error: {str(e)}')
+        return serve_error(str(e), 400)
+
+    except Exception as e:
+        app.logger.info(f'Live recognition failed, returning internal error: {str(e)}')
+        return serve_error(str(e), 500)
+
+
+@app.route('/api/live/<session_id>', methods=['DELETE'])
+def finish_live_session(session_id):
+    if not live_store:
+        return serve_error('Live recognition is disabled', 404)
+
+    try:
+        chords = live_store.finish_session(session_id)
+        if chords is None:
+            return serve_error(f'Live session {session_id} does not exist or has expired', 404)
+        return serve_ok({'chords': chords})
+
+    except KnownRequestParseError as e:
+        app.logger.info(f'Live recognition failed, returning user error: {str(e)}')
+        return serve_error(str(e), 400)
+
+    except Exception as e:
+        app.logger.info(f'Live recognition failed, returning internal error: {str(e)}')
+        return serve_error(str(e), 500)
+
+
+@app.route('/api/stats/live', methods=['GET'])
+def live_stats():
+    if not live_store:
+        return serve_error('Live recognition is disabled', 404)
+    return serve_ok(live_store.get_stats())
+
+
+@app.route('/api/stats/tracing', methods=['GET'])
+def tracing_stats():
+    if not trace_aggregator:
+        return serve_error('Tracing is disabled', 404)
+    return serve_ok(trace_aggregator.get_stats())
+
+
+@app.route('/api/stats/cache', methods=['GET'])
+def cache_stats():
+    if not result_cache:
+        return serve_error('Recognition result cache is disabled', 404)
+    return serve_ok(result_cache.get_stats())
+
+
+@app.route('/api/stats/workers', methods=['GET'])
+def worker_stats():
+    if not worker_pool:
+        return serve_error('Recognition worker pool is disabled', 404)
+    return serve_ok(worker_pool.get_stats())
+
+
+@app.route('/api/stats/batching', methods=['GET'])
+def batching_stats():
+    if not isinstance(prediction_service, MicroBatchingPredictionService):
+        return serve_error('Micro-batching is disabled', 404)
+    return serve_ok(prediction_service.get_stats())
+
+
+@app.route('/api/stats/cascade', methods=['GET'])
+def cascade_stats():
+    service = prediction_service
+    if isinstance(service, MicroBatchingPredictionService):
+        service = service.service
+    if not isinstance(service, CascadePredictionService):
+        return serve_error('Cascade prediction is disabled', 404)
+    return serve_ok(service.get_stats())
+
+
 def main():
     test_filename = 'upload/test-audio.wav' if len(sys.argv) <= 1 else sys.argv[1]
     print(f'Running in test mode: recognizing {test_filename}')
@@ -3,8 +3,87 @@
 # DummyPredictionService: random predictions
 # DataRobotV1APIPredictionService: DataRobot Prediction API v1.0 predictions
 # EmbeddedPredictionService: predictions from a built-in neural network
+# TemplatePredictionService: predictions from matching chroma against ideal chord templates
+# CascadePredictionService: a fast service for all rows, an accurate one for the rows the fast one is unsure about
 export DECHORDER_PREDICTION_SERVICE=EmbeddedPredictionService
 
+# Model file for EmbeddedPredictionService (empty = common/predictions/embedded_model.npz),
+# and whether to fall back to TemplatePredictionService if the model file is missing
+export DECHORDER_EMBEDDED_MODEL_PATH=
+export DECHORDER_TEMPLATE_FALLBACK=0
+
+# Chord qualities recognized by TemplatePredictionService (comma-separated: major, minor, seventh)
+export DECHORDER_TEMPLATE_QUALITIES=major,minor
+
+# CascadePredictionService: the fast and the accurate services, and the confidence below which rows are escalated
+# (escalation rates are logged and served at /api/stats/cascade)
+export DECHORDER_CASCADE_FAST_SERVICE=TemplatePredictionService
+export DECHORDER_CASCADE_ACCURATE_SERVICE=DataRobotV1APIPredictionService
+export DECHORDER_CASCADE_CONFIDENCE_THRESHOLD=0.8
+
+# Set to 1 to decode and featurize uploads block by block (bounded memory for long recordings)
+export DECHORDER_STREAMING_FEATURIZATION=0
+
+# Audio decoder: librosa (soundfile, audioread for other formats) or ffmpeg (one subprocess that decodes,
+# downmixes and resamples; falls back to librosa if the binary is missing), and the ffmpeg binary if not on PATH
+export DECHORDER_AUDIO_DECODER=librosa
+export DECHORDER_FFMPEG_PATH=
+
+# Analysis profile: fast (11025 Hz, ~3x faster featurization), balanced or accurate (4096-sample frames).
+# The profile recorded with the embedded model takes precedence
+export DECHORDER_ANALYSIS_PROFILE=balanced
+
+# Featurization engine: default, or float32 (single precision, blockwise STFT: ~5x lower peak memory on long files)
+export DECHORDER_FEATURIZATION_ENGINE=default
+
+# Seconds of audio recognized per batch when /api/recognize streams NDJSON (stream=1)
+export DECHORDER_NDJSON_BATCH_SECONDS=30
+
+# Min cosine distance between the chroma of adjacent chunks that starts a new chord segment.
+# Only one averaged chunk per segment is predicted (0 = predict every chunk, 0.05 skips ~75% on data/rendered)
+export DECHORDER_CHANGE_THRESHOLD=0
+
+# Set to 1 to decode uploads from memory instead of saving them to FLASK_UPLOAD_FOLDER first
+# (formats that need a seekable file, e.g. M4A, are still spooled to a temporary file)
+export DECHORDER_IN_MEMORY_UPLOADS=1
+
+# Recognition result cache: max results in memory (0 = disabled), optional on-disk tier and its size limit
+export DECHORDER_RESULT_CACHE_ENTRIES=256
+export DECHORDER_RESULT_CACHE_DIR=
+export DECHORDER_RESULT_CACHE_MAX_BYTES=268435456
+
+# Frame-level feature cache (decoded chroma + RMS), lets model swaps skip decoding and STFT. Empty = disabled
+export DECHORDER_FRAME_CACHE_DIR=
+export DECHORDER_FRAME_CACHE_MAX_BYTES=1073741824
+
+# Number of processes featurizing files for /api/recognize/batch (0 = one per CPU core)
+export DECHORDER_BATCH_WORKERS=0
+
+# Recognition worker processes (0 = recognize in the request thread), admission queue size,
+# and the Retry-After value returned with 503 responses when the queue is full
+export DECHORDER_RECOGNITION_WORKERS=0
+export DECHORDER_RECOGNITION_QUEUE_SIZE=8
+export DECHORDER_RETRY_AFTER_SECONDS=5
+
+# Micro-batching of concurrent predictions: max added latency in ms (0 = disabled) and max rows per batch
+export DECHORDER_MICRO_BATCHING_MAX_WAIT_MS=0
+export DECHORDER_MICRO_BATCHING_MAX_ROWS=1024
+
+# Asynchronous jobs (/api/jobs): store directory (empty = disabled), worker threads, TTL of finished results,
+# and the seconds after creation at which an unfinished job is failed
+export DECHORDER_JOB_STORE_DIR=jobs
+export DECHORDER_JOB_WORKERS=2
+export DECHORDER_JOB_TTL_SECONDS=3600
+export DECHORDER_JOB_TIMEOUT_SECONDS=3600
+
+# Live recognition sessions (/api/live): max concurrent sessions (0 = disabled), and the seconds without audio
+# after which a session is closed
+export DECHORDER_LIVE_MAX_SESSIONS=0
+export DECHORDER_LIVE_IDLE_TIMEOUT_SECONDS=60
+
+# Set to 1 to time the pipeline stages of each recognition request (Server-Timing header, /api/stats/tracing)
+export DECHORDER_TRACING=0
+
 # DataRobot parameters
 export DATAROBOT_SERVER="https://<ENTER-URL-HERE>.datarobot.com"
 export DATAROBOT_SERVER_KEY="<ENTER-DATAROBOT-KEY-HERE>"
@@ -12,6 +91,14 @@ export DATAROBOT_DEPLOYMENT_ID="<ENTER-DEPLOYMENT-ID-HERE>"
 export DATAROBOT_USERNAME="<ENTER-USERNAME-HERE>"
 export DATAROBOT_API_TOKEN="<ENTER-API-TOKEN-HERE>"
 
+# DataRobot client: rows per request, concurrent requests, request timeout, retries of transient failures,
+# and the payload format (csv or json)
+export DATAROBOT_MAX_ROWS_PER_REQUEST=1000
+export DATAROBOT_MAX_CONCURRENT_REQUESTS=4
+export DATAROBOT_TIMEOUT_SECONDS=30
+export DATAROBOT_MAX_RETRIES=3
+export DATAROBOT_PAYLOAD_FORMAT=csv
+
 # Flask parameters
 export FLASK_APP=api.py
 export FLASK_ENV=development
@@ -61,7 +61,7 @@ def body_with_valid_audio_file(boundary, saved_audio_file):
     newline = b'\r\n'
     body = b'--' + boundary + newline
     body += b'Content-Disposition: form-data; name="audio-file"; filename="d-e-jazz.mp3"' + newline
-    body += b'Content-Type: audio/mp3' + newline
+    body += b'Content-Type: audio/mp3' + newline + newline
     with open(saved_audio_file, 'rb') as f:
         body += bytearray(f.read()) + newline
     body += b'--' + boundary + b'--' + newline
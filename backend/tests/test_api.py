@@ -0,0 +1,201 @@
+import concurrent.futures
+import importlib.util
+import io
+import json
+import os
+from unittest.mock import Mock
+
+import librosa
+import numpy as np
+import pytest
+
+from common.jobs import SQLiteJobStore
+from common.live import DEFAULT_PCM_SAMPLE_RATE, LiveSessionStore
+from common.tracing import TraceAggregator, get_current_trace
+from common.workers import WorkerPoolBusyError
+
+
+@pytest.fixture(scope='module')
+def sut(tmp_path_factory):
+    # The Flask app directory shadows the flask package, so the module is loaded from its path.
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        upload_folder = str(tmp_path_factory.mktemp('upload'))
+        monkeypatch.setitem(os.environ, 'FLASK_UPLOAD_FOLDER', upload_folder)
+        monkeypatch.setitem(os.environ, 'DECHORDER_PREDICTION_SERVICE', 'DummyPredictionService')
+        spec = importlib.util.spec_from_file_location('api', os.path.join('flask', 'api.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def client(sut):
+    sut.app.config['TESTING'] = True
+    return sut.app.test_client()
+
+
+@pytest.fixture
+def audio_content(saved_audio_file):
+    with open(saved_audio_file, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def pcm_content(saved_audio_file):
+    signal, _ = librosa.load(saved_audio_file, sr=DEFAULT_PCM_SAMPLE_RATE, mono=True)
+    return (np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def upload(*contents, filename='d-e-jazz.mp3'):
+    return {'audio-file': [(io.BytesIO(content), filename) for content in contents]}
+
+
+def test_api_recognize_batch(sut, client, audio_content, monkeypatch):
+    # Featurizing in threads keeps the test independent of the worker process start method.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        monkeypatch.setattr(sut, 'batch_executor', executor)
+        response = client.post(
+            '/api/recognize/batch',
+            data=upload(audio_content, b'not audio'),
+            content_type='multipart/form-data',
+        )
+
+    assert response.status_code == 200
+    file_results = response.get_json()
+    assert [file_result['filename'] for file_result in file_results] == ['d-e-jazz.mp3'] * 2
+    assert len(file_results[0]['chords']) == 6
+    assert 'error' in file_results[1]
+
+
+def test_api_recognize_batch_without_files(client):
+    response = client.post('/api/recognize/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert 'audio-file' in response.get_json()['message']
+
+
+def test_api_recognize_rejected_when_worker_pool_busy(sut, client, audio_content, monkeypatch):
+    worker_pool = Mock()
+    worker_pool.recognize.side_effect = WorkerPoolBusyError('Recognition queue is full')
+    worker_pool.get_stats.return_value = {'workers': 1, 'queueDepth': 2, 'queueCapacity': 2}
+    monkeypatch.setattr(sut, 'worker_pool', worker_pool)
+    response = client.post('/api/recognize', data=upload(audio_content),
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(sut.app.config['RETRY_AFTER_SECONDS'])
+    assert response.get_json()['message'] == 'Recognition queue is full'
+
+
+def test_api_worker_stats(sut, client, monkeypatch):
+    assert client.get('/api/stats/workers').status_code == 404
+
+    worker_pool = Mock()
+    worker_pool.get_stats.return_value = {'workers': 1, 'queueDepth': 0, 'queueCapacity': 2}
+    monkeypatch.setattr(sut, 'worker_pool', worker_pool)
+    response = client.get('/api/stats/workers')
+    assert response.status_code == 200
+    assert response.get_json() == {'workers': 1, 'queueDepth': 0, 'queueCapacity': 2}
+
+
+def test_api_async_job(sut, client, audio_content, tmp_path, monkeypatch):
+    assert client.post('/api/jobs').status_code == 404
+
+    job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(sut, 'job_store', SQLiteJobStore(str(tmp_path / 'jobs')))
+    monkeypatch.setattr(sut, 'job_executor', job_executor)
+    response = client.post('/api/jobs?alternatives=2', data=upload(audio_content),
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['jobId']
+    assert response.headers['Location'] == f'/api/jobs/{job_id}'
+
+    job_executor.shutdown(wait=True)
+    response = client.get(f'/api/jobs/{job_id}')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'succeeded'
+    assert len(body['chords']) == 6
+    assert all('alternatives' in chord for chord in body['chords'])
+
+    assert client.get('/api/jobs/i-do-not-exist').status_code == 404
+
+
+def test_api_live_session(sut, client, pcm_content, monkeypatch):
+    assert client.post('/api/live').status_code == 404
+    assert client.get('/api/stats/live').status_code == 404
+
+    monkeypatch.setattr(sut, 'live_store', LiveSessionStore(max_sessions=1))
+    response = client.post(f'/api/live?sampleRate={DEFAULT_PCM_SAMPLE_RATE}')
+    assert response.status_code == 201
+    session_id = response.get_json()['sessionId']
+    assert response.headers['Location'] == f'/api/live/{session_id}'
+
+    response = client.post('/api/live')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(sut.app.config['RETRY_AFTER_SECONDS'])
+    assert client.get('/api/stats/live').get_json()['sessions'] == 1
+
+    chords = []
+    block_size = len(pcm_content) // 4 + 1
+    for start in range(0, len(pcm_content), block_size):
+        response = client.post(f'/api/live/{session_id}/audio',
+                               data=pcm_content[start:start + block_size])
+        assert response.status_code == 200
+        chords += response.get_json()['chords']
+
+    response = client.delete(f'/api/live/{session_id}')
+    assert response.status_code == 200
+    chords += response.get_json()['chords']
+    assert chords
+    assert [chord['timeOffset'] for chord in chords] == sorted(
+        chord['timeOffset'] for chord in chords
+    )
+
+    assert client.delete(f'/api/live/{session_id}').status_code == 404
+    assert client.post(f'/api/live/{session_id}/audio', data=b'\0\0').status_code == 404
+    assert client.get('/api/stats/live').get_json()['sessions'] == 0
+
+
+def test_api_recognize_ndjson(client, audio_content):
+    response = client.post('/api/recognize?stream=1', data=upload(audio_content),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    chords = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert chords
+    assert all(chord.keys() == {'name', 'confidence', 'timeOffset'} for chord in chords)
+    time_offsets = [chord['timeOffset'] for chord in chords]
+    assert time_offsets == sorted(set(time_offsets))
+
+
+def test_api_recognize_ndjson_invalid_audio(client):
+    response = client.post('/api/recognize?stream=1', data=upload(b'not audio'),
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['message'].startswith('Cannot load audio file')
+
+
+def test_api_server_timing(sut, client, audio_content, monkeypatch):
+    assert client.get('/api/stats/tracing').status_code == 404
+    response = client.post('/api/recognize', data=upload(audio_content),
+                           content_type='multipart/form-data')
+    assert 'Server-Timing' not in response.headers
+
+    monkeypatch.setattr(sut, 'trace_aggregator', TraceAggregator())
+    response = client.post('/api/recognize', data=upload(audio_content),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    server_timing = dict(
+        metric.split(';dur=') for metric in response.headers['Server-Timing'].split(', ')
+    )
+    expected_stages = {'upload', 'decode', 'stft', 'predict', 'postprocess', 'serialize', 'total'}
+    assert expected_stages <= set(server_timing)
+    assert get_current_trace() is None
+
+    # Untraced endpoints are not timed.
+    response = client.get('/api/stats/tracing')
+    assert 'Server-Timing' not in response.headers
+    stats = response.get_json()
+    assert list(stats) == ['recognize_file']
+    assert stats['recognize_file']['requests'] == 1
+    assert expected_stages - {'total'} <= set(stats['recognize_file']['stages'])
@@ -6,6 +6,8 @@ from unittest.mock import Mock, patch
 import pytest
 
 import aws_lambda.lambda_function as sut
+from common.jobs import SQLiteJobStore
+from common.tracing import TraceAggregator, get_current_trace
 from common.utilities import KnownRequestParseError
 
 
@@ -44,6 +46,29 @@ def test_lambda_valid_input(valid_lambda_event, request_context, configured_dumm
     ])
 
 
+def test_lambda_alternatives(valid_lambda_event, request_context, configured_dummy_service,
+                             monkeypatch):
+    # A separate service, so that the random predictions of the shared one stay the same
+    # for other tests.
+    monkeypatch.setattr(sut, 'prediction_service', None)
+    event = dict(valid_lambda_event, queryStringParameters={'alternatives': '1'})
+    response = sut.lambda_handler(event, request_context)
+    assert response['statusCode'] == 200
+    assert all(len(chord['alternatives']) == 1 for chord in json.loads(response['body']))
+
+    event = dict(valid_lambda_event, queryStringParameters={'alternatives': '100'})
+    response = sut.lambda_handler(event, request_context)
+    assert response['statusCode'] == 400
+
+
+def test_lambda_unknown_analysis_profile(valid_lambda_event, request_context,
+                                         configured_dummy_service):
+    event = dict(valid_lambda_event, queryStringParameters={'profile': 'turbo'})
+    response = sut.lambda_handler(event, request_context)
+    assert response['statusCode'] == 400
+    assert 'Unknown analysis profile: turbo' in json.loads(response['body'])['message']
+
+
 def test_lambda_user_error(valid_lambda_event, request_context, configured_dummy_service):
     recognize_func = 'aws_lambda.lambda_function.recognize_saved_file'
     exception = KnownRequestParseError('Boo!')
@@ -64,3 +89,105 @@ def test_lambda_server_error(valid_lambda_event, request_context, configured_dum
     assert response['statusCode'] == 500
     assert response['headers']['Content-Type'] == 'application/json'
     assert json.loads(response['body']) == {'message': 'I am an internal error'}
+
+
+@pytest.fixture
+def lambda_job_store(tmp_path, monkeypatch):
+    job_store = SQLiteJobStore(str(tmp_path / 'jobs'))
+    monkeypatch.setattr(sut, 'job_store', job_store)
+    return job_store
+
+
+def test_lambda_async_job(valid_lambda_event, request_context, configured_dummy_service,
+                          lambda_job_store):
+    create_event = dict(
+        valid_lambda_event,
+        resource='/api/jobs',
+        httpMethod='POST',
+        queryStringParameters={'alternatives': '2', 'profile': 'fast'},
+    )
+    with patch('aws_lambda.lambda_function.dispatch_job') as dispatch_job:
+        response = sut.lambda_handler(create_event, request_context)
+    assert response['statusCode'] == 202
+    job_id = json.loads(response['body'])['jobId']
+    dispatch_job.assert_called_once_with(job_id, request_context, 2, 'fast')
+
+    get_event = {
+        'resource': '/api/jobs/{jobId}',
+        'httpMethod': 'GET',
+        'pathParameters': {'jobId': job_id},
+    }
+    response = sut.lambda_handler(get_event, request_context)
+    assert json.loads(response['body'])['status'] == 'pending'
+
+    run_event = {
+        'dechorderJobId': job_id,
+        'dechorderAlternatives': 2,
+        'dechorderAnalysisProfile': 'fast',
+    }
+    sut.lambda_handler(run_event, request_context)
+    response = sut.lambda_handler(get_event, request_context)
+    body = json.loads(response['body'])
+    assert body['status'] == 'succeeded'
+    assert len(body['chords']) == 6
+    assert all('alternatives' in chord for chord in body['chords'])
+
+
+def test_lambda_async_job_not_found(request_context, lambda_job_store):
+    event = {
+        'resource': '/api/jobs/{jobId}',
+        'httpMethod': 'GET',
+        'pathParameters': {'jobId': 'i-do-not-exist'},
+    }
+    response = sut.lambda_handler(event, request_context)
+    assert response['statusCode'] == 404
+
+
+def test_lambda_run_job_without_job_store(request_context, monkeypatch):
+    monkeypatch.setattr(sut, 'job_store', None)
+    response = sut.lambda_handler({'dechorderJobId': 'job-id'}, request_context)
+    assert response == {'jobId': 'job-id', 'error': 'Asynchronous jobs are disabled'}
+
+
+def test_lambda_reuses_prediction_service(valid_lambda_event, request_context,
+                                          configured_dummy_service, monkeypatch):
+    monkeypatch.setattr(sut, 'prediction_service', None)
+    factory_func = 'aws_lambda.lambda_function.get_prediction_service'
+    with patch(factory_func, wraps=sut.get_prediction_service) as factory:
+        for _ in range(3):
+            response = sut.lambda_handler(valid_lambda_event, request_context)
+            assert response['statusCode'] == 200
+    factory.assert_called_once_with('DummyPredictionService')
+
+
+def test_lambda_initialize_container_with_warmup(configured_dummy_service, monkeypatch):
+    monkeypatch.setattr(sut, 'prediction_service', None)
+    monkeypatch.setitem(os.environ, 'DECHORDER_PRELOAD_MODEL', '1')
+    monkeypatch.setitem(os.environ, 'DECHORDER_WARMUP', '1')
+    with patch('aws_lambda.lambda_function.run_warmup', wraps=sut.run_warmup) as run_warmup:
+        sut.initialize_container()
+
+    assert sut.prediction_service.__class__.__name__ == 'DummyPredictionService'
+    run_warmup.assert_called_once_with(sut.prediction_service)
+    assert sut.init_seconds > 0
+
+
+def test_lambda_logs_trace(valid_lambda_event, request_context, configured_dummy_service,
+                           monkeypatch):
+    monkeypatch.setattr(sut, 'trace_aggregator', TraceAggregator())
+    request_context.aws_request_id = 'c6af9ac6-7b61-11e6-9a41-93e812345678'
+    with patch.object(sut.logger, 'info') as log_info:
+        response = sut.lambda_handler(valid_lambda_event, request_context)
+    assert response['statusCode'] == 200
+
+    trace_lines = [
+        call.args[0] for call in log_info.call_args_list if call.args[0].startswith('Trace: ')
+    ]
+    assert len(trace_lines) == 1
+    log_fields = json.loads(trace_lines[0][len('Trace: '):])
+    assert log_fields['requestId'] == 'c6af9ac6-7b61-11e6-9a41-93e812345678'
+    expected_stages = {'upload', 'decode', 'stft', 'predict', 'postprocess', 'serialize'}
+    assert expected_stages <= set(log_fields['stagesMs'])
+    assert log_fields['totalMs'] >= sum(log_fields['stagesMs'].values())
+    assert log_fields['containerRequests'] == 1
+    assert get_current_trace() is None
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+import common.caching as sut
+from common.features import FrameFeatures
+from common.predictions.dummy import DummyPredictionService
+
+
+@pytest.fixture
+def result():
+    return [{'timeOffset': 0.0, 'name': 'C', 'confidence': 0.9}]
+
+
+def test_get_content_digest_file_and_bytes(saved_audio_file):
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    assert sut.get_content_digest(saved_audio_file) == sut.get_content_digest(content)
+    assert sut.get_content_digest(content) != sut.get_content_digest(content[:-1])
+
+
+def test_get_recognition_cache_key_depends_on_service_and_options(datarobot_v1_service):
+    dummy_service = DummyPredictionService()
+    key = sut.get_recognition_cache_key('abc', dummy_service, streaming=False)
+    assert key == sut.get_recognition_cache_key('abc', dummy_service, streaming=False)
+    assert key != sut.get_recognition_cache_key('abd', dummy_service, streaming=False)
+    assert key != sut.get_recognition_cache_key('abc', dummy_service, streaming=True)
+    assert key != sut.get_recognition_cache_key('abc', datarobot_v1_service, streaming=False)
+    assert key != sut.get_recognition_cache_key('abc', dummy_service, skip_silence=True,
+                                                streaming=False)
+
+
+def test_memory_cache_evicts_least_recently_used(result):
+    cache = sut.RecognitionResultCache(max_entries=2)
+    cache.put('a', result)
+    cache.put('b', result)
+    assert cache.get('a') == result
+    cache.put('c', result)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == result
+    assert cache.get('c') == result
+    assert cache.get_stats() == {
+        'hits': 3,
+        'misses': 1,
+        'diskHits': 0,
+        'coalesced': 0,
+        'memoryEntries': 2,
+    }
+
+
+def test_memory_cache_returns_copies(result):
+    cache = sut.RecognitionResultCache()
+    cache.put('a', result)
+    cache.get('a')[0]['name'] = 'D'
+    assert cache.get('a') == result
+
+
+def test_disk_cache_survives_restart_and_evicts_by_size(tmp_path, result):
+    cache = sut.RecognitionResultCache(max_entries=0, disk_dir=str(tmp_path))
+    cache.put('a', result)
+
+    restarted_cache = sut.RecognitionResultCache(max_entries=10, disk_dir=str(tmp_path))
+    assert restarted_cache.get('a') == result
+    assert restarted_cache.get_stats()['diskHits'] == 1
+
+    entry_size = os.path.getsize(tmp_path / 'a.json')
+    small_cache = sut.RecognitionResultCache(disk_dir=str(tmp_path), max_disk_bytes=entry_size * 2)
+    os.utime(tmp_path / 'a.json', (0, 0))
+    small_cache.put('b', result)
+    small_cache.put('c', result)
+    assert sorted(os.listdir(tmp_path)) == ['b.json', 'c.json']
+
+
+def test_get_or_compute_coalesces_concurrent_calls(result):
+    cache = sut.RecognitionResultCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return result
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compute('a', compute)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [result] * 4
+    assert cache.get_stats()['coalesced'] == 3
+
+
+def test_get_or_compute_propagates_errors():
+    cache = sut.RecognitionResultCache()
+
+    def compute():
+        raise ValueError('Boo!')
+
+    with pytest.raises(ValueError, match='Boo!'):
+        cache.get_or_compute('a', compute)
+    assert cache.get('a') is None
+
+
+def test_get_result_cache_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('DECHORDER_RESULT_CACHE_ENTRIES', raising=False)
+    monkeypatch.delenv('DECHORDER_RESULT_CACHE_DIR', raising=False)
+    assert sut.get_result_cache() is None
+
+    monkeypatch.setenv('DECHORDER_RESULT_CACHE_ENTRIES', '8')
+    assert sut.get_result_cache().max_entries == 8
+
+
+def test_frame_cache_skips_featurization_on_hit(tmp_path, saved_audio_file):
+    frame_cache = sut.FrameFeatureCache(str(tmp_path))
+    frames = frame_cache.get_or_compute(saved_audio_file)
+    assert frame_cache.get_stats() == {'hits': 0, 'misses': 1}
+
+    with patch('common.caching.compute_frame_features', side_effect=AssertionError):
+        cached_frames = frame_cache.get_or_compute(saved_audio_file)
+    assert frame_cache.get_stats() == {'hits': 1, 'misses': 1}
+
+    assert cached_frames.rms.dtype == np.float32
+    assert cached_frames.frames_per_second == frames.frames_per_second
+    assert np.allclose(cached_frames.chroma, frames.chroma, atol=1e-6)
+    assert np.array_equal(cached_frames.aggregate().is_silent, frames.aggregate().is_silent)
+
+
+def test_frame_cache_evicts_by_size(tmp_path):
+    frames = FrameFeatures(np.zeros(1000), np.zeros((12, 1000)), 43.0)
+    frame_cache = sut.FrameFeatureCache(str(tmp_path), max_bytes=80000)
+    for digest in ['a', 'b', 'c']:
+        frame_cache.put(digest, frames)
+        time.sleep(0.01)
+    assert len(os.listdir(tmp_path)) == 1
+    assert frame_cache.get('c') is not None
+
+
+def test_frame_cache_keyed_by_skip_silence(tmp_path):
+    frames = FrameFeatures(np.zeros(1000), np.zeros((12, 1000)), 43.0)
+    frame_cache = sut.FrameFeatureCache(str(tmp_path))
+    frame_cache.put('a', frames, skip_silence=True)
+    assert frame_cache.get('a') is None
+    assert frame_cache.get('a', skip_silence=True) is not None
+
+
+def test_warm_frame_cache(tmp_path, saved_audio_file):
+    frame_cache = sut.FrameFeatureCache(str(tmp_path / 'cache'))
+    sut.warm_frame_cache(os.path.dirname(saved_audio_file), frame_cache)
+    content_digest = sut.get_content_digest(saved_audio_file)
+    assert frame_cache.get(content_digest, skip_silence=True) is not None
@@ -1,4 +1,10 @@
+import io
+import os
+import shutil
+from unittest.mock import patch
+
 import numpy as np
+import pandas as pd
 import pytest
 
 import common.features as sut
@@ -56,3 +62,373 @@ def test_featurize_file_non_audio(saved_non_audio_file):
     msg = 'Cannot load audio file. Error: NoBackendError'
     with pytest.raises(KnownRequestParseError, match=msg):
         sut.featurize_file(saved_non_audio_file)
+
+
+@pytest.mark.parametrize('block_seconds', [30.0, 1.0])
+def test_featurize_file_streaming_matches_featurize_file(saved_audio_file, block_seconds):
+    df_expected = sut.featurize_file(saved_audio_file)
+    df_actual = sut.featurize_file_streaming(saved_audio_file, block_seconds=block_seconds)
+    assert df_actual.shape == df_expected.shape
+    assert np.array_equal(df_actual['time_offset'], df_expected['time_offset'])
+    assert np.array_equal(df_actual['is_silent'], df_expected['is_silent'])
+    assert np.allclose(df_actual[sut.FEATURE_NAMES], df_expected[sut.FEATURE_NAMES], atol=0.05)
+
+
+def test_streaming_featurizer_is_block_size_invariant():
+    rng = np.random.RandomState(42)
+    signal = rng.uniform(-1, 1, size=sut.SUPPORTED_SAMPLE_RATE * 5).astype(np.float32)
+
+    whole = sut.StreamingFeaturizer()
+    whole.tuning = 0.0
+    expected = whole.push(signal) + whole.finish()
+
+    blocked = sut.StreamingFeaturizer()
+    blocked.tuning = 0.0
+    actual = []
+    for start in range(0, len(signal), 1000):
+        actual.extend(blocked.push(signal[start:start + 1000]))
+    actual.extend(blocked.finish())
+
+    assert len(actual) == len(expected) == 5
+    for expected_chunk, actual_chunk in zip(expected, actual):
+        expected_time, expected_chroma, expected_rms = expected_chunk
+        time, chroma, rms = actual_chunk
+        assert time == expected_time
+        assert np.allclose(chroma, expected_chroma, atol=1e-5)
+        assert np.isclose(rms, expected_rms, atol=1e-6)
+
+
+def test_rms_histogram_percentile():
+    rng = np.random.RandomState(42)
+    rms = np.concatenate([np.zeros(100), 10 ** rng.uniform(-6, 0, size=10000)]).astype(np.float32)
+    histogram = sut.RMSHistogram()
+    for start in range(0, len(rms), 1000):
+        histogram.add(rms[start:start + 1000])
+
+    assert len(histogram) == len(rms)
+    for q in [0.5, 25, 50, 95]:
+        assert histogram.percentile(q) == pytest.approx(np.percentile(rms, q), rel=0.025)
+    assert sut.RMSHistogram().percentile(25) == 0.0
+
+
+def test_streaming_featurizer_live_threshold_is_bounded():
+    rng = np.random.RandomState(42)
+    signal = rng.uniform(-1, 1, size=sut.SUPPORTED_SAMPLE_RATE * 5).astype(np.float32)
+    featurizer = sut.StreamingFeaturizer(live=True)
+    for start in range(0, len(signal), 2205):
+        featurizer.push(signal[start:start + 2205])
+
+    exact = sut.StreamingFeaturizer(keep_frames=True)
+    exact.push(signal)
+    assert not featurizer._rms_history
+    expected_threshold = exact.get_adaptive_rms_threshold()
+    assert featurizer.get_adaptive_rms_threshold() == pytest.approx(expected_threshold, rel=0.025)
+
+
+def test_streaming_featurizer_keep_rms_threshold_is_exact():
+    rng = np.random.RandomState(42)
+    signal = rng.uniform(-1, 1, size=sut.SUPPORTED_SAMPLE_RATE * 5).astype(np.float32)
+    featurizer = sut.StreamingFeaturizer(keep_rms=True)
+    for start in range(0, len(signal), 2205):
+        featurizer.push(signal[start:start + 2205])
+
+    exact = sut.StreamingFeaturizer(keep_frames=True)
+    exact.push(signal)
+    assert not featurizer._chroma_history
+    assert featurizer.get_adaptive_rms_threshold() == exact.get_adaptive_rms_threshold()
+
+
+def test_featurize_file_streaming_nonexistent(nonexistent_audio_file):
+    msg = 'Cannot load audio file. Error: .* No such file or directory'
+    with pytest.raises(KnownRequestParseError, match=msg):
+        sut.featurize_file_streaming(nonexistent_audio_file)
+
+
+def test_aggregate_chunks_matches_per_chunk_featurization():
+    rng = np.random.RandomState(42)
+    rms = rng.uniform(0, 1, size=100)
+    chroma = rng.uniform(0, 1, size=(12, 100))
+    chunk_starts = sut.get_chunk_starts(100, 21.5)
+    assert np.array_equal(chunk_starts, [0, 22, 43, 64])
+
+    block = sut.aggregate_chunks(rms, chroma, chunk_starts)
+    threshold = np.percentile(rms, sut.ADAPTIVE_SILENCE_RMS_PERCENTILE)
+    rms_chunks = np.split(rms, chunk_starts[1:])
+    chroma_chunks = np.split(chroma, chunk_starts[1:], axis=1)
+
+    assert block.features.dtype == np.float32
+    assert block.shape == (4, 12)
+    assert np.array_equal(block.time_offsets, [0.0, 1.0, 2.0, 3.0])
+    assert np.allclose(block.features, [sut.featurize_chroma_chunk(c) for c in chroma_chunks])
+    assert np.array_equal(block.is_silent, [sut.is_chunk_silent(c, threshold) for c in rms_chunks])
+
+
+def test_feature_block_non_silent_and_data_frame():
+    block = sut.FeatureBlock(
+        features=np.eye(3, 12, dtype=np.float32),
+        time_offsets=np.array([0.0, 1.0, 2.0]),
+        is_silent=np.array([False, True, False]),
+    )
+    non_silent = block.get_non_silent()
+    assert len(non_silent) == 2
+    assert np.array_equal(non_silent.time_offsets, [0.0, 2.0])
+
+    df = block.to_data_frame()
+    assert list(df.columns) == sut.FEATURE_NAMES + ['time_offset', 'is_silent']
+    assert df.shape == (3, 14)
+
+
+def test_featurize_in_memory_content(saved_audio_file):
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    expected = sut.featurize_file(saved_audio_file)
+    pd.testing.assert_frame_equal(sut.featurize_file(content), expected)
+    pd.testing.assert_frame_equal(sut.featurize_file(io.BytesIO(content)), expected)
+
+
+def test_featurize_in_memory_content_streaming(saved_audio_file):
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    expected = sut.featurize_file_streaming(saved_audio_file)
+    pd.testing.assert_frame_equal(sut.featurize_file_streaming(content), expected)
+
+
+def test_load_audio_spools_unsupported_formats(saved_audio_file):
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    expected_signal, _ = sut.load_audio(saved_audio_file)
+
+    # Simulate a format the in-memory decoder cannot read.
+    original_load = sut.librosa.load
+
+    def load_from_path_only(source, **kwargs):
+        if not isinstance(source, str):
+            raise RuntimeError('Format not recognised')
+        return original_load(source, **kwargs)
+
+    with patch.object(sut.librosa, 'load', side_effect=load_from_path_only):
+        signal, sample_rate = sut.load_audio(content)
+    assert sample_rate == sut.SUPPORTED_SAMPLE_RATE
+    np.testing.assert_array_equal(signal, expected_signal)
+
+
+def test_load_audio_invalid_content():
+    with pytest.raises(KnownRequestParseError, match='Cannot load audio file'):
+        sut.load_audio(b'definitely not audio')
+
+
+@pytest.fixture
+def ffmpeg_decoder():
+    ffmpeg_path = shutil.which(os.environ.get('DECHORDER_FFMPEG_PATH') or 'ffmpeg')
+    if not ffmpeg_path:
+        pytest.skip('ffmpeg is not available')
+    return sut.FFmpegAudioDecoder(ffmpeg_path)
+
+
+def test_get_audio_decoder_falls_back_to_librosa(monkeypatch):
+    monkeypatch.setenv('DECHORDER_AUDIO_DECODER', 'ffmpeg')
+    monkeypatch.setenv('DECHORDER_FFMPEG_PATH', os.path.join('tests', 'testdata', 'i-do-not-exist'))
+    sut.get_audio_decoder.cache_clear()
+    try:
+        assert isinstance(sut.get_audio_decoder(), sut.LibrosaAudioDecoder)
+    finally:
+        sut.get_audio_decoder.cache_clear()
+
+    with pytest.raises(ValueError):
+        sut.get_audio_decoder('gstreamer')
+
+
+def test_ffmpeg_decoder_matches_librosa_decoder(saved_audio_file, ffmpeg_decoder):
+    expected_signal, _ = sut.load_audio(saved_audio_file, decoder=sut.LibrosaAudioDecoder())
+    signal, sample_rate = sut.load_audio(saved_audio_file, decoder=ffmpeg_decoder)
+    assert sample_rate == sut.SUPPORTED_SAMPLE_RATE
+    assert signal.dtype == np.float32
+
+    # The decoders resample differently and handle the MP3 encoder delay differently,
+    # so the signals differ slightly, but the chord features match.
+    assert abs(len(signal) - len(expected_signal)) < 0.05 * sample_rate
+    with patch.object(sut, 'get_audio_decoder', return_value=ffmpeg_decoder):
+        features = sut.featurize_file_block(saved_audio_file)
+    expected_features = sut.featurize_file_block(saved_audio_file)
+    assert np.array_equal(features.is_silent, expected_features.is_silent)
+    assert np.allclose(features.features, expected_features.features, atol=0.05)
+
+    # A piped MP3 cannot be seeked to read the gapless playback info, so it is a few samples longer.
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    piped_signal, _ = sut.load_audio(content, decoder=ffmpeg_decoder)
+    assert abs(len(piped_signal) - len(signal)) < 0.05 * sample_rate
+    with patch.object(sut, 'get_audio_decoder', return_value=ffmpeg_decoder):
+        piped_features = sut.featurize_file_block(content)
+    assert np.allclose(piped_features.features, features.features, atol=0.05)
+
+
+def test_ffmpeg_decoder_streaming_matches_whole_file(saved_audio_file, ffmpeg_decoder):
+    signal, _ = sut.load_audio(saved_audio_file, decoder=ffmpeg_decoder)
+    profile = sut.get_analysis_profile()
+    blocks = list(ffmpeg_decoder.iter_blocks(saved_audio_file, profile, block_seconds=1))
+    assert len(blocks) > 1
+    np.testing.assert_array_equal(np.concatenate(blocks), signal)
+
+
+def test_ffmpeg_decoder_downmixes_like_librosa(tmp_path, ffmpeg_decoder):
+    import soundfile
+    time = np.arange(2 * 44100) / 44100
+    left = 0.5 * np.sin(2 * np.pi * 440 * time)
+    path = str(tmp_path / 'stereo.wav')
+    soundfile.write(path, np.stack([left, np.zeros_like(left)], axis=1), 44100)
+
+    expected_signal, _ = sut.load_audio(path, decoder=sut.LibrosaAudioDecoder())
+    signal, _ = sut.load_audio(path, decoder=ffmpeg_decoder)
+    expected_rms = np.sqrt(np.mean(expected_signal ** 2))
+    assert np.isclose(np.sqrt(np.mean(signal ** 2)), expected_rms, rtol=0.01)
+
+
+def test_ffmpeg_decoder_invalid_content(ffmpeg_decoder):
+    with pytest.raises(KnownRequestParseError, match='Cannot load audio file'):
+        sut.load_audio(b'definitely not audio', decoder=ffmpeg_decoder)
+
+
+def test_compute_frame_rms_matches_spectrogram_rms(saved_audio_file):
+    signal, _ = sut.load_audio(saved_audio_file)
+    expected = sut.librosa.feature.rms(S=np.abs(sut.librosa.stft(signal))).ravel()
+
+    padded_signal = np.pad(signal, sut.STFT_N_FFT // 2, mode=sut.STFT_PAD_MODE)
+    actual = sut.compute_frame_rms(padded_signal)
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected, rtol=1e-4, atol=1e-7)
+
+
+def test_compute_frame_features_skipping_silence(saved_audio_file):
+    signal, sample_rate = sut.load_audio(saved_audio_file)
+    lead_in = np.zeros(3 * sample_rate, dtype=signal.dtype)
+    signal = np.concatenate([lead_in, signal, lead_in])
+    with patch.object(sut, 'load_audio', return_value=(signal, sample_rate)):
+        expected = sut.featurize_file_block('recording.wav')
+        actual = sut.featurize_file_block('recording.wav', skip_silence=True)
+
+    assert np.array_equal(actual.time_offsets, expected.time_offsets)
+    assert np.array_equal(actual.is_silent, expected.is_silent)
+    assert np.all(actual.features[actual.is_silent] == 0)
+
+    # Chroma tuning is estimated from the non-silent frames only, so the features differ slightly.
+    non_silent = ~expected.is_silent
+    assert np.allclose(actual.features[non_silent], expected.features[non_silent], atol=0.05)
+
+
+@pytest.mark.parametrize('batch_seconds', [1, 3, 1000])
+def test_iter_feature_blocks_matches_featurize_file_block(saved_audio_file, batch_seconds):
+    signal, sample_rate = sut.load_audio(saved_audio_file)
+    lead_in = np.zeros(3 * sample_rate, dtype=signal.dtype)
+    signal = np.concatenate([lead_in, signal])
+    with patch.object(sut, 'load_audio', return_value=(signal, sample_rate)):
+        expected = sut.featurize_file_block('recording.wav', skip_silence=True)
+        blocks = list(sut.iter_feature_blocks('recording.wav', batch_seconds))
+
+    assert len(blocks) == int(np.ceil(len(expected) / batch_seconds))
+    time_offsets = np.concatenate([block.time_offsets for block in blocks])
+    assert np.array_equal(time_offsets, expected.time_offsets)
+    assert np.array_equal(np.concatenate([block.is_silent for block in blocks]), expected.is_silent)
+
+    # Chroma tuning is estimated from the first batch with non-silent chunks,
+    # so the features differ slightly.
+    features = np.concatenate([block.features for block in blocks])
+    assert np.allclose(features, expected.features, atol=0.05)
+
+
+def test_get_analysis_profile(monkeypatch):
+    monkeypatch.delenv('DECHORDER_ANALYSIS_PROFILE', raising=False)
+    assert sut.get_analysis_profile() is sut.ANALYSIS_PROFILES[sut.DEFAULT_ANALYSIS_PROFILE]
+
+    monkeypatch.setenv('DECHORDER_ANALYSIS_PROFILE', 'fast')
+    assert sut.get_analysis_profile().name == 'fast'
+    assert sut.get_analysis_profile('accurate').name == 'accurate'
+
+    with pytest.raises(ValueError, match='Unknown analysis profile: turbo'):
+        sut.get_analysis_profile('turbo')
+
+
+def test_analysis_profile_round_trip():
+    profile = sut.ANALYSIS_PROFILES['fast']
+    restored = sut.AnalysisProfile.from_dict(profile.to_dict())
+    assert restored == profile
+    assert restored.name == profile.name
+    assert restored != sut.ANALYSIS_PROFILES['balanced']
+
+    with pytest.raises(ValueError):
+        sut.AnalysisProfile('odd', 22050, 2048, 500, 'soxr_hq')
+
+
+@pytest.mark.parametrize('profile_name', ['fast', 'accurate'])
+def test_featurize_file_with_analysis_profile(saved_audio_file, profile_name):
+    profile = sut.ANALYSIS_PROFILES[profile_name]
+    df_expected = sut.featurize_file(saved_audio_file, profile=sut.ANALYSIS_PROFILES['balanced'])
+    df_actual = sut.featurize_file(saved_audio_file, profile=profile)
+    assert df_actual.shape == df_expected.shape
+    assert np.array_equal(df_actual['time_offset'], df_expected['time_offset'])
+
+    assert np.array_equal(df_actual['is_silent'], df_expected['is_silent'])
+
+    # The chroma of each non-silent chunk peaks on the same pitch class at any resolution.
+    is_voiced = ~df_expected['is_silent'].to_numpy()
+    expected_peaks = df_expected.loc[is_voiced, sut.FEATURE_NAMES].to_numpy().argmax(axis=1)
+    actual_peaks = df_actual.loc[is_voiced, sut.FEATURE_NAMES].to_numpy().argmax(axis=1)
+    assert np.array_equal(actual_peaks, expected_peaks)
+
+    df_streaming = sut.featurize_file_streaming(saved_audio_file, block_seconds=1.0,
+                                                profile=profile)
+    assert np.array_equal(df_streaming['time_offset'], df_actual['time_offset'])
+    assert np.allclose(df_streaming[sut.FEATURE_NAMES], df_actual[sut.FEATURE_NAMES], atol=0.05)
+
+
+def test_featurization_engine_matches_librosa(saved_audio_file):
+    signal, sample_rate = sut.load_audio(saved_audio_file)
+    engine = sut.get_featurization_engine(sut.get_analysis_profile())
+    assert sut.get_featurization_engine(sut.get_analysis_profile()) is engine
+
+    expected_spectrogram = np.abs(sut.librosa.stft(signal))
+    spectrogram = engine.compute_spectrogram(signal)
+    assert np.allclose(spectrogram, expected_spectrogram, atol=1e-6)
+
+    expected_chroma = sut.librosa.feature.chroma_stft(S=expected_spectrogram, sr=sample_rate)
+    assert np.allclose(engine.compute_chroma(spectrogram), expected_chroma, atol=1e-5)
+    expected_rms = sut.librosa.feature.rms(S=expected_spectrogram).ravel()
+    assert np.allclose(engine.compute_rms(spectrogram), expected_rms)
+
+
+def test_featurization_engine_caches_chroma_filterbanks():
+    engine = sut.FeaturizationEngine(sut.ANALYSIS_PROFILES['fast'])
+    filterbank = engine.get_chroma_filterbank(0.03)
+    assert filterbank.dtype == np.float32
+    assert filterbank.shape == (12, 513)
+    assert not filterbank.flags.writeable
+    assert engine.get_chroma_filterbank(0.03 + 1e-9) is filterbank
+    assert engine.get_chroma_filterbank(-0.1) is not filterbank
+
+
+@pytest.mark.parametrize('profile_name', ['fast', 'balanced'])
+def test_float32_featurization_engine_matches_default_engine(saved_audio_file, profile_name):
+    profile = sut.ANALYSIS_PROFILES[profile_name]
+    signal, _ = sut.load_audio(saved_audio_file, profile=profile)
+    engine = sut.FeaturizationEngine(profile)
+    float32_engine = sut.Float32FeaturizationEngine(profile)
+
+    for center in [True, False]:
+        expected_spectrogram = engine.compute_spectrogram(signal, center=center)
+        spectrogram = float32_engine.compute_spectrogram(signal, center=center)
+        assert spectrogram.dtype == np.float32
+        assert np.allclose(spectrogram, expected_spectrogram, atol=1e-4)
+
+    assert float32_engine.estimate_tuning(spectrogram) == engine.estimate_tuning(spectrogram)
+    assert np.allclose(float32_engine.compute_rms(spectrogram), engine.compute_rms(spectrogram))
+    expected_chroma = engine.compute_chroma(spectrogram)
+    assert np.allclose(float32_engine.compute_chroma(spectrogram), expected_chroma, atol=1e-6)
+
+
+def test_get_featurization_engine():
+    profile = sut.get_analysis_profile()
+    float32_engine = sut.get_featurization_engine(profile, 'float32')
+    assert isinstance(float32_engine, sut.Float32FeaturizationEngine)
+    assert sut.get_analysis_signature(profile)['featurization_engine'] in sut.FEATURIZATION_ENGINES
+    with pytest.raises(ValueError, match='Unknown featurization engine: float16'):
+        sut.get_featurization_engine(profile, 'float16')
@@ -0,0 +1,105 @@
+import os
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+import common.jobs as sut
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    return sut.SQLiteJobStore(str(tmp_path / 'jobs'))
+
+
+@pytest.fixture
+def uploaded_audio_file(tmp_path, saved_audio_file):
+    path = str(tmp_path / 'upload.mp3')
+    shutil.copy(saved_audio_file, path)
+    return path
+
+
+def test_create_and_get_job(job_store, uploaded_audio_file):
+    job = job_store.create_job('d-e-jazz.mp3', uploaded_audio_file)
+    assert not os.path.exists(uploaded_audio_file)
+    assert os.path.exists(job.upload_path)
+
+    stored_job = job_store.get_job(job.job_id)
+    assert stored_job.status == sut.JOB_STATUS_PENDING
+    assert stored_job.to_dict() == {
+        'jobId': job.job_id,
+        'status': 'pending',
+        'filename': 'd-e-jazz.mp3',
+    }
+    assert job_store.get_job('i-do-not-exist') is None
+
+
+def test_run_job_succeeds(job_store, uploaded_audio_file, dummy_service):
+    job = job_store.create_job('d-e-jazz.mp3', uploaded_audio_file)
+    sut.run_job(job_store, job.job_id, dummy_service)
+
+    finished_job = job_store.get_job(job.job_id)
+    assert finished_job.status == sut.JOB_STATUS_SUCCEEDED
+    assert len(finished_job.to_dict()['chords']) == 6
+    assert not os.path.exists(job.upload_path)
+
+
+def test_run_job_fails_on_invalid_audio(job_store, tmp_path, saved_non_audio_file, dummy_service):
+    path = str(tmp_path / 'upload.mp3')
+    shutil.copy(saved_non_audio_file, path)
+    job = job_store.create_job('not-audio.mp3', path)
+    sut.run_job(job_store, job.job_id, dummy_service)
+
+    finished_job = job_store.get_job(job.job_id)
+    assert finished_job.status == sut.JOB_STATUS_FAILED
+    assert finished_job.to_dict()['message'].startswith('Cannot load audio file')
+
+
+def test_job_store_closes_connections(job_store, uploaded_audio_file, monkeypatch):
+    connections = []
+    sqlite3_connect = sqlite3.connect
+
+    def connect(*args, **kwargs):
+        connections.append(sqlite3_connect(*args, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(sut.sqlite3, 'connect', connect)
+    job = job_store.create_job('d-e-jazz.mp3', uploaded_audio_file)
+    job_store.update_job(job.job_id, sut.JOB_STATUS_SUCCEEDED, result=[])
+    assert job_store.get_job(job.job_id).status == sut.JOB_STATUS_SUCCEEDED
+    job_store.purge_expired(ttl_seconds=3600)
+
+    assert len(connections) == 5
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError, match='closed'):
+            connection.execute('SELECT 1')
+
+
+def test_purge_expired(job_store, uploaded_audio_file, tmp_path, saved_audio_file):
+    finished_job = job_store.create_job('d-e-jazz.mp3', uploaded_audio_file)
+    job_store.update_job(finished_job.job_id, sut.JOB_STATUS_SUCCEEDED, result=[])
+
+    pending_path = str(tmp_path / 'pending.mp3')
+    shutil.copy(saved_audio_file, pending_path)
+    pending_job = job_store.create_job('d-e-jazz.mp3', pending_path)
+
+    time.sleep(0.05)
+    assert job_store.purge_expired(ttl_seconds=3600) == 0
+    assert job_store.purge_expired(ttl_seconds=0.01) == 1
+    assert job_store.get_job(finished_job.job_id) is None
+    assert job_store.get_job(pending_job.job_id) is not None
+
+
+def test_purge_expired_fails_timed_out_jobs(job_store, uploaded_audio_file):
+    pending_job = job_store.create_job('d-e-jazz.mp3', uploaded_audio_file)
+
+    time.sleep(0.05)
+    assert job_store.purge_expired(ttl_seconds=3600, timeout_seconds=3600) == 0
+    assert job_store.get_job(pending_job.job_id).status == sut.JOB_STATUS_PENDING
+    assert job_store.purge_expired(ttl_seconds=3600, timeout_seconds=0.01) == 0
+
+    timed_out_job = job_store.get_job(pending_job.job_id)
+    assert timed_out_job.status == sut.JOB_STATUS_FAILED
+    assert timed_out_job.finished_at is not None
+    assert not os.path.exists(uploaded_audio_file)
@@ -0,0 +1,211 @@
+import os
+import shutil
+import time
+from unittest.mock import patch
+
+import librosa
+import numpy as np
+import pandas as pd
+import pytest
+
+import common.live as sut
+from common.features import SECONDS_PER_CHUNK, get_analysis_profile, get_audio_decoder
+from common.recognition import recognize_saved_file
+from common.utilities import KnownRequestParseError
+
+
+@pytest.fixture
+def profile():
+    return get_analysis_profile('balanced')
+
+
+@pytest.fixture
+def pcm_content(saved_audio_file):
+    signal, _ = librosa.load(saved_audio_file, sr=sut.DEFAULT_PCM_SAMPLE_RATE, mono=True)
+    return (np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+@pytest.fixture
+def ffmpeg_path():
+    ffmpeg_path = shutil.which(os.environ.get('DECHORDER_FFMPEG_PATH') or 'ffmpeg')
+    if not ffmpeg_path:
+        pytest.skip('ffmpeg is not available')
+    return ffmpeg_path
+
+
+@pytest.fixture
+def clear_audio_decoder_cache():
+    # The decoder depends on DECHORDER_FFMPEG_PATH, which the tests change.
+    get_audio_decoder.cache_clear()
+    yield
+    get_audio_decoder.cache_clear()
+
+
+def replay(session, content, block_size):
+    chords = []
+    for start in range(0, len(content), block_size):
+        chords += session.push(content[start:start + block_size])
+    return chords
+
+
+def test_pcm_decoder_keeps_partial_samples(profile):
+    samples = (np.arange(-1000, 1000, dtype=np.int16) * 16).astype('<i2')
+    content = samples.tobytes()
+    expected = sut.PCMStreamDecoder('s16le', profile.sample_rate, 1, profile).decode(content)
+
+    decoder = sut.PCMStreamDecoder('s16le', profile.sample_rate, 1, profile)
+    signal = np.concatenate([
+        decoder.decode(content[start:start + 333]) for start in range(0, len(content), 333)
+    ])
+
+    assert signal.dtype == np.float32
+    np.testing.assert_array_equal(signal, expected)
+    np.testing.assert_allclose(expected, samples / 32768)
+
+
+def test_pcm_decoder_downmixes_and_resamples(profile):
+    left = np.sin(np.linspace(0, 200 * np.pi, 44100)).astype(np.float32)
+    stereo = np.stack([left, np.zeros_like(left)], axis=1).astype('<f4')
+    decoder = sut.PCMStreamDecoder('f32le', 44100, 2, profile)
+
+    signal = np.concatenate([decoder.decode(stereo.tobytes()), decoder.finish()])
+
+    assert abs(len(signal) - profile.sample_rate) <= 1
+    assert np.max(np.abs(signal)) == pytest.approx(0.5, abs=0.01)
+
+
+@pytest.mark.parametrize('input_format, sample_rate, channels', [
+    ('wav', None, None),
+    ('s16le', '0', None),
+    ('s16le', 'abc', None),
+    ('f32le', None, '9'),
+])
+def test_create_live_decoder_rejects_invalid_input(profile, input_format, sample_rate, channels):
+    with pytest.raises(KnownRequestParseError):
+        sut.create_live_decoder(input_format, profile, sample_rate, channels)
+
+
+def test_live_session_emits_chunks_as_they_complete(dummy_service, profile):
+    decoder = sut.PCMStreamDecoder('f32le', profile.sample_rate, 1, profile)
+    session = sut.LiveRecognitionSession('test', dummy_service, decoder, profile)
+    noise = np.random.RandomState(42).uniform(-0.5, 0.5, profile.sample_rate * 3).astype('<f4')
+    block_size = profile.sample_rate // 10
+
+    # The first chunk is emitted once the frames that cover it have been computed,
+    # not after the second one.
+    pushed_seconds = 0
+    while not session.chunk_count:
+        session.push(noise[int(pushed_seconds * profile.sample_rate):][:block_size].tobytes())
+        pushed_seconds += 0.1
+
+    assert pushed_seconds <= SECONDS_PER_CHUNK + 0.15
+
+
+def test_live_session_matches_offline_recognition(saved_audio_file, embedded_service, pcm_content):
+    store = sut.LiveSessionStore(max_sessions=1)
+    session = store.create_session(embedded_service, 's16le', sut.DEFAULT_PCM_SAMPLE_RATE, 1)
+
+    # 0.1 s blocks that split samples in half.
+    chords = replay(session, pcm_content, 8821)
+    chords += store.finish_session(session.session_id)
+
+    expected = recognize_saved_file(saved_audio_file, embedded_service)
+    assert [(chord['timeOffset'], chord['name']) for chord in chords] == [
+        (chord['timeOffset'], chord['name']) for chord in expected
+    ]
+    assert store.get_session(session.session_id) is None
+
+
+def test_live_session_removes_repeating_chords_across_pushes(dummy_service, profile):
+    decoder = sut.PCMStreamDecoder('f32le', profile.sample_rate, 1, profile)
+    session = sut.LiveRecognitionSession('test', dummy_service, decoder, profile)
+    chunks = [(float(i), np.full(12, 0.5, dtype=np.float32), 1.0) for i in range(2)]
+
+    def predict(features, top_k=0):
+        return pd.DataFrame({'name': ['C'] * len(features), 'confidence': [0.9] * len(features)})
+
+    with patch.object(dummy_service, 'predict', side_effect=predict):
+        assert [chord['name'] for chord in session._recognize_chunks(chunks[:1])] == ['C']
+        assert session._recognize_chunks(chunks[1:]) == []
+
+
+def test_live_session_store_limits_sessions(dummy_service):
+    store = sut.LiveSessionStore(max_sessions=1)
+    session = store.create_session(dummy_service, 's16le')
+
+    with pytest.raises(sut.LiveSessionLimitError):
+        store.create_session(dummy_service, 's16le')
+
+    assert store.finish_session(session.session_id) == []
+    assert store.finish_session(session.session_id) is None
+    store.create_session(dummy_service, 's16le')
+
+
+def test_live_session_store_closes_idle_sessions(dummy_service):
+    store = sut.LiveSessionStore(max_sessions=2, idle_timeout_seconds=60)
+    idle_session = store.create_session(dummy_service, 's16le')
+    active_session = store.create_session(dummy_service, 's16le')
+    idle_session.last_activity = time.monotonic() - 61
+
+    store.purge_idle()
+
+    assert store.get_session(idle_session.session_id) is None
+    assert store.get_session(active_session.session_id) is active_session
+    assert store.get_stats()['sessions'] == 1
+
+
+def test_get_live_session_store(monkeypatch):
+    monkeypatch.delenv('DECHORDER_LIVE_MAX_SESSIONS', raising=False)
+    assert sut.get_live_session_store() is None
+
+    monkeypatch.setenv('DECHORDER_LIVE_MAX_SESSIONS', '4')
+    monkeypatch.setenv('DECHORDER_LIVE_IDLE_TIMEOUT_SECONDS', '10')
+    store = sut.get_live_session_store()
+    assert store.max_sessions == 4
+    assert store.idle_timeout_seconds == 10
+
+
+@pytest.mark.usefixtures('clear_audio_decoder_cache')
+def test_compressed_live_audio_needs_ffmpeg(dummy_service, monkeypatch):
+    monkeypatch.setenv('DECHORDER_FFMPEG_PATH', '/nonexistent/ffmpeg')
+    store = sut.LiveSessionStore(max_sessions=1)
+
+    with pytest.raises(KnownRequestParseError):
+        store.create_session(dummy_service, 'mp3')
+    assert store.get_stats()['sessions'] == 0
+
+
+@pytest.mark.usefixtures('clear_audio_decoder_cache')
+def test_ffmpeg_live_session_matches_offline_recognition(saved_audio_file, embedded_service,
+                                                         ffmpeg_path, monkeypatch):
+    monkeypatch.setenv('DECHORDER_FFMPEG_PATH', ffmpeg_path)
+    store = sut.LiveSessionStore(max_sessions=1)
+    session = store.create_session(embedded_service, 'mp3')
+    with open(saved_audio_file, 'rb') as f:
+        content = f.read()
+
+    chords = replay(session, content, 1000)
+    chords += store.finish_session(session.session_id)
+
+    expected = recognize_saved_file(saved_audio_file, embedded_service)
+    assert [chord['name'] for chord in chords] == [chord['name'] for chord in expected]
+
+
+@pytest.mark.usefixtures('clear_audio_decoder_cache')
+def test_ffmpeg_live_session_rejects_invalid_audio(dummy_service, ffmpeg_path, monkeypatch):
+    monkeypatch.setenv('DECHORDER_FFMPEG_PATH', ffmpeg_path)
+    store = sut.LiveSessionStore(max_sessions=1)
+    session = store.create_session(dummy_service, 'mp3')
+    session.push(b'not an mp3 stream' * 100)
+
+    with pytest.raises(KnownRequestParseError):
+        store.finish_session(session.session_id)
+    assert store.get_session(session.session_id) is None
+
+
+def test_live_session_store_closes_idle_sessions_in_background(dummy_service):
+    store = sut.LiveSessionStore(max_sessions=1, idle_timeout_seconds=0.1)
+    session = store.create_session(dummy_service, 's16le')
+    with patch.object(session, 'close', wraps=session.close) as close:
+        time.sleep(0.5)
+        close.assert_called_once_with()
@@ -1,12 +1,28 @@
-from unittest.mock import patch
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
 
 import numpy as np
+import pandas as pd
 import pytest
+import requests
 
 import common.predictions as sut
+from common.features import ANALYSIS_PROFILES, DEFAULT_ANALYSIS_PROFILE, FEATURE_NAMES
+from common.predictions.batching import MicroBatchingPredictionService
+from common.predictions.cascade import CascadePredictionService
 from common.predictions.datarobot import DataRobotV1APIPredictionService
 from common.predictions.dummy import DummyPredictionService
-from common.predictions.embedded import EmbeddedPredictionService
+from common.predictions.embedded import (
+    EmbeddedPredictionService,
+    PICKLE_MODEL_FILENAME,
+    export_model,
+    load_pickled_model,
+)
+from common.predictions.mlp import MLP_PROBABILITY_TOLERANCE, MLP_STORAGE_DTYPES, NumpyMLPClassifier
+from common.predictions.template import CHORD_QUALITIES, TemplatePredictionService
 
 
 def test_prediction_service_dummy(prediction_payload, dummy_service):
@@ -18,6 +34,32 @@ def test_prediction_service_dummy(prediction_payload, dummy_service):
     assert np.allclose(preds['confidence'], expected_confidences, atol=1e-2)
 
 
+def test_prediction_service_dummy_feature_matrix(prediction_payload, dummy_service):
+    preds = dummy_service.predict(prediction_payload.values)
+    assert len(preds) == len(prediction_payload)
+    assert list(preds.columns) == ['name', 'confidence']
+
+
+def test_to_feature_frame(prediction_payload):
+    df = sut.to_feature_frame(prediction_payload.values)
+    assert list(df.columns) == list(prediction_payload.columns)
+    assert np.allclose(df.values, prediction_payload.values)
+
+
+def test_to_prediction_frame():
+    probabilities = np.array([[0.1, 0.7, 0.2], [0.5, 0.2, 0.3]])
+    df = sut.to_prediction_frame(probabilities, np.array(['C', 'Am', 'G']))
+    assert list(df.columns) == ['name', 'confidence']
+    assert list(df['name']) == ['Am', 'C']
+    assert np.allclose(df['confidence'], [0.7, 0.5])
+
+    df = sut.to_prediction_frame(probabilities, np.array(['C', 'Am', 'G']), top_k=2)
+    assert list(df['alternatives']) == [
+        [{'name': 'Am', 'confidence': 0.7}, {'name': 'G', 'confidence': 0.2}],
+        [{'name': 'C', 'confidence': 0.5}, {'name': 'G', 'confidence': 0.3}],
+    ]
+
+
 def test_prediction_service_datarobot_v1(prediction_payload, datarobot_v1_service):
     labels = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'Am']
     confidences = np.arange(0, len(labels)) * 0.1
@@ -45,6 +87,12 @@ def test_prediction_service_datarobot_v1(prediction_payload, datarobot_v1_servic
     expected_confidences = [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
     assert np.array_equal(preds['name'], expected_names)
     assert np.allclose(preds['confidence'], expected_confidences, atol=1e-2)
+    assert 'alternatives' not in preds
+
+    get_predictions_func = 'get_datarobot_predictions'
+    with patch.object(datarobot_v1_service, get_predictions_func, return_value=p.return_value):
+        preds = datarobot_v1_service.predict(prediction_payload, top_k=2)
+    assert [alt['name'] for alt in preds['alternatives'][0]] == ['Am', 'G']
 
 
 def test_prediction_service_embedded(prediction_payload, embedded_service):
@@ -60,6 +108,8 @@ def test_prediction_service_embedded(prediction_payload, embedded_service):
     ('DataRobotV1APIPredictionService', DataRobotV1APIPredictionService),
     ('DummyPredictionService', DummyPredictionService),
     ('EmbeddedPredictionService', EmbeddedPredictionService),
+    ('TemplatePredictionService', TemplatePredictionService),
+    ('CascadePredictionService', CascadePredictionService),
 ])
 def test_get_prediction_service(service_key, expected_type, monkeypatch):
     mock_env_vars = {
@@ -76,6 +126,338 @@ def test_get_prediction_service(service_key, expected_type, monkeypatch):
     assert isinstance(svc, expected_type)
 
 
+def test_get_prediction_service_template_fallback(tmp_path, monkeypatch):
+    monkeypatch.setenv('DECHORDER_EMBEDDED_MODEL_PATH', str(tmp_path / 'missing.npz'))
+    service = sut.get_prediction_service('EmbeddedPredictionService')
+    assert isinstance(service, EmbeddedPredictionService)
+
+    monkeypatch.setenv('DECHORDER_TEMPLATE_FALLBACK', '1')
+    service = sut.get_prediction_service('EmbeddedPredictionService')
+    assert isinstance(service, TemplatePredictionService)
+
+
 def test_get_prediction_service_unknown_key():
     with pytest.raises(ValueError, match='Unknown prediction service: IDoNotExistService'):
         sut.get_prediction_service('IDoNotExistService')
+
+
+@pytest.fixture
+def pickled_model():
+    return load_pickled_model(os.path.join('common', 'predictions', PICKLE_MODEL_FILENAME))
+
+
+@pytest.fixture
+def training_features():
+    df = pd.read_csv(os.path.join('..', 'data', 'featurized', 'major-minor.csv'))
+    return df.drop(columns='chord').values
+
+
+@pytest.mark.parametrize('dtype', MLP_STORAGE_DTYPES)
+def test_numpy_mlp_matches_sklearn(dtype, pickled_model, prediction_payload, training_features,
+                                   tmp_path):
+    features = np.vstack([prediction_payload.values, training_features])
+
+    model_path = str(tmp_path / f'model.{dtype}.npz')
+    NumpyMLPClassifier.from_sklearn(pickled_model).save(model_path, dtype=dtype)
+    model = NumpyMLPClassifier.load(model_path)
+
+    expected_proba = pickled_model.predict_proba(features)
+    max_difference = np.abs(model.predict_proba(features) - expected_proba).max()
+    assert max_difference <= MLP_PROBABILITY_TOLERANCE[dtype]
+    assert np.array_equal(model.predict(features), pickled_model.predict(features))
+
+
+def test_numpy_mlp_memory_maps_weights(embedded_service):
+    model = NumpyMLPClassifier.load(embedded_service.get_model_filename())
+    assert not model.weights[0].flags.owndata
+    assert not model.weights[0].flags.writeable
+
+    unmapped_model = NumpyMLPClassifier.load(embedded_service.get_model_filename(), mmap=False)
+    assert np.array_equal(model.predict_proba(np.eye(12)), unmapped_model.predict_proba(np.eye(12)))
+
+
+def test_numpy_mlp_rejects_unknown_format_version(embedded_service, tmp_path):
+    arrays = dict(np.load(embedded_service.get_model_filename()))
+    arrays['format_version'] = np.array(99)
+    model_path = str(tmp_path / 'model.npz')
+    np.savez(model_path, **arrays)
+    with pytest.raises(ValueError, match='Unsupported model format version 99'):
+        NumpyMLPClassifier.load(model_path)
+
+
+def test_embedded_model_records_analysis_profile(pickled_model, tmp_path):
+    # The bundled model predates analysis profiles and was trained with the default one.
+    expected_profile = ANALYSIS_PROFILES[DEFAULT_ANALYSIS_PROFILE]
+    assert EmbeddedPredictionService().get_analysis_profile() == expected_profile
+
+    model_path = str(tmp_path / 'model.npz')
+    export_model(pickled_model, model_path, analysis_profile='fast')
+    assert NumpyMLPClassifier.load(model_path).metadata['analysis_profile']['name'] == 'fast'
+
+    profile = EmbeddedPredictionService(model_path).get_analysis_profile()
+    assert profile.name == 'fast'
+    assert profile == ANALYSIS_PROFILES['fast']
+
+
+def test_prediction_service_embedded_alternatives(prediction_payload, embedded_service):
+    embedded_service.load_model_if_needed()
+    model = embedded_service.model
+    with patch.object(model, 'predict_proba', wraps=model.predict_proba) as p:
+        preds = embedded_service.predict(prediction_payload, top_k=3)
+
+    # Names, confidences and alternatives all come from a single forward pass.
+    assert p.call_count == 1
+    for _, row in preds.iterrows():
+        assert len(row['alternatives']) == 3
+        assert row['alternatives'][0] == {'name': row['name'], 'confidence': row['confidence']}
+        confidences = [alt['confidence'] for alt in row['alternatives']]
+        assert confidences == sorted(confidences, reverse=True)
+
+
+def test_prediction_service_embedded_int8(prediction_payload):
+    model_path = os.path.join('common', 'predictions', 'embedded_model.int8.npz')
+    service = EmbeddedPredictionService(model_path)
+    preds = service.predict(prediction_payload)
+    assert np.array_equal(preds['name'], ['D', 'D', 'D', 'Bm', 'E', 'E', 'E', 'Fm'])
+
+
+def test_prediction_service_embedded_pickle(prediction_payload):
+    model_path = os.path.join('common', 'predictions', PICKLE_MODEL_FILENAME)
+    service = EmbeddedPredictionService(model_path)
+    preds = service.predict(prediction_payload)
+    assert np.array_equal(preds['name'], ['D', 'D', 'D', 'Bm', 'E', 'E', 'E', 'Fm'])
+
+
+def test_prediction_service_template(prediction_payload):
+    preds = TemplatePredictionService().predict(prediction_payload)
+    assert np.array_equal(preds['name'], ['D', 'D', 'D', 'D', 'E', 'E', 'E', 'B'])
+    assert np.all(preds['confidence'] > 0.8)
+
+
+def test_prediction_service_template_ideal_chords():
+    service = TemplatePredictionService(qualities=list(CHORD_QUALITIES))
+    chroma = np.zeros((len(service.chord_names), 12))
+    for i, name in enumerate(service.chord_names):
+        chroma[i] = service.templates[:, i] > 0
+
+    preds = service.predict(chroma, top_k=2)
+    assert np.array_equal(preds['name'], service.chord_names)
+    assert all(len(alternatives) == 2 for alternatives in preds['alternatives'])
+
+
+def test_prediction_service_template_training_accuracy():
+    df = pd.read_csv(os.path.join('..', 'data', 'featurized', 'major-minor.csv'))
+    preds = TemplatePredictionService().predict(df)
+    assert np.mean(preds['name'] == df['chord']) > 0.95
+
+
+def make_datarobot_response(status_code, labels=None):
+    response = Mock(status_code=status_code, text='error')
+    response.json.return_value = {
+        'data': [
+            {
+                'rowId': i,
+                'prediction': label,
+                'predictionValues': [{'label': label, 'value': 0.9}],
+            }
+            for i, label in enumerate(labels or [])
+        ]
+    }
+    return response
+
+
+def test_prediction_service_datarobot_v1_batches(prediction_payload, datarobot_v1_service):
+    datarobot_v1_service.max_rows_per_request = 3
+    datarobot_v1_service.session = Mock()
+
+    def post(url, data, headers, timeout):
+        df = pd.read_csv(io.BytesIO(data))
+        assert list(df.columns) == list(prediction_payload.columns)
+        assert headers['Content-Type'].startswith('text/csv')
+        return make_datarobot_response(200, [str(round(value, 6)) for value in df['chroma-C']])
+
+    datarobot_v1_service.session.post.side_effect = post
+    preds = datarobot_v1_service.predict(prediction_payload)
+
+    assert datarobot_v1_service.session.post.call_count == 3
+    expected_names = [str(round(value, 6)) for value in prediction_payload['chroma-C']]
+    assert list(preds['name']) == expected_names
+
+
+def test_prediction_service_datarobot_v1_retries(prediction_payload, datarobot_v1_service):
+    datarobot_v1_service.backoff_seconds = 0
+    datarobot_v1_service.payload_format = 'json'
+    datarobot_v1_service.session = Mock()
+    datarobot_v1_service.session.post.side_effect = [
+        requests.ConnectionError('Connection reset'),
+        make_datarobot_response(503),
+        make_datarobot_response(200, ['C'] * len(prediction_payload)),
+    ]
+
+    preds = datarobot_v1_service.predict(prediction_payload)
+    assert list(preds['name']) == ['C'] * len(prediction_payload)
+    assert datarobot_v1_service.session.post.call_count == 3
+
+
+@pytest.mark.parametrize('status_code, expected_calls', [(400, 1), (503, 4)])
+def test_prediction_service_datarobot_v1_errors(status_code, expected_calls, prediction_payload,
+                                                datarobot_v1_service):
+    datarobot_v1_service.backoff_seconds = 0
+    datarobot_v1_service.session = Mock()
+    datarobot_v1_service.session.post.return_value = make_datarobot_response(status_code)
+
+    with pytest.raises(sut.PredictionError, match='error'):
+        datarobot_v1_service.predict(prediction_payload)
+    assert datarobot_v1_service.session.post.call_count == expected_calls
+
+
+class RecordingPredictionService(sut.PredictionService):
+    def __init__(self, delay_seconds=0):
+        self.delay_seconds = delay_seconds
+        self.batch_sizes = []
+
+    def predict(self, df, top_k=0):
+        time.sleep(self.delay_seconds)
+        self.batch_sizes.append(len(df))
+        df_predictions = pd.DataFrame({
+            'name': df['chroma-C'].astype(str),
+            'confidence': df['chroma-D'],
+        })
+        if top_k:
+            df_predictions['alternatives'] = [
+                [{'name': f'{name}/{j}', 'confidence': 0.0} for j in range(top_k)]
+                for name in df_predictions['name']
+            ]
+        return df_predictions
+
+
+def test_micro_batching_routes_slices_to_callers():
+    service = RecordingPredictionService(delay_seconds=0.05)
+    batching_service = MicroBatchingPredictionService(
+        service,
+        max_batch_rows=100,
+        max_wait_seconds=0.2,
+    )
+    payloads = [
+        pd.DataFrame(np.full((n_rows, 12), i, dtype=float), columns=FEATURE_NAMES)
+        for i, n_rows in enumerate([3, 1, 4, 1, 5])
+    ]
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        results = list(executor.map(batching_service.predict, payloads))
+
+    for i, (payload, preds) in enumerate(zip(payloads, results)):
+        assert list(preds['name']) == [str(float(i))] * len(payload)
+        assert list(preds.index) == list(range(len(payload)))
+
+    # All concurrent calls fit in one batch.
+    assert service.batch_sizes == [14]
+    stats = batching_service.get_stats()
+    assert stats['batches'] == 1
+    assert stats['requests'] == 5
+    assert {'upperBound': 16, 'count': 1} in stats['batchRowsHistogram']
+    assert sum(bucket['count'] for bucket in stats['waitMsHistogram']) == 5
+
+
+def test_micro_batching_trims_alternatives_per_caller():
+    service = RecordingPredictionService(delay_seconds=0.05)
+    batching_service = MicroBatchingPredictionService(
+        service,
+        max_batch_rows=100,
+        max_wait_seconds=0.2,
+    )
+    top_ks = [0, 3, 1]
+    payload = pd.DataFrame(np.zeros((2, 12)), columns=FEATURE_NAMES)
+
+    def predict(top_k):
+        return batching_service.predict(payload, top_k=top_k)
+
+    with ThreadPoolExecutor(max_workers=len(top_ks)) as executor:
+        results = list(executor.map(predict, top_ks))
+
+    assert service.batch_sizes == [6]
+    assert 'alternatives' not in results[0]
+    assert [len(alternatives) for alternatives in results[1]['alternatives']] == [3, 3]
+    assert [len(alternatives) for alternatives in results[2]['alternatives']] == [1, 1]
+
+
+def test_micro_batching_respects_max_batch_rows():
+    service = RecordingPredictionService()
+    batching_service = MicroBatchingPredictionService(
+        service,
+        max_batch_rows=4,
+        max_wait_seconds=0.2,
+    )
+    payloads = [pd.DataFrame(np.zeros((3, 12)), columns=FEATURE_NAMES) for _ in range(3)]
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        list(executor.map(batching_service.predict, payloads))
+    assert service.batch_sizes == [3, 3, 3]
+
+    # Large calls bypass batching.
+    batching_service.predict(pd.DataFrame(np.zeros((10, 12)), columns=FEATURE_NAMES))
+    assert service.batch_sizes[-1] == 10
+    assert batching_service.get_stats()['batches'] == 3
+
+
+def test_micro_batching_propagates_errors():
+    service = Mock(spec=sut.PredictionService)
+    service.predict.side_effect = sut.PredictionError('Boo!')
+    batching_service = MicroBatchingPredictionService(service, max_wait_seconds=0.001)
+
+    with pytest.raises(sut.PredictionError, match='Boo!'):
+        batching_service.predict(np.zeros((2, 12)))
+
+
+class FixedPredictionService(sut.PredictionService):
+    def __init__(self, name, confidences):
+        self.name = name
+        self.confidences = confidences
+        self.predicted_rows = []
+
+    def predict(self, df, top_k=0):
+        self.predicted_rows.append(df['chroma-C'].tolist())
+        df_predictions = pd.DataFrame({'name': self.name, 'confidence': self.confidences[:len(df)]})
+        if top_k:
+            df_predictions['alternatives'] = [[{'name': self.name, 'confidence': 1.0}]] * len(df)
+        return df_predictions
+
+
+def test_cascade_escalates_low_confidence_rows():
+    fast_service = FixedPredictionService('fast', [0.9, 0.5, 0.95, 0.1])
+    accurate_service = FixedPredictionService('accurate', [0.99, 0.98])
+    service = CascadePredictionService(fast_service, accurate_service, confidence_threshold=0.8)
+    payload = pd.DataFrame(np.arange(48).reshape(4, 12), columns=FEATURE_NAMES)
+
+    preds = service.predict(payload, top_k=1)
+    assert list(preds['name']) == ['fast', 'accurate', 'fast', 'accurate']
+    assert np.allclose(preds['confidence'], [0.9, 0.99, 0.95, 0.98])
+    top_names = [alternatives[0]['name'] for alternatives in preds['alternatives']]
+    assert top_names == list(preds['name'])
+
+    # Only the low-confidence rows are sent to the accurate service.
+    assert accurate_service.predicted_rows == [[12, 36]]
+    assert service.get_stats()['escalationRate'] == 0.5
+
+
+def test_cascade_skips_accurate_service_when_confident():
+    fast_service = FixedPredictionService('fast', [0.9, 0.95])
+    accurate_service = Mock(spec=sut.PredictionService)
+    service = CascadePredictionService(fast_service, accurate_service, confidence_threshold=0.8)
+
+    preds = service.predict(np.zeros((2, 12)))
+    assert list(preds['name']) == ['fast', 'fast']
+    accurate_service.predict.assert_not_called()
+
+
+def test_cascade_rejects_mismatched_analysis_profiles():
+    fast_service = Mock(spec=sut.PredictionService)
+    fast_service.get_analysis_profile.return_value = ANALYSIS_PROFILES['fast']
+    accurate_service = Mock(spec=sut.PredictionService)
+    accurate_service.get_analysis_profile.return_value = None
+    service = CascadePredictionService(fast_service, accurate_service)
+    assert service.get_analysis_profile() == ANALYSIS_PROFILES['fast']
+
+    accurate_service.get_analysis_profile.return_value = ANALYSIS_PROFILES['accurate']
+    with pytest.raises(sut.PredictionError, match='analysis profile'):
+        service.get_analysis_profile()
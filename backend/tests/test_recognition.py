@@ -1,6 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import Mock, patch
+
+import numpy as np
 import pytest
 
 import common.recognition as sut
+from common.caching import FrameFeatureCache, RecognitionResultCache
+from common.features import get_featurization_engine
+from common.predictions.dummy import DummyPredictionService
 from common.utilities import KnownRequestParseError
 
 
@@ -21,3 +28,179 @@ def test_recognize_file(saved_audio_file, dummy_service):
     assert len(chords) == 6
     for chord in chords:
         assert set(chord.keys()) == {'timeOffset', 'name', 'confidence'}
+
+
+def test_recognize_file_streaming(saved_audio_file, dummy_service):
+    chords = sut.recognize_saved_file(saved_audio_file, dummy_service, streaming=True)
+    assert len(chords) == 6
+    for chord in chords:
+        assert set(chord.keys()) == {'timeOffset', 'name', 'confidence'}
+
+
+def test_recognize_file_alternatives(saved_audio_file, embedded_service):
+    chords = sut.recognize_saved_file(saved_audio_file, embedded_service, top_k=3)
+    for chord in chords:
+        assert set(chord.keys()) == {'timeOffset', 'name', 'confidence', 'alternatives'}
+        assert len(chord['alternatives']) == 3
+        assert chord['alternatives'][0]['name'] == chord['name']
+
+
+def test_recognize_file_cached(saved_audio_file, dummy_service):
+    cache = RecognitionResultCache()
+    chords = sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache)
+    cached_chords = sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache)
+    assert cached_chords == chords
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_recognize_file_with_frame_cache(tmp_path, saved_audio_file, dummy_service):
+    frame_cache = FrameFeatureCache(str(tmp_path))
+    sut.recognize_saved_file(saved_audio_file, dummy_service, frame_cache=frame_cache)
+    chords = sut.recognize_saved_file(saved_audio_file, dummy_service, frame_cache=frame_cache)
+    assert len(chords) == 6
+    assert frame_cache.get_stats() == {'hits': 1, 'misses': 1}
+
+
+@pytest.mark.parametrize('batch_seconds', [1, 3, 30])
+def test_iter_recognized_chords(saved_audio_file, embedded_service, batch_seconds):
+    batches = list(sut.iter_recognized_chords(saved_audio_file, embedded_service,
+                                              batch_seconds=batch_seconds))
+
+    # Repeating chords are removed across batches too.
+    assert len(batches) == int(np.ceil(8 / batch_seconds))
+    expected_chords = sut.recognize_saved_file(saved_audio_file, embedded_service)
+    assert [chord for chords in batches for chord in chords] == expected_chords
+
+
+def test_iter_recognized_chords_errors_on_first_batch(saved_non_audio_file, dummy_service):
+    batches = sut.iter_recognized_chords(saved_non_audio_file, dummy_service)
+    with pytest.raises(KnownRequestParseError, match='Cannot load audio file'):
+        next(batches)
+
+
+def test_iter_recognized_chords_cached(saved_audio_file, dummy_service):
+    cache = RecognitionResultCache()
+    batches = list(sut.iter_recognized_chords(saved_audio_file, dummy_service, cache=cache,
+                                              batch_seconds=3))
+    cached_batches = list(sut.iter_recognized_chords(saved_audio_file, dummy_service, cache=cache,
+                                                     batch_seconds=3))
+
+    assert cached_batches == [[chord for chords in batches for chord in chords]]
+    assert cache.get_stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('use_process_pool', [False, True])
+def test_recognize_files(saved_audio_file, nonexistent_audio_file, use_process_pool):
+    paths = [saved_audio_file, nonexistent_audio_file, saved_audio_file]
+    service = DummyPredictionService()
+    predict = Mock(wraps=service.predict)
+
+    with patch.object(service, 'predict', predict):
+        if use_process_pool:
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                results = sut.recognize_saved_files(paths, service, executor=executor)
+        else:
+            results = sut.recognize_saved_files(paths, service)
+
+    assert predict.call_count == 1
+    assert len(predict.call_args[0][0]) == 12
+    assert len(results) == 3
+    assert 'No such file or directory' in results[1]['error']
+    for result in [results[0], results[2]]:
+        assert [chord['timeOffset'] for chord in result['chords']][0] == 0.0
+        for chord in result['chords']:
+            assert set(chord.keys()) == {'timeOffset', 'name', 'confidence'}
+
+
+def test_resolve_analysis_profile(monkeypatch, dummy_service, embedded_service):
+    monkeypatch.setenv('DECHORDER_ANALYSIS_PROFILE', 'fast')
+    assert sut.resolve_analysis_profile(dummy_service).name == 'fast'
+    assert sut.resolve_analysis_profile(dummy_service, 'accurate').name == 'accurate'
+
+    # The profile recorded with the model wins over the configured default.
+    assert sut.resolve_analysis_profile(embedded_service).name == 'balanced'
+    with pytest.raises(KnownRequestParseError, match='does not match the prediction model'):
+        sut.resolve_analysis_profile(embedded_service, 'fast')
+    with pytest.raises(KnownRequestParseError, match='Unknown analysis profile: turbo'):
+        sut.resolve_analysis_profile(dummy_service, 'turbo')
+
+
+def test_recognize_file_cached_per_analysis_profile(saved_audio_file, dummy_service):
+    cache = RecognitionResultCache()
+    sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache, analysis_profile='fast')
+    sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache,
+                             analysis_profile='balanced')
+    sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache, analysis_profile='fast')
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 2
+
+
+def test_recognize_file_float32_featurization(monkeypatch, saved_audio_file, embedded_service):
+    expected_chords = sut.recognize_saved_file(saved_audio_file, embedded_service)
+
+    monkeypatch.setenv('DECHORDER_FEATURIZATION_ENGINE', 'float32')
+    get_featurization_engine.cache_clear()
+    try:
+        chords = sut.recognize_saved_file(saved_audio_file, embedded_service)
+    finally:
+        get_featurization_engine.cache_clear()
+
+    assert [chord['name'] for chord in chords] == [chord['name'] for chord in expected_chords]
+    expected_time_offsets = [chord['timeOffset'] for chord in expected_chords]
+    assert [chord['timeOffset'] for chord in chords] == expected_time_offsets
+    expected_confidences = [chord['confidence'] for chord in expected_chords]
+    assert np.allclose([chord['confidence'] for chord in chords], expected_confidences)
+
+
+def test_find_stable_segments():
+    features = np.array([
+        [1.0, 0.0, 0.0],
+        [0.9, 0.1, 0.0],
+        [0.0, 1.0, 0.0],
+        [0.0, 1.0, 0.1],
+        [1.0, 0.0, 0.0],
+    ])
+    assert list(sut.find_stable_segments(features, 0.05)) == [0, 0, 1, 1, 2]
+    assert list(sut.find_stable_segments(features, 0.001)) == [0, 1, 2, 3, 4]
+
+
+def test_get_segment_representatives():
+    features = np.array([[1.0, 0.0], [0.8, 0.2], [0.0, 1.0]])
+    representatives, segment_ids = sut.get_segment_representatives(features, 0.1)
+    assert np.allclose(representatives, [[0.9, 0.1], [0.0, 1.0]])
+    assert list(segment_ids) == [0, 0, 1]
+
+    representatives, segment_ids = sut.get_segment_representatives(features, 0)
+    assert representatives is features
+    assert list(segment_ids) == [0, 1, 2]
+
+
+def test_recognize_file_change_gating(saved_audio_file, embedded_service):
+    predict = Mock(wraps=embedded_service.predict)
+    with patch.object(embedded_service, 'predict', predict):
+        chords = sut.recognize_saved_file(saved_audio_file, embedded_service,
+                                          change_threshold=0.05, top_k=2)
+
+    # The recording has two stable chords: only one row per chord is predicted.
+    assert len(predict.call_args[0][0]) == 2
+    assert [chord['name'] for chord in chords] == ['D', 'E']
+    assert [chord['timeOffset'] for chord in chords] == [0.0, 4.0]
+    assert all(len(chord['alternatives']) == 2 for chord in chords)
+
+
+def test_recognize_files_change_gating(saved_audio_file, embedded_service):
+    results = sut.recognize_saved_files([saved_audio_file, saved_audio_file], embedded_service,
+                                        change_threshold=0.05)
+    expected_chords = sut.recognize_saved_file(saved_audio_file, embedded_service,
+                                               change_threshold=0.05)
+    assert [result['chords'] for result in results] == [expected_chords, expected_chords]
+
+
+def test_recognize_in_memory_content(saved_audio_file, dummy_service):
+    with open(saved_audio_file, 'rb') as fp:
+        content = fp.read()
+    cache = RecognitionResultCache(max_entries=4)
+    chords = sut.recognize_saved_file(content, dummy_service, cache=cache)
+    assert chords == sut.recognize_saved_file(saved_audio_file, dummy_service, cache=cache)
+    assert cache.get_stats()['hits'] == 1
@@ -0,0 +1,135 @@
+import os
+import time
+
+import pytest
+
+import common.tracing as sut
+from common.recognition import recognize_saved_file
+
+
+@pytest.fixture
+def trace():
+    trace, token = sut.start_trace()
+    yield trace
+    sut.end_trace(token)
+
+
+def test_trace_stage_without_trace():
+    assert sut.get_current_trace() is None
+    with sut.trace_stage('decode') as stage:
+        assert stage is None
+
+
+def test_trace_stage(trace):
+    with sut.trace_stage('decode'):
+        time.sleep(0.01)
+    with sut.trace_stage('stft'):
+        pass
+    with sut.trace_stage('decode'):
+        time.sleep(0.01)
+
+    assert sut.get_current_trace() is trace
+    assert list(trace.stages) == ['decode', 'stft']
+    assert trace.stages['decode'] >= 0.02
+    assert trace.get_total_seconds() >= sum(trace.stages.values())
+
+
+def test_trace_nested_stages(trace):
+    with sut.trace_stage('stft'):
+        with sut.trace_stage('rms'):
+            time.sleep(0.01)
+
+    # Only the outermost stage is timed.
+    assert list(trace.stages) == ['stft']
+    assert trace.stages['stft'] >= 0.01
+
+
+def test_trace_stage_exception(trace):
+    with pytest.raises(ValueError):
+        with sut.trace_stage('decode'):
+            raise ValueError('Boo!')
+
+    with sut.trace_stage('stft'):
+        pass
+    assert list(trace.stages) == ['decode', 'stft']
+
+
+def test_end_trace():
+    trace, token = sut.start_trace()
+    sut.end_trace(token)
+    assert sut.get_current_trace() is None
+    with sut.trace_stage('decode'):
+        pass
+    assert not trace.stages
+
+
+def test_traced_iter(trace):
+    def produce():
+        for i in range(3):
+            time.sleep(0.01)
+            yield i
+
+    assert list(sut.traced_iter('decode', produce())) == [0, 1, 2]
+    assert trace.stages['decode'] >= 0.03
+
+
+def test_trace_output(trace):
+    trace.add('decode', 0.0125)
+    trace.add('predict', 0.5)
+    trace.add('decode', 0.0125)
+
+    server_timing = trace.to_server_timing().split(', ')
+    assert server_timing[:2] == ['decode;dur=25.000', 'predict;dur=500.000']
+    assert server_timing[2].startswith('total;dur=')
+
+    log_fields = trace.to_log_fields()
+    assert log_fields['stagesMs'] == {'decode': 25.0, 'predict': 500.0}
+    assert log_fields['totalMs'] >= 0
+
+
+def test_trace_aggregator():
+    aggregator = sut.TraceAggregator(history_size=2)
+    for seconds in [0.1, 0.2, 0.3]:
+        trace = sut.Trace('recognize')
+        trace.add('predict', seconds)
+        aggregator.add(trace)
+    trace = sut.Trace('recognize')
+    trace.add('decode', 0.05)
+    aggregator.add(trace)
+    aggregator.add(sut.Trace('live'))
+
+    stats = aggregator.get_stats()
+    assert set(stats) == {'recognize', 'live'}
+    assert stats['live']['requests'] == 1
+    assert list(stats['live']['stages']) == ['total']
+
+    stats = stats['recognize']
+    assert stats['requests'] == 4
+    assert set(stats['stages']) == {'predict', 'decode', 'total'}
+    assert stats['stages']['total']['requests'] == 4
+
+    predict_stats = stats['stages']['predict']
+    assert predict_stats['requests'] == 3
+    assert predict_stats['meanMs'] == pytest.approx(200)
+    assert predict_stats['maxMs'] == pytest.approx(300)
+    # Percentiles only cover the most recent durations.
+    assert predict_stats['p50Ms'] == pytest.approx(250)
+
+
+def test_get_trace_aggregator(monkeypatch):
+    monkeypatch.delitem(os.environ, 'DECHORDER_TRACING', raising=False)
+    assert sut.get_trace_aggregator() is None
+
+    monkeypatch.setitem(os.environ, 'DECHORDER_TRACING', '1')
+    assert isinstance(sut.get_trace_aggregator(), sut.TraceAggregator)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_trace_recognition_stages(saved_audio_file, dummy_service, trace, streaming):
+    recognize_saved_file(saved_audio_file, dummy_service, streaming=streaming)
+    expected_stages = {
+        'decode', 'stft', 'rms', 'tuning', 'chroma', 'chunking', 'silence',
+        'predict', 'postprocess',
+    }
+    assert expected_stages <= set(trace.stages)
+    assert trace.get_total_seconds() >= sum(trace.stages.values())
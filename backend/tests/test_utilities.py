@@ -1,3 +1,4 @@
+import base64
 import tempfile
 import os
 
@@ -55,3 +56,59 @@ def test_extract_file_invalid_extension(valid_headers, body_with_valid_audio_fil
     msg = r'Only the following file extensions are supported: \.wav, \.mp3, \.m4a'
     with pytest.raises(sut.KnownRequestParseError, match=msg):
         sut.extract_file_from_http_request(valid_headers, body, upload_dir)
+
+
+def test_extract_file_in_memory(valid_headers, body_with_valid_audio_file, saved_audio_file):
+    file = sut.extract_file_from_http_request(valid_headers, body_with_valid_audio_file)
+    assert file.stored_filename is None
+    with open(saved_audio_file, 'rb') as f:
+        assert file.content == f.read()
+    assert file.source is file.content
+
+
+def test_extract_file_preserves_crlf_in_content(valid_headers, boundary):
+    content = b'RIFF\r\n\r\n\r\n\x00\r\n--not-a-boundary\r\n'
+    body = b'--' + boundary + b'\r\n'
+    body += b'Content-Disposition: form-data; name="audio-file"; filename="crlf.wav"\r\n'
+    body += b'Content-Type: audio/wav\r\n\r\n'
+    body += content + b'\r\n--' + boundary + b'--\r\n'
+
+    file = sut.extract_file_from_http_request(valid_headers, body)
+    assert isinstance(file.content, memoryview)
+    assert file.content.tobytes() == content
+    assert file.mime_type == 'audio/wav'
+
+
+def test_extract_file_skips_other_fields(valid_headers, boundary, body_with_valid_audio_file):
+    other_field = b'--' + boundary + b'\r\n'
+    other_field += b'Content-Disposition: form-data; name="comment"\r\n\r\n'
+    other_field += b'hello\r\n'
+
+    body = other_field + body_with_valid_audio_file
+    file = sut.extract_file_from_http_request(valid_headers, body)
+    assert file.original_filename == 'd-e-jazz.mp3'
+
+
+@pytest.mark.parametrize('chunk_size', [4, 8, 1024])
+def test_decode_base64_body(chunk_size, body_with_valid_audio_file):
+    for body in [b'', b'a', b'ab', b'abc', body_with_valid_audio_file]:
+        encoded_body = base64.b64encode(body).decode('utf-8')
+        assert sut.decode_base64_body(encoded_body, chunk_size) == body
+        assert sut.decode_base64_body(encoded_body.encode('utf-8'), chunk_size) == body
+
+
+def test_decode_base64_body_malformed():
+    with pytest.raises(sut.KnownRequestParseError, match='Malformed base64-encoded request body'):
+        sut.decode_base64_body('abcde')
+
+
+@pytest.mark.parametrize('value, expected', [(None, 0), ('', 0), ('0', 0), ('3', 3)])
+def test_parse_alternatives_count(value, expected):
+    assert sut.parse_alternatives_count(value) == expected
+
+
+@pytest.mark.parametrize('value', ['-1', '6', 'many'])
+def test_parse_alternatives_count_invalid(value):
+    msg = 'Expected "alternatives" to be an integer'
+    with pytest.raises(sut.KnownRequestParseError, match=msg):
+        sut.parse_alternatives_count(value)
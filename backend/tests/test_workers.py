@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import common.workers as sut
+from common.utilities import KnownRequestParseError
+
+
+def wait_for_stats(worker_pool, **expected_stats):
+    # Done callbacks may run shortly after the result becomes available.
+    for _ in range(100):
+        stats = worker_pool.get_stats()
+        if all(stats[key] == value for key, value in expected_stats.items()):
+            return stats
+        time.sleep(0.01)
+    return worker_pool.get_stats()
+
+
+@pytest.fixture
+def worker_pool():
+    pool = sut.RecognitionWorkerPool('DummyPredictionService', max_workers=1, max_queue_size=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_pool_recognize(worker_pool, saved_audio_file):
+    chords = worker_pool.recognize(saved_audio_file)
+    assert len(chords) == 6
+    for chord in chords:
+        assert set(chord.keys()) == {'timeOffset', 'name', 'confidence'}
+    assert wait_for_stats(worker_pool, completed=1)['completed'] == 1
+
+
+def test_worker_pool_propagates_errors(worker_pool, nonexistent_audio_file):
+    with pytest.raises(KnownRequestParseError, match='No such file or directory'):
+        worker_pool.recognize(nonexistent_audio_file)
+
+
+def test_worker_pool_rejects_when_queue_is_full(worker_pool, saved_audio_file):
+    futures = [worker_pool.submit(saved_audio_file) for _ in range(2)]
+    stats = worker_pool.get_stats()
+    assert stats['busyWorkers'] == 1
+    assert stats['queueDepth'] == 1
+    assert stats['utilization'] == 1.0
+
+    with pytest.raises(sut.WorkerPoolBusyError):
+        worker_pool.submit(saved_audio_file)
+
+    for future in futures:
+        future.result()
+    stats = wait_for_stats(worker_pool, completed=2)
+    assert stats['rejected'] == 1
+    assert stats['completed'] == 2
+    assert stats['queueDepth'] == 0